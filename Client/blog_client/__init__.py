@@ -0,0 +1,17 @@
+"""
+    Python client for the blog api, with a blocking ('BlogClient') and an asyncio
+    ('AsyncBlogClient') version of the same methods.
+
+    Usage example:
+        from blog_client import BlogClient
+
+        with BlogClient('http://localhost:8000/') as client:
+            client.login('aaa', 'bbbbbb')
+            postId = client.addPost('The title.', 'The body message.')
+            posts = client.getPosts(range(1, 100), concurrency=8)
+"""
+from .common import BlogApiError
+from .client import BlogClient
+from .async_client import AsyncBlogClient
+
+__all__ = ['BlogApiError', 'BlogClient', 'AsyncBlogClient']
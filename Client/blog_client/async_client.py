@@ -0,0 +1,164 @@
+"""
+    Asyncio client for the blog api, built on an 'aiohttp' session (the 'aiohttp'
+    package is only needed for this client).
+
+    Usage example:
+        async with AsyncBlogClient('http://localhost:8000/') as client:
+            await client.login('aaa', 'bbbbbb')
+            posts = await client.getPosts(range(1, 100), concurrency=16)
+"""
+import asyncio
+from urllib.parse import urljoin
+
+try:
+    import aiohttp
+
+except ImportError:
+    aiohttp = None
+
+from .common import URL, RETRY_STATUSES, Routes, decodeResponse, getResult, isInvalidToken, queryParameters, retryDelay
+
+
+class AsyncBlogClient(Routes):
+    """
+        Same as 'BlogClient', but the route methods are coroutines.
+        The session is opened with the first request, and needs to be closed with 'close()' (or by using the client with 'async with').
+    """
+
+    def __init__(self, url=URL, username=None, password=None, namespace=None, poolSize=10, timeout=10, retries=2):
+        if aiohttp is None:
+            raise ImportError("The async client needs the 'aiohttp' package.")
+
+        self.url = url
+        self.username = username
+        self.password = password
+        self.token = None
+        self.poolSize = poolSize
+        self.timeout = timeout
+        self.retries = retries
+        self.headers = {} if namespace is None else {'X-Namespace': namespace}
+        self.session = None
+        self.tokenLock = asyncio.Lock()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def getSession(self):
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.poolSize),
+                timeout=aiohttp.ClientTimeout(total=self.timeout),
+                headers=self.headers)
+
+        return self.session
+
+    async def send(self, path, data=None, params=None):
+        """
+            Make a GET request if 'data' is not passed.
+            Otherwise do a POST request with the given 'data' dictionary.
+            Returns the status code and the decoded json.
+        """
+        completeUrl = urljoin(self.url, path)
+        method = 'GET' if data is None else 'POST'
+        data = None if data is None else queryParameters(data)
+
+        for attempt in range(self.retries + 1):
+            async with self.getSession().request(method, completeUrl, data=data, params=queryParameters(params)) as r:
+                status = r.status
+                text = await r.text()
+
+            if status in RETRY_STATUSES and attempt < self.retries:
+                await asyncio.sleep(retryDelay(r.headers))
+                continue
+
+            return status, decodeResponse(status, text)
+
+    async def request(self, path, data=None, params=None):
+        """
+            Same as 'send()', but only returns the json (whether the request was successful or not).
+        """
+        return (await self.send(path, data, params))[1]
+
+    async def getToken(self):
+        async with self.tokenLock:
+            if self.token is None:
+                await self.login()
+
+            return self.token
+
+    async def refreshToken(self, staleToken):
+        """
+            Log in again, unless another task already replaced the 'staleToken'.
+        """
+        async with self.tokenLock:
+            if self.token == staleToken:
+                await self.login()
+
+            return self.token
+
+    async def _call(self, path, data=None, params=None, token=False, result=None, allowMissing=False):
+        if not token:
+            status, response = await self.send(path, data, params)
+            return getResult(status, response, result, allowMissing)
+
+        sentToken = await self.getToken()
+        status, response = await self.send(path, {**data, 'token': sentToken}, params)
+
+        if isInvalidToken(status, response):
+            status, response = await self.send(path, {**data, 'token': await self.refreshToken(sentToken)}, params)
+
+        return getResult(status, response, result, allowMissing)
+
+    async def iterUsers(self, limit=1000):
+        """
+            All the usernames (in alphabetical order), fetched a page at a time.
+        """
+        cursor = None
+
+        while True:
+            users, cursor = await self.getUsers(limit, cursor)
+
+            for username in users:
+                yield username
+
+            if cursor is None:
+                return
+
+    async def iterPostIds(self, limit=1000):
+        """
+            All the post ids (in ascending order), fetched a page at a time.
+        """
+        cursor = None
+
+        while True:
+            ids, cursor = await self.getPostIds(limit, cursor)
+
+            for blogId in ids:
+                yield blogId
+
+            if cursor is None:
+                return
+
+    async def getPosts(self, ids, concurrency=8):
+        """
+            Get many posts with concurrent '/blog/get/:blogId' requests, with at most 'concurrency' of them at the same time.
+            Returns a dictionary of id -> post, the posts that don't exist are not included.
+        """
+        ids = list(ids)
+        semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+        async def getPost(blogId):
+            async with semaphore:
+                return await self.getPost(blogId)
+
+        posts = await asyncio.gather(*(getPost(blogId) for blogId in ids))
+
+        return {blogId: post for blogId, post in zip(ids, posts) if post is not None}
@@ -0,0 +1,147 @@
+"""
+    Blocking client for the blog api, built on a 'requests' session.
+
+    The connections are kept open between requests, in a pool shared by all the
+    threads that use the same client.
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from .common import URL, RETRY_STATUSES, Routes, decodeResponse, getResult, isInvalidToken, queryParameters, retryDelay
+
+
+class BlogClient(Routes):
+    """
+        The route methods (see 'Routes') raise 'BlogApiError' when a request isn't successful.
+        The routes that need a token log in with the last credentials used (in 'createUser()' / 'login()' / etc), and log in again when the token expires.
+
+        'poolSize' is the maximum number of open connections (the threads wait for a free one instead of opening more).
+        'retries' is how many times a request is made again after a '429 Too Many Requests' / '503 Service Unavailable'.
+    """
+
+    def __init__(self, url=URL, username=None, password=None, namespace=None, poolSize=10, timeout=10, retries=2):
+        self.url = url
+        self.username = username
+        self.password = password
+        self.token = None
+        self.timeout = timeout
+        self.retries = retries
+        self.tokenLock = threading.Lock()
+
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=poolSize, pool_block=True)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+        if namespace is not None:
+            self.session.headers['X-Namespace'] = namespace
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        self.session.close()
+
+    def send(self, path, data=None, params=None):
+        """
+            Make a GET request if 'data' is not passed.
+            Otherwise do a POST request with the given 'data' dictionary.
+            Returns the status code and the decoded json.
+        """
+        completeUrl = urljoin(self.url, path)
+        method = 'GET' if data is None else 'POST'
+
+        for attempt in range(self.retries + 1):
+            r = self.session.request(method, completeUrl, data=data, params=queryParameters(params), timeout=self.timeout)
+
+            if r.status_code in RETRY_STATUSES and attempt < self.retries:
+                time.sleep(retryDelay(r.headers))
+                continue
+
+            return r.status_code, decodeResponse(r.status_code, r.text)
+
+    def request(self, path, data=None, params=None):
+        """
+            Same as 'send()', but only returns the json (whether the request was successful or not).
+        """
+        return self.send(path, data, params)[1]
+
+    def getToken(self):
+        """
+            The current token, logs in first if there's none yet.
+        """
+        with self.tokenLock:
+            if self.token is None:
+                self.login()
+
+            return self.token
+
+    def refreshToken(self, staleToken):
+        """
+            Log in again, unless another thread already replaced the 'staleToken' (logging in is slow on purpose, so it's done only once).
+        """
+        with self.tokenLock:
+            if self.token == staleToken:
+                self.login()
+
+            return self.token
+
+    def _call(self, path, data=None, params=None, token=False, result=None, allowMissing=False):
+        if not token:
+            status, response = self.send(path, data, params)
+            return getResult(status, response, result, allowMissing)
+
+        sentToken = self.getToken()
+        status, response = self.send(path, {**data, 'token': sentToken}, params)
+
+        if isInvalidToken(status, response):
+            status, response = self.send(path, {**data, 'token': self.refreshToken(sentToken)}, params)
+
+        return getResult(status, response, result, allowMissing)
+
+    def iterUsers(self, limit=1000):
+        """
+            All the usernames (in alphabetical order), fetched a page at a time.
+        """
+        cursor = None
+
+        while True:
+            users, cursor = self.getUsers(limit, cursor)
+            yield from users
+
+            if cursor is None:
+                return
+
+    def iterPostIds(self, limit=1000):
+        """
+            All the post ids (in ascending order), fetched a page at a time.
+        """
+        cursor = None
+
+        while True:
+            ids, cursor = self.getPostIds(limit, cursor)
+            yield from ids
+
+            if cursor is None:
+                return
+
+    def getPosts(self, ids, concurrency=8):
+        """
+            Get many posts with concurrent '/blog/get/:blogId' requests, with at most 'concurrency' of them at the same time.
+            Returns a dictionary of id -> post, the posts that don't exist are not included.
+            The 'concurrency' should be at most the 'poolSize', otherwise some threads are left waiting for a connection.
+        """
+        ids = list(ids)
+
+        with ThreadPoolExecutor(max_workers=max(concurrency, 1)) as executor:
+            posts = executor.map(self.getPost, ids)
+
+            return {blogId: post for blogId, post in zip(ids, posts) if post is not None}
@@ -0,0 +1,277 @@
+"""
+    The parts shared by the blocking and the asyncio clients: the routes of the
+    api, and how the responses are interpreted.
+"""
+import json
+from urllib.parse import quote
+
+URL = 'http://localhost:8000/'
+
+# the server sends this message (with a 404, like a missing post) when the token expired or was invalidated
+INVALID_TOKEN_MESSAGE = "Invalid authentication 'token'."
+
+# the request can be made again after the 'Retry-After' time (rate limited / server busy)
+RETRY_STATUSES = (429, 503)
+
+# maximum time to wait before making a request again (in seconds), whatever the 'Retry-After' says
+MAX_RETRY_DELAY = 10
+
+
+class BlogApiError(Exception):
+    """
+        The server answered with 'success: false' (or with something that isn't json).
+        The 'status' is the http status code (None when the request wasn't sent).
+    """
+
+    def __init__(self, status, message):
+        super().__init__('{0} (status {1})'.format(message, status))
+        self.status = status
+        self.message = message
+
+
+def decodeResponse(status, text):
+    """
+        Parse the json body of a response.
+    """
+    try:
+        return json.loads(text)
+
+    except ValueError:
+        raise BlogApiError(status, 'Invalid response: {0!r}'.format(text[:100]))
+
+
+def retryDelay(headers):
+    """
+        How long to wait before making a rejected request again.
+    """
+    try:
+        delay = float(headers.get('Retry-After', 1))
+
+    except ValueError:
+        delay = 1
+
+    return min(max(delay, 0), MAX_RETRY_DELAY)
+
+
+def isInvalidToken(status, response):
+    return status == 404 and response.get('message') == INVALID_TOKEN_MESSAGE
+
+
+def queryParameters(params):
+    """
+        Remove the parameters that weren't given, and convert the rest to strings.
+    """
+    if params is None:
+        return None
+
+    return {key: str(value) for key, value in params.items() if value is not None}
+
+
+def getResult(status, response, result=None, allowMissing=False):
+    """
+        The value returned by a route method: 'result(response)' when the request was successful.
+        With 'allowMissing', a '404 Not Found' returns None instead of raising 'BlogApiError'.
+    """
+    if response.get('success'):
+        return response if result is None else result(response)
+
+    if allowMissing and status == 404:
+        return None
+
+    raise BlogApiError(status, response.get('message', 'Request failed.'))
+
+
+class Routes:
+    """
+        The routes of the api, shared by 'BlogClient' and 'AsyncBlogClient'.
+        Each method describes its request and passes it to '_call()' (so with the async client they return an awaitable instead).
+        The subclasses have the 'username' / 'password' / 'token' attributes.
+    """
+
+    def _setCredentials(self, username, password):
+        """
+            Returns a function that keeps the credentials and the token of a successful response (used to log in again later).
+        """
+        def result(response):
+            self.username = username
+            self.password = password
+            self.token = response['token']
+            return self.token
+
+        return result
+
+    def _getCredentials(self, username, password):
+        username = self.username if username is None else username
+        password = self.password if password is None else password
+
+        if username is None or password is None:
+            raise BlogApiError(None, 'No username/password to log in with.')
+
+        return username, password
+
+    def createUser(self, username, password):
+        """
+            Create a user, and make the following requests as that user.
+        """
+        return self._call('/user/create', {
+            'username': username,
+            'password': password
+        }, result=self._setCredentials(username, password))
+
+    def login(self, username=None, password=None):
+        """
+            Get a new token (with the given credentials, or the ones used before).
+        """
+        username, password = self._getCredentials(username, password)
+
+        return self._call('/user/login', {
+            'username': username,
+            'password': password
+        }, result=self._setCredentials(username, password))
+
+    def removeUser(self, username=None, password=None):
+        """
+            Returns the number of posts and tokens that were removed.
+        """
+        username, password = self._getCredentials(username, password)
+
+        return self._call('/user/remove', {
+            'username': username,
+            'password': password
+        })
+
+    def changePassword(self, newPassword, username=None, password=None):
+        username, password = self._getCredentials(username, password)
+
+        return self._call('/user/change_password', {
+            'username': username,
+            'password': password,
+            'newPassword': newPassword
+        }, result=self._setCredentials(username, newPassword))
+
+    def invalidateTokens(self, username=None, password=None):
+        """
+            Only the returned token stays valid.
+        """
+        username, password = self._getCredentials(username, password)
+
+        return self._call('/user/invalidate_tokens', {
+            'username': username,
+            'password': password
+        }, result=self._setCredentials(username, password))
+
+    def getUsers(self, limit=None, cursor=None):
+        """
+            A page of usernames, returns the list and the cursor of the next page (None in the last page).
+        """
+        return self._call('/user/getall', params={
+            'limit': limit,
+            'cursor': cursor
+        }, result=lambda response: (response['users'], response.get('next_cursor')))
+
+    def randomUser(self):
+        """
+            Returns a dictionary with the 'username' and its 'posts_ids'.
+        """
+        return self._call('/user/random', result=lambda response: {
+            'username': response['username'],
+            'posts_ids': response['posts_ids']
+        })
+
+    def randomUsers(self, count):
+        return self._call('/user/random', params={'count': count}, result=lambda response: response['users'])
+
+    def addPost(self, title, body):
+        """
+            Returns the id of the new post.
+        """
+        return self._call('/blog/add', {
+            'title': title,
+            'body': body
+        }, token=True, result=lambda response: response['post_id'])
+
+    def addPosts(self, posts):
+        """
+            Add a list of '{ "title": ..., "body": ... }' posts at once.
+            Returns the result of each one (with the 'post_id' of the ones that were added).
+        """
+        return self._call('/blog/bulk_add', {
+            'posts': json.dumps(posts)
+        }, token=True, result=lambda response: response['results'])
+
+    def getPost(self, blogId):
+        """
+            Returns None if the post doesn't exist.
+        """
+        return self._call('/blog/get/{0}'.format(blogId), allowMissing=True, result=lambda response: response['post'])
+
+    def getManyPosts(self, ids):
+        """
+            Get up to 100 posts in a single request.
+            Returns a dictionary of id -> post, and the list of ids that weren't found.
+        """
+        return self._call('/blog/get_many', {
+            'ids': ','.join(str(a) for a in ids)
+        }, result=lambda response: (response['posts'], response['missing']))
+
+    def removePost(self, blogId):
+        return self._call('/blog/remove', {
+            'blogId': blogId
+        }, token=True)
+
+    def updatePost(self, blogId, title, body):
+        return self._call('/blog/update', {
+            'blogId': blogId,
+            'title': title,
+            'body': body
+        }, token=True)
+
+    def getUserPostIds(self, username):
+        """
+            The ids of all the posts of the user (None if there are none).
+        """
+        return self._call('/blog/{0}/getall'.format(quote(username, safe='')), allowMissing=True,
+                          result=lambda response: response['posts_ids'])
+
+    def getFeed(self, username=None, limit=None, before=None):
+        """
+            The most recent posts (of everyone, or of the given user).
+            Returns a list of '{ "id": ..., "post": ... }', and the 'before' of the next page (None in the last page).
+        """
+        path = '/blog/feed' if username is None else '/blog/{0}/feed'.format(quote(username, safe=''))
+
+        return self._call(path, params={
+            'limit': limit,
+            'before': before
+        }, result=lambda response: (response['posts'], response.get('next_before')))
+
+    def randomPost(self):
+        return self._call('/blog/random', result=lambda response: response['post'])
+
+    def randomPosts(self, count):
+        """
+            Returns a list of '{ "id": ..., "post": ... }'.
+        """
+        return self._call('/blog/random', params={'count': count}, result=lambda response: response['posts'])
+
+    def getPostIds(self, limit=None, cursor=None):
+        """
+            A page of post ids, returns the list and the cursor of the next page (None in the last page).
+        """
+        return self._call('/blog/getall', params={
+            'limit': limit,
+            'cursor': cursor
+        }, result=lambda response: (response['posts_ids'], response.get('next_cursor')))
+
+    def search(self, query, limit=None, offset=None):
+        """
+            Returns the response as is ('total' / 'results' / 'next_offset').
+        """
+        return self._call('/blog/search', params={
+            'q': query,
+            'limit': limit,
+            'offset': offset
+        })
+
+    def stats(self):
+        return self._call('/stats')
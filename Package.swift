@@ -11,6 +11,7 @@ let package = Package(
         .package( url: "https://github.com/IBM-Swift/HeliumLogger.git", .upToNextMajor( from: "1.7.0" ) ),
         .package( url: "https://github.com/IBM-Swift/BlueCryptor.git",  .upToNextMajor( from: "0.8.0" ) ),
         .package( url: "https://github.com/vapor/redis.git",            .upToNextMajor( from: "2.2.0" ) ),
+        .package( url: "https://github.com/IBM-Swift/CZlib.git",        .exact( "0.1.0" ) ),
     ],
     targets: [
         .target(
@@ -20,6 +21,7 @@ let package = Package(
                 "HeliumLogger",
                 "Cryptor",
                 "Redis",
+                "CZlib",
             ],
             path: "./Sources"
         )
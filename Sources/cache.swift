@@ -0,0 +1,201 @@
+import Foundation
+
+
+/**
+ * A thread safe, in memory, least recently used cache.
+ * Each entry has its own time to live, and the least recently used entries are removed when over capacity.
+ * The removals are counted (see 'removals()'), so a value read from the database before its key was removed (invalidated) isn't added back afterwards.
+ */
+class Cache<Value> {
+    private class Node {
+        let key: String
+        var value: Value
+        var expiresAt: Date
+        var previous: Node?
+        var next: Node?
+
+        init(key: String, value: Value, expiresAt: Date) {
+            self.key = key
+            self.value = value
+            self.expiresAt = expiresAt
+        }
+    }
+
+    let capacity: Int
+
+    private var nodes = [String: Node]()
+    private var head: Node?     // most recently used
+    private var tail: Node?     // least recently used
+    private let lock = NSLock()
+    private var hits = 0
+    private var misses = 0
+
+        // number of removals, for each group of keys (see 'removals()')
+    private var removalCounts = [Int](repeating: 0, count: 64)
+
+
+    init(capacity: Int) {
+        self.capacity = capacity
+    }
+
+
+    /**
+     * Get the value associated with the key (if it exists and hasn't expired yet).
+     */
+    func get(_ key: String) -> Value? {
+        self.lock.lock()
+        defer { self.lock.unlock() }
+
+        guard let node = self.nodes[ key ] else {
+            self.misses += 1
+            return nil
+        }
+
+        guard node.expiresAt > Date() else {
+            self.unlink(node)
+            self.nodes[ key ] = nil
+            self.misses += 1
+            return nil
+        }
+
+        self.unlink(node)
+        self.pushFront(node)
+        self.hits += 1
+
+        return node.value
+    }
+
+
+    /**
+     * Add/replace a value, which will be valid for 'ttl' seconds.
+     * With 'removals' (taken before the value was read from the database), the value isn't added if the key may have been removed since then: the value could be outdated.
+     */
+    func set(_ key: String, _ value: Value, ttl: TimeInterval, removals: [Int]? = nil) {
+        guard self.capacity > 0 && ttl > 0 else {
+            return
+        }
+
+        self.lock.lock()
+        defer { self.lock.unlock() }
+
+        if let removals = removals {
+            let group = self.group(key)
+
+            guard removals[ group ] == self.removalCounts[ group ] else {
+                return
+            }
+        }
+
+        let expiresAt = Date(timeIntervalSinceNow: ttl)
+
+        if let node = self.nodes[ key ] {
+            node.value = value
+            node.expiresAt = expiresAt
+            self.unlink(node)
+            self.pushFront(node)
+            return
+        }
+
+        let node = Node(key: key, value: value, expiresAt: expiresAt)
+        self.nodes[ key ] = node
+        self.pushFront(node)
+
+        if self.nodes.count > self.capacity, let last = self.tail {
+            self.unlink(last)
+            self.nodes[ last.key ] = nil
+        }
+    }
+
+
+    /**
+     * Remove the entry of the given key.
+     */
+    func remove(_ key: String) {
+        self.lock.lock()
+        defer { self.lock.unlock() }
+
+        self.removalCounts[ self.group(key) ] += 1
+
+        if let node = self.nodes[ key ] {
+            self.unlink(node)
+            self.nodes[ key ] = nil
+        }
+    }
+
+
+    /**
+     * The number of removals so far, to pass to 'set()' later on.
+     * The keys are split between a fixed number of groups (to keep it small), so the removal of a different key can also prevent a value from being added (which only means one less value in the cache).
+     */
+    func removals() -> [Int] {
+        self.lock.lock()
+        defer { self.lock.unlock() }
+
+        return self.removalCounts
+    }
+
+
+    /**
+     * Hit/miss counters and current size.
+     */
+    func stats() -> [String: Any] {
+        self.lock.lock()
+        defer { self.lock.unlock() }
+
+        var stats = [String: Any]()
+        stats["size"] = self.nodes.count
+        stats["capacity"] = self.capacity
+        stats["hits"] = self.hits
+        stats["misses"] = self.misses
+
+        return stats
+    }
+
+
+    /**
+     * The position of the key in 'removalCounts'.
+     */
+    private func group(_ key: String) -> Int {
+        return Int( UInt(bitPattern: key.hashValue) % UInt(self.removalCounts.count) )
+    }
+
+
+    /**
+     * Add a node to the front of the list (the most recently used position).
+     */
+    private func pushFront(_ node: Node) {
+        node.previous = nil
+        node.next = self.head
+        self.head?.previous = node
+        self.head = node
+
+        if self.tail == nil {
+            self.tail = node
+        }
+    }
+
+
+    /**
+     * Remove a node from the list.
+     */
+    private func unlink(_ node: Node) {
+        if let previous = node.previous {
+            previous.next = node.next
+        }
+
+        else {
+            self.head = node.next
+        }
+
+        if let next = node.next {
+            next.previous = node.previous
+        }
+
+        else {
+            self.tail = node.previous
+        }
+
+        node.previous = nil
+        node.next = nil
+    }
+}
@@ -0,0 +1,42 @@
+import Foundation
+
+
+/**
+ * Administrative commands, run from the command line instead of starting the server.
+ * For example: `swift run blog_web_api drop-namespace test`
+ */
+func runCommand(_ arguments: [String]) throws {
+    let usage = """
+        Available commands:
+            drop-namespace <namespace>    Remove all the keys of the namespace.
+            rebuild-search-index          Index the terms of all the existing posts again.
+            compress-posts                Compress the body of the existing posts (the ones over POST_COMPRESS_MIN_SIZE bytes).
+            memory-report                 Show how much redis memory the posts use.
+        """
+
+    switch arguments.first ?? "" {
+        case "drop-namespace" where arguments.count == 2:
+            let count = try DB.dropNamespace(arguments[ 1 ])
+            print("Removed \(count) keys.")
+
+        case "rebuild-search-index":
+            let count = try DB.rebuildSearchIndex()
+            print("Indexed \(count) posts.")
+
+        case "compress-posts":
+            let count = try DB.compressPosts()
+            print("Compressed \(count) posts.")
+
+        case "memory-report":
+            let report = try DB.postsMemoryReport()
+            let posts = report[ "posts" ]!
+
+            print("Posts: \(posts) (\(report[ "compressed" ]!) compressed)")
+            print("Memory used by the posts: \(report[ "posts_memory" ]!) bytes (\(posts > 0 ? report[ "posts_memory" ]! / posts : 0) per post)")
+            print("Stored body size: \(report[ "body_bytes" ]!) bytes")
+            print("Total memory used by redis: \(report[ "used_memory" ] ?? 0) bytes")
+
+        default:
+            print(usage)
+    }
+}
@@ -0,0 +1,88 @@
+import Foundation
+import CZlib
+import LoggerAPI
+
+
+/**
+ * Compression of the body of the posts, to use less memory in redis.
+ * Bodies with at least 'minimumSize' bytes are compressed with zlib and stored in base64 (so they're still text), with "zlib" in the 'body_format' field of the post.
+ * Posts without a 'body_format' have the body in plain text.
+ */
+enum BodyCompression {
+    static let format = "zlib"
+    static let minimumSize = Int(ProcessInfo.processInfo.environment["POST_COMPRESS_MIN_SIZE"] ?? "512") ?? 512
+
+
+    /**
+     * Get the body to store, and its format (nil for plain text).
+     * The body is kept in plain text when it's short, or when compressing it doesn't save anything.
+     */
+    static func encode(_ body: String) -> (body: String, format: String?) {
+        let bytes = Array(body.utf8)
+
+        guard bytes.count >= BodyCompression.minimumSize, let compressed = BodyCompression.compress(bytes) else {
+            return (body, nil)
+        }
+
+        let encoded = Data(bytes: compressed).base64EncodedString()
+
+        guard encoded.utf8.count < bytes.count else {
+            return (body, nil)
+        }
+
+        return (encoded, BodyCompression.format)
+    }
+
+
+    /**
+     * Get the original body back, from a stored body and its format.
+     */
+    static func decode(_ body: String, format: String?) -> String {
+        guard format == BodyCompression.format else {
+            return body
+        }
+
+        guard let data = Data(base64Encoded: body), let bytes = BodyCompression.decompress([UInt8](data)), let text = String(bytes: bytes, encoding: .utf8) else {
+            Log.error("Failed to decompress a post body.")
+            return body
+        }
+
+        return text
+    }
+
+
+    /**
+     * Compress with zlib. The result starts with the original size (4 bytes, big endian), which is needed to decompress it.
+     */
+    static func compress(_ bytes: [UInt8]) -> [UInt8]? {
+        var size = compressBound(uLong( bytes.count ))
+        var output = [UInt8](repeating: 0, count: Int( size ))
+
+        guard compress2(&output, &size, bytes, uLong( bytes.count ), Z_DEFAULT_COMPRESSION) == Z_OK else {
+            return nil
+        }
+
+        let count = UInt32( bytes.count )
+        let header: [UInt8] = [ UInt8( count >> 24 & 0xFF ), UInt8( count >> 16 & 0xFF ), UInt8( count >> 8 & 0xFF ), UInt8( count & 0xFF ) ]
+
+        return header + output[ 0 ..< Int( size ) ]
+    }
+
+
+    static func decompress(_ bytes: [UInt8]) -> [UInt8]? {
+        guard bytes.count > 4 else {
+            return nil
+        }
+
+        let count = Int( bytes[ 0 ] ) << 24 | Int( bytes[ 1 ] ) << 16 | Int( bytes[ 2 ] ) << 8 | Int( bytes[ 3 ] )
+        let input = Array(bytes[ 4... ])
+        var size = uLong( count )
+        var output = [UInt8](repeating: 0, count: count)
+
+        guard uncompress(&output, &size, input, uLong( input.count )) == Z_OK, Int( size ) == count else {
+            return nil
+        }
+
+        return output
+    }
+}
@@ -4,8 +4,26 @@ import LoggerAPI
 import Cryptor
 
 
+enum DatabaseError: Error {
+    case unexpectedReply
+}
+
+
 class Database {
-    let client: TCPClient
+    let pool: ConnectionPool
+    let replicas: ReplicaSet
+    let tokenCache: Cache<String>
+    let tokenCacheTTL: TimeInterval
+    let postCache: Cache<CachedPost>
+    let postCacheTTL: TimeInterval
+    let invalidationChannel = "cache_invalidations"
+    let scriptHashes: [String: String]
+    let defaultNamespace: String
+    let tokenSweepInterval: TimeInterval
+
+    private let sweepLock = NSLock()
+    private var sweeps = 0          // number of completed token sweeps
+    private var sweptTokens = 0     // number of expired tokens removed by the sweeps
 
 
     /**
@@ -17,447 +35,1616 @@ class Database {
         var redisHost = "localhost"
         var redisPort: UInt16 = 6379
         var redisPassword: String?
+        let poolSize = Int(ProcessInfo.processInfo.environment["REDIS_POOL_SIZE"] ?? "10") ?? 10
+        let redisDatabase = Int(ProcessInfo.processInfo.environment["REDIS_DB"] ?? "0") ?? 0
 
-        if let urlString = redisUrl {
-            let url = URL(string: urlString)
+        self.defaultNamespace = ProcessInfo.processInfo.environment["REDIS_NAMESPACE"] ?? ""
+        let tokenCacheSize = Int(ProcessInfo.processInfo.environment["TOKEN_CACHE_SIZE"] ?? "10000") ?? 10_000
 
-            if let url = url {
-                redisHost = url.host!
-                redisPort = UInt16( url.port! )
-                redisPassword = url.password!
-            }
+        self.tokenCache = Cache<String>(capacity: tokenCacheSize)
+        self.tokenCacheTTL = TimeInterval(ProcessInfo.processInfo.environment["TOKEN_CACHE_TTL"] ?? "30") ?? 30
 
-            else {
+        let postCacheSize = Int(ProcessInfo.processInfo.environment["POST_CACHE_SIZE"] ?? "1000") ?? 1000
+
+        self.postCache = Cache<CachedPost>(capacity: postCacheSize)
+        self.postCacheTTL = TimeInterval(ProcessInfo.processInfo.environment["POST_CACHE_TTL"] ?? "300") ?? 300
+        self.tokenSweepInterval = TimeInterval(ProcessInfo.processInfo.environment["TOKEN_SWEEP_INTERVAL"] ?? "600") ?? 600
+
+            // redis identifies the scripts by their SHA1 digest
+        var scriptHashes = [String: String]()
+
+        for script in Scripts.all {
+            scriptHashes[ script ] = CryptoUtils.hexString(from: Digest(using: .sha1).update(string: script)!.final())
+        }
+
+        self.scriptHashes = scriptHashes
+
+        if let urlString = redisUrl {
+            guard let url = Database.parseRedisUrl(urlString) else {
                 Log.error("Invalid redis URL.")
                 exit(1)
             }
+
+            redisHost = url.host
+            redisPort = url.port
+            redisPassword = url.password
         }
 
         do {
-            self.client = try TCPClient(hostname:redisHost, port: redisPort, password: redisPassword)
+            self.pool = try ConnectionPool(hostname: redisHost, port: redisPort, password: redisPassword, database: redisDatabase, size: poolSize)
         }
 
         catch {
             Log.error("Redis error: \(error)")
             exit(1)
         }
-    }
 
+            // optional read replicas, a replica that can't be reached is left out
+        var replicas = [Replica]()
+        let replicaUrls = (ProcessInfo.processInfo.environment["REDIS_REPLICA_URLS"] ?? "").split(separator: ",")
 
-    /**
-     * Add a new user to the database.
-     */
-    func addUser(name: String, password: String) throws -> Bool {
-        guard let salt = try? Random.generate(byteCount: 64) else {
-            Log.error("Failed to create the 'salt'.")
-            return false
+        for urlString in replicaUrls {
+            guard let url = Database.parseRedisUrl(urlString.trimmingCharacters(in: .whitespaces)) else {
+                Log.error("Invalid redis replica URL: \(urlString)")
+                exit(1)
+            }
+
+            do {
+                let pool = try ConnectionPool(hostname: url.host, port: url.port, password: url.password, database: redisDatabase, size: poolSize)
+                replicas.append(Replica(name: "\(url.host):\(url.port)", pool: pool))
+            }
+
+            catch {
+                Log.error("Failed to connect to the redis replica \(url.host):\(url.port), not using it: \(error)")
+            }
         }
 
-        let saltString = CryptoUtils.hexString(from: salt)
-        let passwordHash = getPasswordHash(string: password, salt: saltString)
-
-        try self.client.makePipeline()
-            .enqueue(
-                .custom("MULTI".makeBytes())
-            )
-            .enqueue(
-                .custom("HMSET".makeBytes()), [
-                    "user_\(name)",
-                    "password",
-                    passwordHash,
-                    "salt",
-                    saltString
-                ]
-            )
-            .enqueue(
-                .custom("SADD".makeBytes()), [
-                    "users",
-                    name
-                ]
-            )
-            .enqueue(
-                .custom("EXEC".makeBytes())
-            )
-            .execute()
+        let maxLag = TimeInterval(ProcessInfo.processInfo.environment["REDIS_REPLICA_MAX_LAG"] ?? "")
 
-        return true
+        self.replicas = ReplicaSet(replicas: replicas, maxLag: maxLag)
     }
 
 
     /**
-     * Remove an existing user and his posts from the database.
+     * Get the host, port and password from a redis url ('redis://:password@host:port').
      */
-    func removeUser(name: String) throws -> Bool {
-            // remove the user's posts
-        let posts = try self.getUserPosts(username: name)
-
-        for postId in posts {
-            _ = try self.removePost(username: name, id: postId)
+    static func parseRedisUrl(_ urlString: String) -> (host: String, port: UInt16, password: String?)? {
+        guard let url = URL(string: urlString), let host = url.host else {
+            return nil
         }
 
-            // remove all the associated tokens
-        try self.removeAllTokens(username: name)
+        return (host, UInt16( url.port ?? 6379 ), url.password)
+    }
 
-            // remove the user information
-        try self.client.makePipeline()
-            .enqueue(
-                .custom("MULTI".makeBytes())
-            )
-            .enqueue(
-                .custom("HDEL".makeBytes()), [
-                    "user_\(name)",
-                    "password",
-                    "salt"
-                ]
-            )
-            .enqueue(
-                .custom("SREM".makeBytes()), [
-                    "users",
-                    name
-                ]
-            )
-            .enqueue(
-                .custom("EXEC".makeBytes())
-            )
-            .execute()
 
-        return true
+    /**
+     * The namespace of the current request (set by the 'NamespaceMiddleware'), otherwise the one from the 'REDIS_NAMESPACE' environment variable.
+     */
+    var namespace: String {
+        return Thread.current.threadDictionary[ "namespace" ] as? String ?? self.defaultNamespace
     }
 
 
     /**
-     * Get a list with all the usernames.
+     * Get the complete name of a key, scoped by the current namespace (for example "test:user_aaa" in the "test" namespace).
      */
-    func getAllUsers() throws -> [String] {
-        return try self.getAllSetMembers(key: "users")
+    func key(_ name: String) -> String {
+        let namespace = self.namespace
+
+        return namespace.isEmpty ? name : "\(namespace):\(name)"
     }
 
 
     /**
-     * Generic function, returns all the members of a given redis set in an array.
+     * Remove all the keys of a namespace (with 'UNLINK', a batch at a time).
      */
-    func getAllSetMembers(key: String) throws -> [String] {
-        let response = try self.client.command(
-            .custom("SMEMBERS".makeBytes()), [
-                key
-            ]
-        )
-        var all = [String]()
+    func dropNamespace(_ namespace: String) throws -> Int {
+        var count = 0
 
-        guard let members = response?.array else {
-            return all
+        try self.scanKeys(match: "\(namespace):*") {
+            keys in
+
+            count += try self.command(.custom("UNLINK".makeBytes()), keys)?.int ?? 0
         }
 
-        for member in members {
-            let value = member?.string
+        return count
+    }
 
-            if value != nil {
-                all.append( value! )
+
+    /**
+     * Listen for tokens/posts invalidated by other instances of the server, and remove them from our caches.
+     * Runs in its own thread, with a dedicated connection (a subscribed connection can't be used for other commands).
+     */
+    func listenCacheInvalidations() {
+        let thread = Thread {
+            while true {
+                do {
+                    let client = try self.pool.connect()
+
+                    try client.subscribe(channel: self.invalidationChannel) {
+                        data in
+
+                            // the message is an array with: "message" / channel / payload
+                        guard let message = data?.array, message.count == 3, let payload = message[ 2 ]?.string else {
+                            return
+                        }
+
+                        self.removeFromCache(payload)
+                    }
+                }
+
+                catch {
+                    Log.error("Cache invalidation listener error: \(error)")
+                }
+
+                    // connection lost, try again in a bit
+                Thread.sleep(forTimeInterval: 1)
             }
         }
 
-        return all
+        thread.name = "cache_invalidations"
+        thread.start()
     }
 
 
     /**
-     * Generic function, get a redis hash from the database, and convert it into a dictionary.
+     * Remove entries from the local caches.
+     * The 'payload' has the cache name followed by a comma separated list of keys, for example: "post:1,2,3".
      */
-    func getHash(key: String) -> [String: String]? {
-            // returns an array instead of a hash, where every field is followed by its value
-        let response = try? self.client.command(.custom("HGETALL".makeBytes()), [ key ])
+    func removeFromCache(_ payload: String) {
+        let parts = payload.split(separator: ":", maxSplits: 1)
 
-        guard let hashData = response else {
-            return nil
+        guard parts.count == 2 else {
+            return
         }
 
-        guard let hashList = hashData!.array else {
-            return nil
-        }
+        let cache: (String) -> Void
 
-        guard hashList.count > 0 else {
-            return nil
+        switch parts[ 0 ] {
+            case "token":
+                cache = self.tokenCache.remove
+            case "post":
+                cache = self.postCache.remove
+            default:
+                return
         }
 
-        var dict = [String: String]()
-        var a = 0
+        for key in parts[ 1 ].split(separator: ",") {
+            cache(String( key ))
+        }
+    }
 
-        while (a < hashList.count) {
-            let field = hashList[ a ]!.string!
-            let value = hashList[ a + 1 ]!.string!
 
-            dict[ field ] = value
-            a += 2
+    /**
+     * Remove entries from the cache of this server, and of the other servers (through the redis pub/sub channel).
+     */
+    func invalidateCache(_ name: String, keys: [String]) throws {
+        guard keys.count > 0 else {
+            return
         }
 
-        return dict
+        let payload = "\(name):" + keys.map { self.key($0) }.joined(separator: ",")
+
+        self.removeFromCache(payload)
+        try self.command(
+            .custom("PUBLISH".makeBytes()), [
+                self.invalidationChannel,
+                payload
+            ]
+        )
     }
 
 
     /**
-     * Get the information of the given user.
+     * Run the given function with a connection from the pool (a single command, or a pipeline).
+     * With 'readOnly', it runs in one of the replicas (if there are any available, see 'ReplicaSet'), falling back to the primary if the replica fails.
+     * Otherwise it runs in the primary. After a write, the reads that follow in the same request go to the primary as well (see 'ReplicaSet.noteCommand()').
+     * The time it took is added to the trace of the current request, tagged with the name of the calling method.
+     * The pipelines need to be a 'TracedPipeline', so their size is traced as well.
+     * A 'pinned' replica is used instead of picking one, and isn't replaced by the primary when it fails (see 'scan()').
      */
-    func getUser(name: String) -> [String: String]? {
-        return self.getHash(key: "user_\(name)")
+    @discardableResult
+    func withClient<T>(caller: String = #function, readOnly: Bool = false, pinned: Replica? = nil, _ body: (TCPClient) throws -> T) throws -> T {
+        let start = Date()
+
+        defer {
+            RedisTrace.record(caller: caller, elapsed: Date().timeIntervalSince(start))
+        }
+
+        let result: T
+
+        if readOnly, let replica = pinned {
+            do {
+                result = try replica.pool.withClient(body)
+                replica.countRead()
+            }
+
+            catch {
+                Log.warning("Redis replica \(replica.name) failed: \(error)")
+                replica.healthy = false
+                throw error
+            }
+        }
+
+        else if readOnly, let replica = self.replicas.next() {
+            do {
+                result = try replica.pool.withClient(body)
+                replica.countRead()
+            }
+
+            catch {
+                Log.warning("Redis replica \(replica.name) failed, using the primary: \(error)")
+                replica.healthy = false
+                result = try self.pool.withClient(body)
+            }
+        }
+
+        else {
+            result = try self.pool.withClient(body)
+        }
+
+        return result
     }
 
 
     /**
-     * Get the username associated with the given token.
+     * Run a single command on a connection from the pool.
      */
-    func getUserName(token: String) throws -> String? {
-        return try self.client.command(.get, ["token_\(token)"])?.string
+    @discardableResult
+    func command(_ command: Command, _ params: [BytesConvertible] = [], readOnly: Bool = false, pinned: Replica? = nil, caller: String = #function) throws -> Redis.Data? {
+        if !readOnly {
+            ReplicaSet.noteCommand(command)
+        }
+
+        let reply = try self.withClient(caller: caller, readOnly: readOnly, pinned: pinned) {
+            client in try client.command(command, params)
+        }
+
+        RedisTrace.recordBytes(sent: RedisTrace.commandSize(command, params), received: RedisTrace.replySize(reply))
+
+        return reply
     }
 
 
     /**
-     * Generate the token to be used to authenticate a user.
+     * Load all the scripts into the redis script cache, so they can be called with 'EVALSHA'.
      */
-    func generateUserToken(username: String) throws -> String {
-        let token = UUID().uuidString
-        let oneDaySeconds = 86_400  // expire the token after 1 day
-        let key = "token_\(token)"
-
-        try self.client.makePipeline()
-            .enqueue(
-                .custom("MULTI".makeBytes())
-            )
-            .enqueue(
-                .set, [
-                    key,
-                    username
-                ]
-            )
-            .enqueue(
-                .custom("EXPIRE".makeBytes()), [
-                    key,
-                    String( oneDaySeconds )
-                ]
-            )
-            .enqueue(
-                .custom("SADD".makeBytes()), [
-                    "user_tokens_\(username)",
-                    token
-                ]
-            )
-            .enqueue(
-                .custom("EXEC".makeBytes())
-            )
-            .execute()
-
-        return token
+    func loadScripts() throws {
+        for script in Scripts.all {
+            try self.command(.custom("SCRIPT".makeBytes()), [ "LOAD", script ])
+        }
     }
 
 
     /**
-     * Each token has an expiration date. Remove the ones that have expired from the "user_tokens_*" set.
+     * Run one of the scripts from 'Scripts'.
+     * If the script isn't in the server cache anymore (the server restarted, or the cache was flushed), load it again and retry.
+     * Scripts that only read ('readOnly') can run in the replicas. Those are sent with 'EVAL', since we can't know which replicas have them cached already.
      */
-    func cleanUserTokens(username: String) throws {
-        let userTokensKey = "user_tokens_\(username)"
-        let tokens = try self.client.command(
-            .custom("SMEMBERS".makeBytes()), [
-                userTokensKey
-            ])!.array!
+    @discardableResult
+    func runScript(_ script: String, keys: [String], args: [String], readOnly: Bool = false, caller: String = #function) throws -> Redis.Data? {
+        if readOnly && self.replicas.replicas.count > 0 {
+            return try self.command(.custom("EVAL".makeBytes()), [ script, String( keys.count ) ] + keys + args, readOnly: true, caller: caller)
+        }
 
-        for tokenObj in tokens {
-            guard let token = tokenObj?.string else {
-                continue
-            }
+        let params: [BytesConvertible] = [ self.scriptHashes[ script ]!, String( keys.count ) ] + keys + args
 
-            let checkToken = try self.client.command(.get, ["token_\(token)"])?.string
+        do {
+            return try self.command(.custom("EVALSHA".makeBytes()), params, caller: caller)
+        }
 
-                // doesn't exist anymore, clear from the set as well
-            if checkToken == nil {
-                try self.client.command(
-                    .custom("SREM".makeBytes()), [
-                        userTokensKey,
-                        token
-                    ]
-                )
+        catch {
+            guard "\(error)".contains("NOSCRIPT") else {
+                throw error
             }
+
+            try self.command(.custom("SCRIPT".makeBytes()), [ "LOAD", script ])
+            return try self.command(.custom("EVALSHA".makeBytes()), params, caller: caller)
         }
     }
 
 
     /**
-     * Remove all the tokens associated with the given user.
+     * Add a new user to the database.
+     * Throws 'PasswordHasherError.busy' if there's no room to hash the password right now.
      */
-    func removeAllTokens(username: String) throws {
-        let userTokensKey = "user_tokens_\(username)"
-        let tokens = try self.client.command(
-            .custom("SMEMBERS".makeBytes()), [
-                userTokensKey
-            ])!.array!
+    func addUser(name: String, password: String) throws -> Bool {
+        guard let salt = try? Random.generate(byteCount: 64) else {
+            Log.error("Failed to create the 'salt'.")
+            return false
+        }
 
-        for tokenObj in tokens {
-            guard let token = tokenObj?.string else {
-                continue
-            }
+        let saltString = CryptoUtils.hexString(from: salt)
+        let passwordHash = try HASHER.hash(password: password, salt: saltString)
 
-            try self.client.command(
-                .custom("DEL".makeBytes()), [
-                    "token_\(token)"
-                ]
-            )
-            try self.client.command(
-                .custom("SREM".makeBytes()), [
-                    userTokensKey,
-                    token
-                ]
-            )
+        try self.withClient { client in
+            try TracedPipeline(client: client)
+                .enqueue(
+                    .custom("MULTI".makeBytes())
+                )
+                .enqueue(
+                    .custom("HMSET".makeBytes()), [
+                        self.key("user_\(name)"),
+                        "password",
+                        passwordHash,
+                        "salt",
+                        saltString
+                    ]
+                )
+                .enqueue(
+                    .custom("SADD".makeBytes()), [
+                        self.key("users"),
+                        name
+                    ]
+                )
+                .enqueue(
+                    .custom("ZADD".makeBytes()), [
+                        self.key("users_index"),
+                        "0",
+                        name
+                    ]
+                )
+                .enqueue(
+                    .custom("EXEC".makeBytes())
+                )
+                .execute()
         }
+
+        return true
     }
 
 
     /**
-     * Returns the Unix timestamp (number of seconds since 1/1/1970).
+     * Remove an existing user, their posts and tokens from the database (atomically, in a single round trip).
+     * Returns how many posts and tokens were removed.
      */
-    func getCurrentTime() throws -> String {
-        let time = try self.client.command(
-            .custom("TIME".makeBytes())
-            )!.array!
+    func removeUser(name: String) throws -> (posts: Int, tokens: Int) {
+        let reply = try self.runScript(
+            Scripts.removeUser,
+            keys: [
+                self.key("user_posts_\(name)"),
+                self.key("user_tokens_\(name)"),
+                self.key("user_\(name)"),
+                self.key("users"),
+                self.key("users_index"),
+                self.key("posts"),
+                self.key("posts_index"),
+                self.key("posts_by_time"),
+                self.key("user_posts_by_time_\(name)")
+            ],
+            args: [ name, self.key("") ]
+        )
+        var removed = [[String](), [String]()]
+
+        if let lists = reply?.array, lists.count == 2 {
+            for (index, list) in lists.enumerated() {
+                for member in list?.array ?? [] {
+                    if let value = member?.string {
+                        removed[ index ].append( value )
+                    }
+                }
+            }
+        }
 
-        return time[ 0 ]!.string!
+        try self.invalidateCache("post", keys: removed[ 0 ])
+        try self.invalidateCache("token", keys: removed[ 1 ])
+
+        return (removed[ 0 ].count, removed[ 1 ].count)
     }
 
 
     /**
-     * Add a new blog post to the database.
+     * Get a page of usernames (in alphabetical order), starting after the 'cursor' username.
      */
-    func addBlogPost(username: String, title: String, body: String) throws -> Int? {
-        let id = try self.client.command(
-            .custom("INCR".makeBytes()), [
-                "LAST_POST_ID"
-            ])!.int!
-        let time = try getCurrentTime()
-
-        try self.client.makePipeline()
-            .enqueue(
-                .custom("MULTI".makeBytes())
-            )
-            .enqueue(
-                .custom("HMSET".makeBytes()), [
-                    "post_\(id)",
-                    "title", title,
-                    "body", body,
-                    "author", username,
-                    "last_updated", time
-                ]
-            )
-            .enqueue(
-                .custom("SADD".makeBytes()), [
-                    "user_posts_\(username)",
-                    "\(id)"
-                ]
-            )
-            .enqueue(
-                .custom("SADD".makeBytes()), [
-                    "posts",
-                    "\(id)"
-                ]
-            )
-            .enqueue(
-                .custom("EXEC".makeBytes())
-            )
-            .execute()
-
-        return id
+    func getUsersPage(limit: Int, cursor: String?) throws -> (members: [String], nextCursor: String?) {
+        return try self.getSortedSetPage(key: self.key("users_index"), limit: limit, cursor: cursor, byLex: true)
     }
 
 
     /**
-     * Update the contents of an existing blog post.
+     * Generic function, returns a page of members of a sorted set in ascending order, starting after the 'cursor' member.
+     * Members are ordered by score, or lexicographically when 'byLex' is set (in which case all the scores need to be the same).
+     * The 'nextCursor' is only returned when there are more members after this page.
      */
-    func updateBlogPost(id: String, title: String, body: String) throws {
-        try self.client.command(
-            .custom("HMSET".makeBytes()), [
-                "post_\(id)",
-                "title", title,
-                "body", body,
-                "last_updated", try getCurrentTime()
-            ]
+    func getSortedSetPage(key: String, limit: Int, cursor: String?, byLex: Bool) throws -> (members: [String], nextCursor: String?) {
+        let start: String
+        let end: String
+
+        if byLex {
+            start = cursor != nil ? "(\(cursor!)" : "-"
+            end = "+"
+        }
+
+        else {
+            start = cursor != nil ? "(\(cursor!)" : "-inf"
+            end = "+inf"
+        }
+
+            // ask for one extra element, to know if there's a next page
+        let response = try self.command(
+            .custom((byLex ? "ZRANGEBYLEX" : "ZRANGEBYSCORE").makeBytes()), [
+                key,
+                start,
+                end,
+                "LIMIT",
+                "0",
+                String( limit + 1 )
+            ],
+            readOnly: true
         )
+        var members = [String]()
+
+        for member in response?.array ?? [] {
+            if let value = member?.string {
+                members.append( value )
+            }
+        }
+
+        var nextCursor: String?
+
+        if members.count > limit {
+            members.removeLast()
+            nextCursor = members.last
+        }
+
+        return (members, nextCursor)
     }
 
 
     /**
-     * Get the information of the given post.
+     * Build the sorted set indexes ('users_index' / 'posts_index') from the 'users' / 'posts' sets, if they're out of sync.
+     * The time ordered indexes ('posts_by_time' / 'user_posts_by_time_*') are built from the 'last_updated' time of the posts.
+     * The members that aren't in the sets anymore are removed from the indexes as well, so the counts match again after a rebuild.
+     * Only needed once for databases created before the indexes were introduced.
      */
-    func getBlogPost(id: String) -> [String: String]? {
-        return self.getHash(key: "post_\(id)")
+    func buildIndexes() throws {
+        let indexes = [
+            (set: self.key("users"), index: self.key("users_index"), byLex: true),
+            (set: self.key("posts"), index: self.key("posts_index"), byLex: false)
+        ]
+
+        for info in indexes {
+            let setCount = try self.command(.custom("SCARD".makeBytes()), [ info.set ])?.int ?? 0
+            let indexCount = try self.command(.custom("ZCARD".makeBytes()), [ info.index ])?.int ?? 0
+
+            guard setCount != indexCount else {
+                continue
+            }
+
+            Log.info("Rebuilding the '\(info.index)' index.")
+
+            for member in try self.getAllSetMembers(key: info.set) {
+                try self.command(
+                    .custom("ZADD".makeBytes()), [
+                        info.index,
+                        info.byLex ? "0" : member,
+                        member
+                    ]
+                )
+            }
+
+            try self.removeStaleIndexMembers(index: info.index, set: info.set)
+        }
+
+        let postsCount = try self.command(.custom("SCARD".makeBytes()), [ self.key("posts") ])?.int ?? 0
+        let timeIndexCount = try self.command(.custom("ZCARD".makeBytes()), [ self.key("posts_by_time") ])?.int ?? 0
+
+        guard postsCount != timeIndexCount else {
+            return
+        }
+
+        Log.info("Rebuilding the '\(self.key("posts_by_time"))' index.")
+
+        var cursor: String?
+
+        repeat {
+            let page = try self.getPostsPage(limit: 500, cursor: cursor)
+
+            for (id, post) in try self.getBlogPosts(ids: page.members) {
+                    // the 'last_updated' time only has seconds, so the id is used to order the posts of the same second
+                let score = "\(post["last_updated"]!)." + String(format: "%06d", (Int(id) ?? 0) % 1_000_000)
+
+                try self.command(.custom("ZADD".makeBytes()), [ self.key("posts_by_time"), score, id ])
+                try self.command(.custom("ZADD".makeBytes()), [ self.key("user_posts_by_time_\(post["author"]!)"), score, id ])
+            }
+
+            cursor = page.nextCursor
+
+        } while cursor != nil
+
+        try self.removeStaleIndexMembers(index: self.key("posts_by_time"), set: self.key("posts"))
     }
 
 
     /**
-     * Get a list of ids of all the posts made by the user.
+     * Remove the members of a sorted set index that aren't in its source set.
+     * The index is checked a batch at a time (with 'ZSCAN'), and the stale members are removed after the whole index was checked.
      */
-    func getUserPosts(username: String) throws -> [String] {
-        return try self.getAllSetMembers(key: "user_posts_\(username)")
+    private func removeStaleIndexMembers(index: String, set: String) throws {
+        var stale = [String]()
+
+        try self.scan("ZSCAN", key: index) {
+            membersAndScores in
+
+                // the members are followed by their score
+            let members = stride(from: 0, to: membersAndScores.count, by: 2).map { membersAndScores[ $0 ] }
+            let replies = try self.withClient { (client: TCPClient) -> [Redis.Data?] in
+                let pipeline = TracedPipeline(client: client)
+
+                for member in members {
+                    try pipeline.enqueue(.custom("SISMEMBER".makeBytes()), [ set, member ])
+                }
+
+                return try pipeline.execute()
+            }
+
+            stale += zip(members, replies).flatMap { $0.1?.int == 0 ? $0.0 : nil }
+        }
+
+        guard stale.count > 0 else {
+            return
+        }
+
+        Log.info("Removing \(stale.count) members from the '\(index)' index.")
+
+        for start in stride(from: 0, to: stale.count, by: 500) {
+            let params: [String] = [ index ] + stale[ start ..< min(start + 500, stale.count) ]
+
+            try self.command(.custom("ZREM".makeBytes()), params)
+        }
     }
 
 
     /**
-     * Remove a blog post from the database.
+     * Generic function, returns all the members of a given redis set in an array.
      */
-    func removePost(username: String, id: String) throws -> Bool {
-        try self.client.makePipeline()
-            .enqueue(
-                .custom("MULTI".makeBytes())
-            )
-            .enqueue(
-                .custom("SREM".makeBytes()), [
-                    "user_posts_\(username)",
-                    id
-                ]
-            )
-            .enqueue(
-                .custom("SREM".makeBytes()), [
-                    "posts",
-                    id
-                ]
-            )
-            .enqueue(
-                .custom("DEL".makeBytes()), [
-                    "post_\(id)"
-                ]
-            )
-            .enqueue(
-                .custom("EXEC".makeBytes())
-            )
-            .execute()
+    func getAllSetMembers(key: String) throws -> [String] {
+        let response = try self.command(
+            .custom("SMEMBERS".makeBytes()), [
+                key
+            ]
+        )
+        var all = [String]()
 
-        return true
+        guard let members = response?.array else {
+            return all
+        }
+
+        for member in members {
+            let value = member?.string
+
+            if value != nil {
+                all.append( value! )
+            }
+        }
+
+        return all
     }
 
 
     /**
-     * Get a random post ID.
+     * Generic function, get a redis hash from the database, and convert it into a dictionary.
+     * With 'readOnly' it's read from a replica, but if it isn't there the primary is checked as well (it may have been added just now).
      */
-    func getRandomPostId() throws -> String? {
-        return try self.client.command(
-            .custom("SRANDMEMBER".makeBytes()), [
-                "posts"
-            ]
-        )?.string
+    func getHash(key: String, readOnly: Bool = false) -> [String: String]? {
+        guard let response = try? self.command(.custom("HGETALL".makeBytes()), [ key ], readOnly: readOnly) else {
+            return nil
+        }
+
+        let hash = self.hashFromReply(response)
+
+        if hash == nil && readOnly && self.replicas.enabled {
+            return self.getHash(key: key)
+        }
+
+        return hash
     }
 
 
     /**
-     * Return a list with all the blog posts ids.
+     * Convert the reply of a 'HGETALL' command into a dictionary.
      */
-    func getAllPosts() throws -> [String] {
-        return try getAllSetMembers(key: "posts")
+    func hashFromReply(_ reply: Redis.Data?) -> [String: String]? {
+            // returns an array instead of a hash, where every field is followed by its value
+        guard let hashList = reply?.array else {
+            return nil
+        }
+
+        guard hashList.count > 0 else {
+            return nil
+        }
+
+        var dict = [String: String]()
+        var a = 0
+
+        while (a < hashList.count) {
+            let field = hashList[ a ]!.string!
+            let value = hashList[ a + 1 ]!.string!
+
+            dict[ field ] = value
+            a += 2
+        }
+
+        return dict
     }
 
 
     /**
-     * Get a random username.
+     * Convert the reply of a 'HGETALL' of a post into a dictionary, with the body decompressed (see 'BodyCompression').
      */
-    func getRandomUser() throws -> String? {
-        return try self.client.command(
-            .custom("SRANDMEMBER".makeBytes()), [
-                "users"
-            ]
-        )?.string
+    func postFromReply(_ reply: Redis.Data?) -> [String: String]? {
+        guard let post = self.hashFromReply(reply) else {
+            return nil
+        }
+
+        return self.decodePost(post)
+    }
+
+
+    /**
+     * Get the body of a post back in plain text (the 'body_format' field is only used internally).
+     */
+    func decodePost(_ post: [String: String]) -> [String: String] {
+        var post = post
+
+        if let format = post.removeValue(forKey: "body_format") {
+            post[ "body" ] = BodyCompression.decode(post[ "body" ] ?? "", format: format)
+        }
+
+        return post
+    }
+
+
+    /**
+     * Get the information of the given user.
+     */
+    func getUser(name: String) -> [String: String]? {
+        return self.getHash(key: self.key("user_\(name)"))
+    }
+
+
+    /**
+     * Get the username associated with the given token.
+     * When it isn't in the cache it's read from a replica, but if it isn't there the primary is checked as well (the token may have been created just now).
+     * A lagging replica could still have a token that was just removed, so what was read from a replica is only cached for as long as the replicas can lag behind (see 'ReplicaSet.cacheTTL()').
+     */
+    func getUserName(token: String) throws -> String? {
+        if let username = self.tokenCache.get(self.key(token)) {
+            return username
+        }
+
+        let removals = self.tokenCache.removals()
+        var readOnly = true
+        var replies = try self.getToken(token, readOnly: true)
+
+        if replies[ 0 ]?.string == nil && self.replicas.enabled {
+            readOnly = false
+            replies = try self.getToken(token)
+        }
+
+        guard let username = replies[ 0 ]?.string else {
+            return nil
+        }
+
+            // don't keep it in the cache for longer than the token is valid
+        let expiresIn = replies[ 1 ]?.int ?? 0
+        let ttl: TimeInterval? = readOnly ? self.replicas.cacheTTL(self.tokenCacheTTL) : self.tokenCacheTTL
+
+        if expiresIn > 0, let ttl = ttl {
+            self.tokenCache.set(self.key(token), username, ttl: min(ttl, TimeInterval( expiresIn )), removals: removals)
+        }
+
+        return username
+    }
+
+
+    /**
+     * Get the username of a token, and the time (in seconds) until the token expires.
+     */
+    private func getToken(_ token: String, readOnly: Bool = false) throws -> [Redis.Data?] {
+        let key = self.key("token_\(token)")
+
+        return try self.withClient(readOnly: readOnly) { client in
+            try TracedPipeline(client: client)
+                .enqueue(.get, [ key ])
+                .enqueue(.custom("TTL".makeBytes()), [ key ])
+                .execute()
+        }
+    }
+
+
+    /**
+     * Generate the token to be used to authenticate a user.
+     */
+    func generateUserToken(username: String) throws -> String {
+        let token = UUID().uuidString
+        let oneDaySeconds = 86_400  // expire the token after 1 day
+        let key = self.key("token_\(token)")
+        let userTokensKey = self.key("user_tokens_\(username)")
+        let expiresAt = Int( Date().timeIntervalSince1970 ) + oneDaySeconds
+
+        try self.withClient { client in
+            try TracedPipeline(client: client)
+                .enqueue(
+                    .custom("MULTI".makeBytes())
+                )
+                .enqueue(
+                    .set, [
+                        key,
+                        username
+                    ]
+                )
+                .enqueue(
+                    .custom("EXPIRE".makeBytes()), [
+                        key,
+                        String( oneDaySeconds )
+                    ]
+                )
+                .enqueue(
+                    .custom("ZADD".makeBytes()), [
+                        userTokensKey,
+                        String( expiresAt ),
+                        token
+                    ]
+                )
+                    // the newest token is the last one to expire, so the whole set can go away then
+                .enqueue(
+                    .custom("EXPIRE".makeBytes()), [
+                        userTokensKey,
+                        String( oneDaySeconds )
+                    ]
+                )
+                .enqueue(
+                    .custom("EXEC".makeBytes())
+                )
+                .execute()
+        }
+
+        return token
+    }
+
+
+    /**
+     * Remove all the tokens associated with the given user.
+     */
+    func removeAllTokens(username: String) throws {
+        let userTokensKey = self.key("user_tokens_\(username)")
+        let tokens = try self.command(
+            .custom("ZRANGE".makeBytes()), [
+                userTokensKey,
+                "0",
+                "-1"
+            ])?.array ?? []
+
+        var removed = [String]()
+
+        for tokenObj in tokens {
+            if let token = tokenObj?.string {
+                removed.append(token)
+            }
+        }
+
+        guard removed.count > 0 else {
+            return
+        }
+
+        try self.withClient { client in
+            try TracedPipeline(client: client)
+                .enqueue(
+                    .custom("MULTI".makeBytes())
+                )
+                .enqueue(
+                    .custom("DEL".makeBytes()), removed.map { self.key("token_\($0)") }
+                )
+                .enqueue(
+                    .custom("ZREM".makeBytes()), [ userTokensKey ] + removed
+                )
+                .enqueue(
+                    .custom("EXEC".makeBytes())
+                )
+                .execute()
+        }
+
+        try self.invalidateCache("token", keys: removed)
+    }
+
+
+    /**
+     * Generic function, iterate over all the keys that match the pattern (with 'SCAN', so redis isn't blocked).
+     * The keys are given in batches to the 'handler' function.
+     */
+    func scanKeys(match pattern: String, handler: ([String]) throws -> Void) throws {
+        try self.scan("SCAN", params: [ "MATCH", pattern ], handler: handler)
+    }
+
+
+    /**
+     * Generic function, iterate over all the members of a set (with 'SSCAN', so neither redis nor the server need to hold the whole set at once).
+     * The members are given in batches to the 'handler' function.
+     */
+    func scanSet(key: String, handler: ([String]) throws -> Void) throws {
+        try self.scan("SSCAN", key: key, readOnly: true, handler: handler)
+    }
+
+
+    /**
+     * Run one of the 'SCAN' family of commands until the whole collection was iterated.
+     * A cursor only makes sense in the server that returned it, so with 'readOnly' the whole iteration goes to the same replica (or to the primary, when there's none available).
+     * If that replica fails before the first batch, the iteration starts over in the primary. After that the error is thrown (restarting would give the same members twice).
+     */
+    private func scan(_ command: String, key: String? = nil, params: [String] = [], readOnly: Bool = false, handler: ([String]) throws -> Void) throws {
+        var cursor = "0"
+        var replica = readOnly ? self.replicas.next() : nil
+
+        while true {
+            let arguments = (key != nil ? [ key! ] : []) + [ cursor ] + params + [ "COUNT", "500" ]
+            let reply: [Redis.Data?]
+
+                // without a replica, every iteration goes to the primary (not to a replica that became available in the meantime)
+            do {
+                reply = try self.command(.custom(command.makeBytes()), arguments, readOnly: replica != nil, pinned: replica)?.array ?? []
+            }
+
+            catch where replica != nil && cursor == "0" {
+                replica = nil
+                continue
+            }
+
+            guard reply.count == 2, let nextCursor = reply[ 0 ]?.string else {
+                return
+            }
+
+            var members = [String]()
+
+            for member in reply[ 1 ]?.array ?? [] {
+                if let value = member?.string {
+                    members.append( value )
+                }
+            }
+
+            if members.count > 0 {
+                try handler(members)
+            }
+
+            guard nextCursor != "0" else {
+                return
+            }
+
+            cursor = nextCursor
+        }
+    }
+
+
+    /**
+     * Remove the expired tokens of all the users, a batch of "user_tokens_*" keys at a time.
+     * Other keys match the pattern as well (the hash of a user named "tokens_*", the "rate_limit_user_tokens_*" buckets, etc), so only the sorted sets are swept.
+     * Returns the number of tokens removed.
+     */
+    @discardableResult
+    func sweepExpiredTokens() throws -> Int {
+        let now = String( Int( Date().timeIntervalSince1970 ) )
+        var removed = 0
+
+            // include the keys of all the namespaces
+        try self.scanKeys(match: "*user_tokens_*") {
+            keys in
+
+            let types = try self.withClient { (client: TCPClient) -> [Redis.Data?] in
+                let pipeline = TracedPipeline(client: client)
+
+                for key in keys {
+                    try pipeline.enqueue(.custom("TYPE".makeBytes()), [ key ])
+                }
+
+                return try pipeline.execute()
+            }
+
+            let sortedSets = zip(keys, types).flatMap { $0.1?.string == "zset" ? $0.0 : nil }
+
+            guard sortedSets.count > 0 else {
+                return
+            }
+
+            let replies = try self.withClient { (client: TCPClient) -> [Redis.Data?] in
+                let pipeline = TracedPipeline(client: client)
+
+                for key in sortedSets {
+                    try pipeline.enqueue(.custom("ZREMRANGEBYSCORE".makeBytes()), [ key, "-inf", now ])
+                }
+
+                return try pipeline.execute()
+            }
+
+            removed += replies.reduce(0) { $0 + ($1?.int ?? 0) }
+        }
+
+        self.sweepLock.lock()
+        self.sweeps += 1
+        self.sweptTokens += removed
+        self.sweepLock.unlock()
+
+        return removed
+    }
+
+
+    func tokenSweeperStats() -> [String: Any] {
+        self.sweepLock.lock()
+        defer { self.sweepLock.unlock() }
+
+        var stats = [String: Any]()
+        stats["interval"] = self.tokenSweepInterval
+        stats["sweeps"] = self.sweeps
+        stats["removed_tokens"] = self.sweptTokens
+
+        return stats
+    }
+
+
+    /**
+     * Periodically remove the expired tokens, in a background thread.
+     * The interval (in seconds) can be set with the 'TOKEN_SWEEP_INTERVAL' environment variable.
+     */
+    func startTokenSweeper() {
+        let thread = Thread {
+            while true {
+                Thread.sleep(forTimeInterval: self.tokenSweepInterval)
+
+                do {
+                    try self.sweepExpiredTokens()
+                }
+
+                catch {
+                    Log.error("Failed to remove the expired tokens: \(error)")
+                }
+            }
+        }
+
+        thread.name = "token_sweeper"
+        thread.start()
+    }
+
+
+    /**
+     * Periodically check the health and replication lag of the replicas (see 'ReplicaSet'), in a background thread.
+     * Each check sets the current time in the "replica_heartbeat" key of the primary, and then reads it back from every replica.
+     * The interval (in seconds) can be set with the 'REDIS_REPLICA_CHECK_INTERVAL' environment variable.
+     */
+    func startReplicaMonitor() {
+        guard self.replicas.enabled else {
+            return
+        }
+
+        let interval = TimeInterval(ProcessInfo.processInfo.environment["REDIS_REPLICA_CHECK_INTERVAL"] ?? "1") ?? 1
+        let heartbeatKey = self.key("replica_heartbeat")
+        let thread = Thread {
+            while true {
+                let now = Date().timeIntervalSince1970
+
+                do {
+                    try self.command(.set, [ heartbeatKey, String( now ) ])
+                    self.replicas.check(heartbeatKey: heartbeatKey, writtenAt: now)
+                }
+
+                catch {
+                    Log.error("Failed to check the redis replicas: \(error)")
+                }
+
+                Thread.sleep(forTimeInterval: interval)
+            }
+        }
+
+        thread.name = "replica_monitor"
+        thread.start()
+    }
+
+
+    /**
+     * The "user_tokens_*" keys used to be sets, convert them to sorted sets (scored by the expiration time of each token).
+     * Only needed once for databases created before the change.
+     */
+    func migrateTokenSets() throws {
+        let now = Int( Date().timeIntervalSince1970 )
+
+        try self.scanKeys(match: self.key("user_tokens_*")) {
+            keys in
+
+            for key in keys {
+                guard try self.command(.custom("TYPE".makeBytes()), [ key ])?.string == "set" else {
+                    continue
+                }
+
+                Log.info("Converting '\(key)' to a sorted set.")
+
+                var params = [ "\(key)_migration" ]
+
+                for token in try self.getAllSetMembers(key: key) {
+                    let expiresIn = try self.command(.custom("TTL".makeBytes()), [ self.key("token_\(token)") ])?.int ?? -2
+
+                    if expiresIn > 0 {
+                        params.append( String( now + expiresIn ) )
+                        params.append( token )
+                    }
+                }
+
+                if params.count > 1 {
+                    try self.command(.custom("ZADD".makeBytes()), params)
+                    try self.command(.custom("RENAME".makeBytes()), [ params[ 0 ], key ])
+                }
+
+                else {
+                    try self.command(.custom("DEL".makeBytes()), [ key ])
+                }
+            }
+        }
+    }
+
+
+    /**
+     * Add several blog posts at once (for importing content).
+     * A block of consecutive ids is reserved with a single 'INCRBY', and then all the posts are written in a single transaction.
+     * Returns the ids of the new posts (in the same order).
+     */
+    func addBlogPosts(username: String, posts: [(title: String, body: String)]) throws -> [Int] {
+        guard posts.count > 0 else {
+            return []
+        }
+
+        let reserve = try self.withClient { client in
+            try TracedPipeline(client: client)
+                .enqueue(
+                    .custom("INCRBY".makeBytes()), [
+                        self.key("LAST_POST_ID"),
+                        String( posts.count )
+                    ]
+                )
+                .enqueue(
+                    .custom("TIME".makeBytes())
+                )
+                .execute()
+        }
+
+        guard let lastId = reserve[ 0 ]?.int, let time = reserve[ 1 ]?.array?[ 0 ]?.string, let microseconds = Int(reserve[ 1 ]?.array?[ 1 ]?.string ?? ""), let seconds = Int(time) else {
+            throw DatabaseError.unexpectedReply
+        }
+
+        let ids = Array( (lastId - posts.count + 1) ... lastId )
+
+        try self.withClient { (client: TCPClient) -> [Redis.Data?] in
+            let pipeline = TracedPipeline(client: client)
+
+            try pipeline.enqueue(.custom("MULTI".makeBytes()))
+
+            for (index, post) in posts.enumerated() {
+                let id = String( ids[ index ] )
+                let terms = getSearchTerms("\(post.title) \(post.body)")
+                let stored = BodyCompression.encode(post.body)
+                var fields = [ "title", post.title, "body", stored.body, "author", username, "last_updated", time ]
+
+                if let format = stored.format {
+                    fields += [ "body_format", format ]
+                }
+
+                try pipeline.enqueue(.custom("HMSET".makeBytes()), [ self.key("post_\(id)") ] + fields)
+                try pipeline.enqueue(.custom("SADD".makeBytes()), [ self.key("user_posts_\(username)"), id ])
+                try pipeline.enqueue(.custom("SADD".makeBytes()), [ self.key("posts"), id ])
+                try pipeline.enqueue(.custom("ZADD".makeBytes()), [ self.key("posts_index"), id, id ])
+
+                    // one microsecond apart, so they keep the order of the list in the time ordered indexes
+                let scoreMicroseconds = seconds * 1_000_000 + microseconds + index
+                let score = "\(scoreMicroseconds / 1_000_000)." + String(format: "%06d", scoreMicroseconds % 1_000_000)
+
+                try pipeline.enqueue(.custom("ZADD".makeBytes()), [ self.key("posts_by_time"), score, id ])
+                try pipeline.enqueue(.custom("ZADD".makeBytes()), [ self.key("user_posts_by_time_\(username)"), score, id ])
+
+                    // new posts, so there are no previous terms to remove (see 'Scripts.setTermsFunction')
+                if terms.count > 0 {
+                    try pipeline.enqueue(.custom("SADD".makeBytes()), [ self.key("post_terms_\(id)") ] + terms)
+
+                    for term in terms {
+                        try pipeline.enqueue(.custom("SADD".makeBytes()), [ self.key("search_\(term)"), id ])
+                    }
+                }
+            }
+
+            try pipeline.enqueue(.custom("EXEC".makeBytes()))
+
+            return try pipeline.execute()
+        }
+
+        return ids
+    }
+
+
+    /**
+     * Add a new blog post to the database.
+     * The id, the time and all the writes are done atomically in the redis server (in a single round trip).
+     */
+    func addBlogPost(username: String, title: String, body: String) throws -> Int? {
+        let stored = BodyCompression.encode(body)
+
+        return try self.runScript(
+            Scripts.addPost,
+            keys: [
+                self.key("LAST_POST_ID"),
+                self.key("user_posts_\(username)"),
+                self.key("posts"),
+                self.key("posts_index"),
+                self.key("posts_by_time"),
+                self.key("user_posts_by_time_\(username)")
+            ],
+            args: [ username, title, stored.body, self.key(""), stored.format ?? "" ] + getSearchTerms("\(title) \(body)")
+        )?.int
+    }
+
+
+    /**
+     * Update the contents of an existing blog post.
+     * Returns false if the post doesn't exist (for example, if it was removed in the meantime).
+     */
+    func updateBlogPost(id: String, title: String, body: String) throws -> Bool {
+        let stored = BodyCompression.encode(body)
+        let updated = try self.runScript(
+            Scripts.updatePost,
+            keys: [ self.key("post_\(id)") ],
+            args: [ title, stored.body, self.key(""), id, stored.format ?? "" ] + getSearchTerms("\(title) \(body)")
+        )?.int == 1
+
+        try self.invalidateCache("post", keys: [ id ])
+
+        return updated
+    }
+
+
+    /**
+     * Keep a post that was just read from the database in the cache (along with its json, see 'CachedPost').
+     * The 'removals' of the cache need to be taken before the post is read (see 'Cache.set()'), so a post that is updated in the meantime doesn't go back into the cache with its old contents.
+     * Posts that may have been read from a replica ('readOnly') are only cached for as long as the replicas can lag behind (see 'ReplicaSet.cacheTTL()'): a lagging replica can still have the previous version of a post that was just updated.
+     */
+    @discardableResult
+    func cachePost(id: String, fields: [String: String], removals: [Int], readOnly: Bool = false) -> CachedPost {
+        let post = CachedPost(id: id, fields: fields)
+
+        let ttl: TimeInterval? = readOnly ? self.replicas.cacheTTL(self.postCacheTTL) : self.postCacheTTL
+
+        if let ttl = ttl {
+            self.postCache.set(self.key(id), post, ttl: ttl, removals: removals)
+        }
+
+        return post
+    }
+
+
+    /**
+     * Get the given post, with its json already encoded.
+     * When it isn't in the cache it's read from a replica (see 'getHash()' and 'cachePost()').
+     */
+    func getCachedPost(id: String) -> CachedPost? {
+        if let post = self.postCache.get(self.key(id)) {
+            return post
+        }
+
+        let removals = self.postCache.removals()
+
+        guard let fields = self.getHash(key: self.key("post_\(id)"), readOnly: true) else {
+            return nil
+        }
+
+        return self.cachePost(id: id, fields: self.decodePost(fields), removals: removals, readOnly: true)
+    }
+
+
+    /**
+     * Get the information of several posts at once.
+     * Returns a dictionary of id -> post, posts that don't exist are not included.
+     */
+    func getBlogPosts(ids: [String]) throws -> [String: [String: String]] {
+        var posts = [String: [String: String]]()
+
+        for (id, post) in try self.getCachedPosts(ids: ids) {
+            posts[ id ] = post.fields
+        }
+
+        return posts
+    }
+
+
+    /**
+     * Get several posts at once, with their json already encoded (the ones not in the cache are fetched from a replica in a single pipeline, see 'cachePost()').
+     * The posts that aren't in the replica are checked in the primary as well (they may have been added just now).
+     * Returns a dictionary of id -> post, posts that don't exist are not included.
+     */
+    func getCachedPosts(ids: [String]) throws -> [String: CachedPost] {
+        var posts = [String: CachedPost]()
+        var missing = [String]()
+
+        for id in ids {
+            if let post = self.postCache.get(self.key(id)) {
+                posts[ id ] = post
+            }
+
+            else {
+                missing.append(id)
+            }
+        }
+
+        guard missing.count > 0 else {
+            return posts
+        }
+
+        let removals = self.postCache.removals()
+
+        for (id, fields) in try self.readPosts(ids: missing, readOnly: true) {
+            posts[ id ] = self.cachePost(id: id, fields: fields, removals: removals, readOnly: true)
+        }
+
+        missing = missing.filter { posts[ $0 ] == nil }
+
+        if missing.count > 0 && self.replicas.enabled {
+            for (id, fields) in try self.readPosts(ids: missing) {
+                posts[ id ] = self.cachePost(id: id, fields: fields, removals: removals)
+            }
+        }
+
+        return posts
+    }
+
+
+    /**
+     * Read several posts from the database in a single pipeline (see 'postFromReply()').
+     */
+    private func readPosts(ids: [String], readOnly: Bool = false) throws -> [(id: String, fields: [String: String])] {
+        let replies = try self.withClient(readOnly: readOnly) { (client: TCPClient) -> [Redis.Data?] in
+            let pipeline = TracedPipeline(client: client)
+
+            for id in ids {
+                try pipeline.enqueue(.custom("HGETALL".makeBytes()), [ self.key("post_\(id)") ])
+            }
+
+            return try pipeline.execute()
+        }
+
+        var posts = [(id: String, fields: [String: String])]()
+
+        for (index, id) in ids.enumerated() {
+            if let fields = self.postFromReply(replies[ index ]) {
+                posts.append((id: id, fields: fields))
+            }
+        }
+
+        return posts
+    }
+
+
+    /**
+     * Number of posts made by the user.
+     */
+    func countUserPosts(username: String) throws -> Int {
+        return try self.command(.custom("SCARD".makeBytes()), [ self.key("user_posts_\(username)") ], readOnly: true)?.int ?? 0
+    }
+
+
+    /**
+     * Iterate over the ids of all the posts made by the user, a batch at a time.
+     */
+    func scanUserPosts(username: String, handler: ([String]) throws -> Void) throws {
+        try self.scanSet(key: self.key("user_posts_\(username)"), handler: handler)
+    }
+
+
+    /**
+     * Iterate over the ids of all the posts, a batch at a time (in no particular order).
+     */
+    func scanAllPosts(handler: ([String]) throws -> Void) throws {
+        try self.scanSet(key: self.key("posts"), handler: handler)
+    }
+
+
+    /**
+     * Iterate over all the usernames, a batch at a time (in no particular order).
+     */
+    func scanAllUsers(handler: ([String]) throws -> Void) throws {
+        try self.scanSet(key: self.key("users"), handler: handler)
+    }
+
+
+    /**
+     * Remove a blog post from the database.
+     */
+    func removePost(username: String, id: String) throws -> Bool {
+        try self.runScript(
+            Scripts.removePost,
+            keys: [
+                self.key("user_posts_\(username)"),
+                self.key("posts"),
+                self.key("posts_index"),
+                self.key("post_\(id)"),
+                self.key("posts_by_time"),
+                self.key("user_posts_by_time_\(username)")
+            ],
+            args: [ self.key(""), id ]
+        )
+
+        try self.invalidateCache("post", keys: [ id ])
+
+        return true
+    }
+
+
+    /**
+     * Find the posts that have the terms of the query (see 'getSearchTerms()').
+     * The results are ranked by the number of matched terms, and then by the most recent.
+     * Returns the total number of posts found, and the ids (and number of matched terms) of the posts in the requested page.
+     * Runs in the primary, since the search script ranks the posts in a temporary key.
+     */
+    func searchPosts(query: String, offset: Int, limit: Int) throws -> (total: Int, results: [(id: String, matches: Int)]) {
+        let terms = getSearchTerms(query, limit: 10)
+
+        guard terms.count > 0 else {
+            return (0, [])
+        }
+
+        let reply = try self.runScript(
+            Scripts.search,
+            keys: [],
+            args: [ self.key(""), String( offset ), String( limit ) ] + terms
+        )?.array ?? []
+
+        guard reply.count == 2, let total = reply[ 0 ]?.int, let page = reply[ 1 ]?.array else {
+            return (0, [])
+        }
+
+        var results = [(id: String, matches: Int)]()
+        var index = 0
+
+        while index + 1 < page.count {
+            if let id = page[ index ]?.string, let matches = page[ index + 1 ]?.int {
+                results.append((id: id, matches: matches))
+            }
+
+            index += 2
+        }
+
+        return (total, results)
+    }
+
+
+    /**
+     * Index the terms of all the existing posts again (for posts added before the search was available, for example).
+     * Returns the number of posts indexed.
+     */
+    func rebuildSearchIndex() throws -> Int {
+        var count = 0
+        var cursor: String?
+
+        repeat {
+            let page = try self.getPostsPage(limit: 500, cursor: cursor)
+
+            for (id, post) in try self.getBlogPosts(ids: page.members) {
+                try self.runScript(
+                    Scripts.indexPost,
+                    keys: [],
+                    args: [ self.key(""), id ] + getSearchTerms("\(post["title"]!) \(post["body"]!)")
+                )
+                count += 1
+            }
+
+            cursor = page.nextCursor
+
+        } while cursor != nil
+
+        return count
+    }
+
+
+    /**
+     * Compress the body of the existing posts that are still in plain text (see 'BodyCompression'), a page of posts at a time.
+     * Posts that are changed in the meantime are left alone (they were already stored in the right format).
+     * Returns the number of posts compressed.
+     */
+    func compressPosts() throws -> Int {
+        var count = 0
+        var cursor: String?
+
+        repeat {
+            let page = try self.getPostsPage(limit: 500, cursor: cursor)
+            let replies = try self.withClient { (client: TCPClient) -> [Redis.Data?] in
+                let pipeline = TracedPipeline(client: client)
+
+                for id in page.members {
+                    try pipeline.enqueue(.custom("HMGET".makeBytes()), [ self.key("post_\(id)"), "body", "body_format" ])
+                }
+
+                return try pipeline.execute()
+            }
+
+            for (index, id) in page.members.enumerated() {
+                guard let fields = replies[ index ]?.array, fields.count == 2, let body = fields[ 0 ]?.string, fields[ 1 ]?.string == nil else {
+                    continue
+                }
+
+                let stored = BodyCompression.encode(body)
+
+                guard let format = stored.format else {
+                    continue
+                }
+
+                let replaced = try self.runScript(
+                    Scripts.replaceBody,
+                    keys: [ self.key("post_\(id)") ],
+                    args: [ body, stored.body, format ]
+                )?.int == 1
+
+                if replaced {
+                    count += 1
+                }
+            }
+
+            cursor = page.nextCursor
+
+        } while cursor != nil
+
+        return count
+    }
+
+
+    /**
+     * Measure the memory used by the posts (with 'MEMORY USAGE'), to check how much the compression saves.
+     */
+    func postsMemoryReport() throws -> [String: Int] {
+        var report = [ "posts": 0, "compressed": 0, "posts_memory": 0, "body_bytes": 0 ]
+        var cursor: String?
+
+        repeat {
+            let page = try self.getPostsPage(limit: 500, cursor: cursor)
+            let replies = try self.withClient { (client: TCPClient) -> [Redis.Data?] in
+                let pipeline = TracedPipeline(client: client)
+
+                for id in page.members {
+                    try pipeline.enqueue(.custom("MEMORY".makeBytes()), [ "USAGE", self.key("post_\(id)") ])
+                    try pipeline.enqueue(.custom("HSTRLEN".makeBytes()), [ self.key("post_\(id)"), "body" ])
+                    try pipeline.enqueue(.custom("HEXISTS".makeBytes()), [ self.key("post_\(id)"), "body_format" ])
+                }
+
+                return try pipeline.execute()
+            }
+
+            for index in 0 ..< page.members.count {
+                guard let memory = replies[ index * 3 ]?.int else {
+                    continue
+                }
+
+                report[ "posts" ]! += 1
+                report[ "posts_memory" ]! += memory
+                report[ "body_bytes" ]! += replies[ index * 3 + 1 ]?.int ?? 0
+                report[ "compressed" ]! += replies[ index * 3 + 2 ]?.int ?? 0
+            }
+
+            cursor = page.nextCursor
+
+        } while cursor != nil
+
+        let info = try self.command(.custom("INFO".makeBytes()), [ "memory" ])?.string ?? ""
+
+        for line in info.split(separator: "\r\n") where line.hasPrefix("used_memory:") {
+            report[ "used_memory" ] = Int(line.split(separator: ":")[ 1 ])
+        }
+
+        return report
+    }
+
+
+    /**
+     * Get up to 'count' random posts (different from each other), in a single round trip.
+     * Returns a list of (id, post), which is shorter than 'count' if there aren't enough posts.
+     */
+    func getRandomPosts(count: Int) throws -> [(id: String, post: CachedPost)] {
+        let removals = self.postCache.removals()
+        let reply = try self.runScript(
+            Scripts.randomPosts,
+            keys: [ self.key("posts") ],
+            args: [ self.key(""), String( count ) ],
+            readOnly: true
+        )?.array ?? []
+
+        var posts = [(id: String, post: CachedPost)]()
+        var index = 0
+
+        while index + 1 < reply.count {
+            if let id = reply[ index ]?.string, let fields = self.postFromReply(reply[ index + 1 ]) {
+                posts.append((id: id, post: self.cachePost(id: id, fields: fields, removals: removals, readOnly: true)))
+            }
+
+            index += 2
+        }
+
+        return posts
+    }
+
+
+    /**
+     * Get the most recently added/updated posts, newest first (of all the users, or only of the given user), with their contents in a single round trip.
+     * Only the posts older than 'before' are included, when given. To get the next page, pass the returned 'nextBefore'.
+     */
+    func getFeed(username: String?, limit: Int, before: String?) throws -> (posts: [(id: String, post: CachedPost)], nextBefore: String?) {
+        let key = username != nil ? self.key("user_posts_by_time_\(username!)") : self.key("posts_by_time")
+        let removals = self.postCache.removals()
+        let reply = try self.runScript(
+            Scripts.feed,
+            keys: [ key ],
+            args: [ self.key(""), before ?? "+inf", String( limit ) ],
+            readOnly: true
+        )?.array ?? []
+
+        guard reply.count == 2, let list = reply[ 1 ]?.array else {
+            return ([], nil)
+        }
+
+        var posts = [(id: String, post: CachedPost)]()
+        var index = 0
+
+        while index + 1 < list.count {
+            if let id = list[ index ]?.string, let fields = self.postFromReply(list[ index + 1 ]) {
+                posts.append((id: id, post: self.cachePost(id: id, fields: fields, removals: removals, readOnly: true)))
+            }
+
+            index += 2
+        }
+
+        let nextBefore = reply[ 0 ]?.string ?? ""
+
+        return (posts, nextBefore.isEmpty ? nil : nextBefore)
+    }
+
+
+    /**
+     * Get a page of blog post ids (in ascending order), starting after the 'cursor' id.
+     */
+    func getPostsPage(limit: Int, cursor: String?) throws -> (members: [String], nextCursor: String?) {
+        return try self.getSortedSetPage(key: self.key("posts_index"), limit: limit, cursor: cursor, byLex: false)
+    }
+
+
+    /**
+     * Take 'cost' tokens from the given rate limit buckets (see 'RateLimiter').
+     * Returns 0 if the tokens were taken, otherwise the number of seconds until there are enough tokens.
+     */
+    func takeRateLimitTokens(buckets: [String], cost: Int, capacity: Int, refillRate: Double) throws -> Double {
+            // not a write of the request itself, so the reads that follow can still go to the replicas
+        let primaryOnly = ReplicaSet.primaryOnly
+        defer { ReplicaSet.primaryOnly = primaryOnly }
+
+        let reply = try self.runScript(
+            Scripts.rateLimit,
+            keys: buckets.map { self.key("rate_limit_\($0)") },
+            args: [ String( capacity ), String( refillRate ), String( cost ) ]
+        )
+
+        return Double(reply?.string ?? "") ?? 0
+    }
+
+
+    /**
+     * Get up to 'count' random users (different from each other) and the ids of their posts, in a single round trip.
+     */
+    func getRandomUsers(count: Int) throws -> [(username: String, posts: [String])] {
+        let reply = try self.runScript(
+            Scripts.randomUsers,
+            keys: [ self.key("users") ],
+            args: [ self.key(""), String( count ) ],
+            readOnly: true
+        )?.array ?? []
+
+        var users = [(username: String, posts: [String])]()
+        var index = 0
+
+        while index + 1 < reply.count {
+            if let username = reply[ index ]?.string, let posts = reply[ index + 1 ]?.array {
+                users.append((username: username, posts: posts.flatMap { $0?.string }))
+            }
+
+            index += 2
+        }
+
+        return users
     }
-}
\ No newline at end of file
+}
@@ -0,0 +1,106 @@
+import Foundation
+import LoggerAPI
+
+
+enum PasswordHasherError: Error {
+    case busy
+}
+
+
+/**
+ * Runs the password hashing in a dedicated, size limited, pool of workers.
+ * Hashing is expensive (see 'getPasswordHash()'), so we limit how many run at the same time, and how many are waiting in the queue.
+ * When the queue is full the request is rejected right away, instead of piling up and starving the other requests.
+ */
+class PasswordHasher {
+    let workers: Int
+    let queueSize: Int
+
+    private let queue = OperationQueue()
+    private let lock = NSLock()
+    private var pending = 0     // number of hashes waiting in the queue or being computed
+    private var completed = 0
+    private var rejected = 0
+    private var totalWaitTime: TimeInterval = 0
+    private var totalHashTime: TimeInterval = 0
+
+
+    /**
+     * By default use one worker per core, and allow up to 4 queued hashes per worker.
+     * Can be changed with the 'HASH_WORKERS' / 'HASH_QUEUE_SIZE' environment variables.
+     */
+    init() {
+        let environment = ProcessInfo.processInfo.environment
+        let cores = ProcessInfo.processInfo.activeProcessorCount
+
+        self.workers = max(Int(environment["HASH_WORKERS"] ?? "") ?? cores, 1)
+        self.queueSize = max(Int(environment["HASH_QUEUE_SIZE"] ?? "") ?? self.workers * 4, 0)
+
+        self.queue.name = "password_hasher"
+        self.queue.maxConcurrentOperationCount = self.workers
+    }
+
+
+    /**
+     * Hash a password in one of the workers (blocks until it's done).
+     * Throws 'PasswordHasherError.busy' if there's no more room in the queue.
+     */
+    func hash(password: String, salt: String) throws -> String {
+        self.lock.lock()
+
+        guard self.pending < self.workers + self.queueSize else {
+            self.rejected += 1
+            self.lock.unlock()
+
+            Log.warning("Password hashing queue is full, rejecting the request.")
+            throw PasswordHasherError.busy
+        }
+
+        self.pending += 1
+        self.lock.unlock()
+
+        let done = DispatchSemaphore(value: 0)
+        let queuedAt = Date()
+        var hash = ""
+
+        self.queue.addOperation {
+            let startedAt = Date()
+            hash = getPasswordHash(string: password, salt: salt)
+            let finishedAt = Date()
+
+            self.lock.lock()
+            self.pending -= 1
+            self.completed += 1
+            self.totalWaitTime += startedAt.timeIntervalSince(queuedAt)
+            self.totalHashTime += finishedAt.timeIntervalSince(startedAt)
+            self.lock.unlock()
+
+            done.signal()
+        }
+
+        done.wait()
+        return hash
+    }
+
+
+    /**
+     * Current state of the workers, used to size the pool.
+     * The times are averages, in milliseconds.
+     */
+    func stats() -> [String: Any] {
+        self.lock.lock()
+        defer { self.lock.unlock() }
+
+        var stats = [String: Any]()
+        stats["workers"] = self.workers
+        stats["queue_size"] = self.queueSize
+        stats["queue_depth"] = max(self.pending - self.workers, 0)
+        stats["in_progress"] = min(self.pending, self.workers)
+        stats["completed"] = self.completed
+        stats["rejected"] = self.rejected
+        stats["average_wait_ms"] = self.completed > 0 ? self.totalWaitTime * 1000 / Double(self.completed) : 0
+        stats["average_hash_ms"] = self.completed > 0 ? self.totalHashTime * 1000 / Double(self.completed) : 0
+
+        return stats
+    }
+}
@@ -6,10 +6,45 @@ import Foundation
 
 HeliumLogger.use()
 let DB = Database()
+let HASHER = PasswordHasher()
+let METRICS = Metrics()
+let LIMITER = RateLimiter()
+
+do {
+    try DB.buildIndexes()
+    try DB.migrateTokenSets()
+    try DB.loadScripts()
+}
+
+catch {
+    Log.error("Failed to prepare the database: \(error)")
+    exit(1)
+}
+
+    // run an administrative command instead of the server
+if CommandLine.arguments.count > 1 {
+    do {
+        try runCommand(Array( CommandLine.arguments.dropFirst() ))
+        exit(0)
+    }
+
+    catch {
+        Log.error("Command failed: \(error)")
+        exit(1)
+    }
+}
+
+DB.listenCacheInvalidations()
+DB.startTokenSweeper()
+DB.startReplicaMonitor()
 
 
 let router = Router()
+router.all(middleware: MetricsMiddleware())
+router.all(middleware: TracingMiddleware())
+router.all(middleware: NamespaceMiddleware())
 router.all(middleware: BodyParser())
+router.all(middleware: RateLimitMiddleware())
 
 
 /**
@@ -43,7 +78,16 @@ router.post("/user/create") {
     }
 
         // create the user
-    guard let _ = try? DB.addUser(name: username, password: password) else {
+    do {
+        _ = try DB.addUser(name: username, password: password)
+    }
+
+    catch PasswordHasherError.busy {
+        try serverBusy(response)
+        return
+    }
+
+    catch {
         try unsuccessfulRequest("Failed to create the user.", response, .internalServerError)
         return
     }
@@ -69,8 +113,6 @@ router.post("/user/login") {
     guard let password = try validatePassword(params["password"]!, response)                else { return }
     guard                try authenticateUser(username, password, response)                 else { return }
 
-    try DB.cleanUserTokens(username: username)
-
         // make a new token and send it back to the user
     var result = [String: Any]()
     result["success"] = true
@@ -92,13 +134,12 @@ router.post("/user/remove") {
     guard let password = try validatePassword(params["password"]!, response)                else { return }
     guard                try authenticateUser(username, password, response)                 else { return }
 
-    guard try DB.removeUser(name: username) else {
-        try unsuccessfulRequest("Failed to remove the user.", response, .notFound)
-        return
-    }
+    let removed = try DB.removeUser(name: username)
 
     var result = [String: Any]()
     result["success"] = true
+    result["removed_posts"] = removed.posts
+    result["removed_tokens"] = removed.tokens
 
     try response.status(.OK).send(json: result).end()
 }
@@ -117,14 +158,21 @@ router.post("/user/change_password") {
     guard let newPassword = try validatePassword(params["newPassword"]!, response) else { return }
     guard                   try authenticateUser(username, password, response) else     { return }
 
-        // remove all previous tokens (they're invalidated due to the password change)
-    try DB.removeAllTokens(username: username)
+    do {
+        guard try DB.addUser(name: username, password: newPassword) else {
+            try unsuccessfulRequest("Failed to change the password.", response, .internalServerError)
+            return
+        }
+    }
 
-    guard try DB.addUser(name: username, password: newPassword) else {
-        try unsuccessfulRequest("Failed to change the password.", response, .internalServerError)
+    catch PasswordHasherError.busy {
+        try serverBusy(response)
         return
     }
 
+        // remove all previous tokens (they're invalidated due to the password change)
+    try DB.removeAllTokens(username: username)
+
     var result = [String: Any]()
     result["success"] = true
     result["token"] = try DB.generateUserToken(username: username)
@@ -156,43 +204,59 @@ router.post("/user/invalidate_tokens") {
 
 
 /**
- * Get a list with all the users name.
+ * Get a list with the users name (in alphabetical order, a page at a time).
+ * With 'all=1', all the users are sent instead (in no particular order).
+ * Arguments: 'limit' / 'cursor' / 'all' (optional)
  */
 router.get("/user/getall") {
     request, response, next in
 
-    guard let users = try? DB.getAllUsers() else {
-        try unsuccessfulRequest("Failed to get all the users.", response, .notFound)
+    if request.queryParameters["all"] == "1" {
+        try sendList("users", response) {
+            handler in try DB.scanAllUsers(handler: handler)
+        }
         return
     }
 
-    var result = [String: Any]()
-    result["success"] = true
-    result["users"] = users
+    guard let (limit, cursor) = try getPageParameters(request, response) else { return }
 
-    try response.status(.OK).send(json: result).end()
+    guard let page = try? DB.getUsersPage(limit: limit, cursor: cursor) else {
+        try unsuccessfulRequest("Failed to get all the users.", response, .notFound)
+        return
+    }
+
+    try sendJSON(try JSONEncoder().encode(IdsPage("users", page)), response)
 }
 
 
 /**
  * Get a random username, and a list of ids of posts made by the selected user.
+ * With 'count', a list of (different) random users is sent instead, in 'users'.
+ * Arguments: 'count' (optional, between 1 and 100)
  */
 router.get("/user/random") {
     request, response, next in
 
-    guard let username = try DB.getRandomUser() else {
-        try unsuccessfulRequest("No user available", response, .notFound)
-        return
-    }
+    guard let count = try getCountParameter(request, response) else { return }
+
+    let users = try DB.getRandomUsers(count: count)
 
-    guard let postsList = try? DB.getUserPosts(username: username) else {
+    guard users.count > 0 else {
+        try unsuccessfulRequest("No user available", response, .notFound)
         return
     }
 
     var result = [String: Any]()
     result["success"] = true
-    result["username"] = username
-    result["posts_ids"] = postsList
+
+    if request.queryParameters["count"] == nil {
+        result["username"] = users[ 0 ].username
+        result["posts_ids"] = users[ 0 ].posts
+    }
+
+    else {
+        result["users"] = users.map { [ "username": $0.username, "posts_ids": $0.posts ] }
+    }
 
     try response.status(.OK).send(json: result).end()
 }
@@ -219,6 +283,53 @@ router.post("/blog/add") {
 }
 
 
+/**
+ * Add several posts at once (up to 1000), for importing content.
+ * Each post is validated like in '/blog/add', and the result of each one is returned in 'results' (in the same order).
+ * Arguments: 'token' / 'posts' (json array of '{ "title": ..., "body": ... }' objects)
+ */
+router.post("/blog/bulk_add") {
+    request, response, next in
+
+    guard let params   = try getPostParameters(["token", "posts"], request, response) else { return }
+    guard let username = try validateToken(params, response)                          else { return }
+    guard let list     = try validatePostsList(params["posts"]!, 1000, response)      else { return }
+
+    var results = [[String: Any]]()
+    var valid = [(title: String, body: String)]()
+
+    for element in list {
+        guard let post = element else {
+            results.append([ "success": false, "message": "Each post needs a 'title' and a 'body'." ])
+            continue
+        }
+
+        if let message = checkTitleBody(post.title, post.body) {
+            results.append([ "success": false, "message": message ])
+            continue
+        }
+
+        results.append([ "success": true ])
+        valid.append(post)
+    }
+
+    let ids = try DB.addBlogPosts(username: username, posts: valid)
+    var index = 0
+
+    for position in 0 ..< results.count where results[ position ]["success"] as! Bool {
+        results[ position ]["post_id"] = ids[ index ]
+        index += 1
+    }
+
+    var result = [String: Any]()
+    result["success"] = true
+    result["added"] = ids.count
+    result["results"] = results
+
+    try response.status(.OK).send(json: result).end()
+}
+
+
 /**
  * Get a specific blog post.
  * Arguments: 'blogId'
@@ -227,16 +338,71 @@ router.get("/blog/get/:blogId") {
     request, response, next in
 
     guard let blogId = try validateBlogId(request, response)  else { return }
-    guard let post   = try validateBlogPost(blogId, response) else { return }
+    guard let post   = try validateCachedPost(blogId, response) else { return }
 
-    var result = [String: Any]()
-    result["success"] = true
-    result["post"] = post
+    let etag = post.etag
 
-    try response.status(.OK).send(json: result).end()
+    response.headers["ETag"] = etag
+    response.headers["Cache-Control"] = "no-cache"
+
+        // the client already has the latest version
+    if etagMatches(request.headers["If-None-Match"], etag) {
+        try response.status(.notModified).end()
+        return
+    }
+
+    var result = JSONObject()
+    try result.append("success", true)
+    try result.append("post", json: post.json)
+
+    try sendJSON(result.encoded(), response)
 }
 
 
+/**
+ * Get several blog posts at once.
+ * The posts that weren't found are listed in 'missing'.
+ * Arguments: 'ids' (comma separated list, in the query string or in the body)
+ */
+let getManyPosts: RouterHandler = {
+    request, response, next in
+
+    let idsString: String
+
+    if request.method == .post {
+        guard let params = try getPostParameters(["ids"], request, response) else { return }
+        idsString = params["ids"]!
+    }
+
+    else {
+        guard let ids = request.queryParameters["ids"] else {
+            try unsuccessfulRequest("Missing 'ids' argument.", response, .badRequest)
+            return
+        }
+        idsString = ids
+    }
+
+    guard let ids = try validateBlogIds(idsString, response) else { return }
+
+    let posts = try DB.getCachedPosts(ids: ids)
+    var found = JSONObject()
+
+    for (id, post) in posts {
+        try found.append(id, json: post.json)
+    }
+
+    var result = JSONObject()
+    try result.append("success", true)
+    try result.append("posts", json: found.encoded())
+    try result.append("missing", ids.filter { posts[ $0 ] == nil })
+
+    try sendJSON(result.encoded(), response)
+}
+
+router.get("/blog/get_many", handler: getManyPosts)
+router.post("/blog/get_many", handler: getManyPosts)
+
+
 /**
  * Remove a blog post.
  * Arguments: 'token' / 'blogId'
@@ -277,11 +443,16 @@ router.post("/blog/update") {
     guard let post          = try validateBlogPost(params["blogId"]!, response) else { return }
     guard                     try validateAuthor(post, username, response)      else { return }
 
-    guard let _ = try? DB.updateBlogPost(id: params["blogId"]!, title: title, body: body) else {
+    guard let updated = try? DB.updateBlogPost(id: params["blogId"]!, title: title, body: body) else {
         try unsuccessfulRequest("Failed to update the post.", response, .internalServerError)
         return
     }
 
+    guard updated else {
+        try unsuccessfulRequest("Didn't find the blog post.", response, .notFound)
+        return
+    }
+
     var result = [String: Any]()
     result["success"] = true
 
@@ -301,55 +472,197 @@ router.get("/blog/:username/getall") {
         return
     }
 
-    let postsList = try DB.getUserPosts(username: username)
-    guard postsList.count != 0 else {
+    guard try DB.countUserPosts(username: username) != 0 else {
         try unsuccessfulRequest("No posts found.", response, .notFound)
         return
     }
 
-    var result = [String: Any]()
-    result["success"] = true
-    result["posts_ids"] = postsList
+    try sendList("posts_ids", response) {
+        handler in try DB.scanUserPosts(username: username, handler: handler)
+    }
+}
 
-    try response.status(.OK).send(json: result).end()
+
+/**
+ * Get the most recently added/updated posts made by the given user (with their contents), newest first.
+ * To get the next page, pass the returned 'next_before' in 'before' (not sent in the last page).
+ * Arguments: 'username' / 'limit' (optional, between 1 and 100) / 'before' (optional)
+ */
+router.get("/blog/:username/feed") {
+    request, response, next in
+
+    guard let username = request.parameters["username"] else {
+        try unsuccessfulRequest("Missing 'username' argument.", response, .badRequest)
+        return
+    }
+
+    try sendFeed(username: username, request, response)
+}
+
+
+/**
+ * Get the most recently added/updated posts (with their contents), newest first.
+ * To get the next page, pass the returned 'next_before' in 'before' (not sent in the last page).
+ * Arguments: 'limit' (optional, between 1 and 100) / 'before' (optional)
+ */
+router.get("/blog/feed") {
+    request, response, next in
+
+    try sendFeed(username: nil, request, response)
 }
 
 
 /**
  * Get a random blog post.
+ * With 'count', a list of (different) random posts is sent instead, in 'posts'.
+ * Arguments: 'count' (optional, between 1 and 100)
  */
 router.get("/blog/random") {
     request, response, next in
 
-    guard let random = try DB.getRandomPostId() else {
+    guard let count = try getCountParameter(request, response) else { return }
+
+    let posts = try DB.getRandomPosts(count: count)
+
+    guard posts.count > 0 else {
         try unsuccessfulRequest("Couldn't find any post.", response, .notFound)
         return
     }
 
-    guard let post = try? validateBlogPost(random, response) else { return }
+    var result = JSONObject()
+    try result.append("success", true)
 
-    var result = [String: Any]()
-    result["success"] = true
-    result["post"] = post
+    if request.queryParameters["count"] == nil {
+        try result.append("post", json: posts[ 0 ].post.json)
+    }
 
-    try response.status(.OK).send(json: result).end()
+    else {
+        try result.append("posts", json: try encodePostsList(posts))
+    }
+
+    try sendJSON(result.encoded(), response)
 }
 
 
 /**
- * Get a list with all the blog posts ids.
+ * Get a list with the blog posts ids (in ascending order, a page at a time).
+ * With 'all=1', all the ids are sent instead (in no particular order).
+ * Arguments: 'limit' / 'cursor' / 'all' (optional)
  */
  router.get("/blog/getall") {
      request, response, next in
 
-     var result = [String: Any]()
-     result["success"] = true
-     result["posts_ids"] = try DB.getAllPosts()
+     if request.queryParameters["all"] == "1" {
+         try sendList("posts_ids", response) {
+             handler in try DB.scanAllPosts(handler: handler)
+         }
+         return
+     }
+
+     guard let (limit, cursor) = try getPageParameters(request, response) else { return }
+
+     guard cursor == nil || Int(cursor!) != nil else {
+         try unsuccessfulRequest("Invalid 'cursor' argument.", response, .badRequest)
+         return
+     }
 
-     try response.status(.OK).send(json: result).end()
+     let page = try DB.getPostsPage(limit: limit, cursor: cursor)
+
+     try sendJSON(try JSONEncoder().encode(IdsPage("posts_ids", page)), response)
  }
 
 
+/**
+ * Search the blog posts by their title/body.
+ * The results are ranked by the number of matched terms, and then by the most recent.
+ * Arguments: 'q' / 'limit' (optional, between 1 and 100) / 'offset' (optional)
+ */
+router.get("/blog/search") {
+    request, response, next in
+
+    guard let query = request.queryParameters["q"], getSearchTerms(query).count > 0 else {
+        try unsuccessfulRequest("Missing 'q' argument (with at least one word to search for).", response, .badRequest)
+        return
+    }
+
+    guard let limit = Int(request.queryParameters["limit"] ?? "20"), limit >= 1 && limit <= 100 else {
+        try unsuccessfulRequest("'limit' needs to be a number between 1 and 100.", response, .badRequest)
+        return
+    }
+
+    guard let offset = Int(request.queryParameters["offset"] ?? "0"), offset >= 0 else {
+        try unsuccessfulRequest("'offset' needs to be a positive number.", response, .badRequest)
+        return
+    }
+
+    let found = try DB.searchPosts(query: query, offset: offset, limit: limit)
+    let posts = try DB.getBlogPosts(ids: found.results.map { $0.id })
+    var results = [[String: Any]]()
+
+    for result in found.results {
+        guard let post = posts[ result.id ] else {
+            continue
+        }
+
+        results.append([
+            "id": result.id,
+            "matches": result.matches,
+            "post": post
+        ])
+    }
+
+    var result = [String: Any]()
+    result["success"] = true
+    result["total"] = found.total
+    result["results"] = results
+    result["next_offset"] = offset + limit < found.total ? offset + limit : nil
+
+    try response.status(.OK).send(json: result).end()
+}
+
+
+/**
+ * Internal statistics of the server (useful to tune the configuration).
+ */
+router.get("/stats") {
+    request, response, next in
+
+    var result = [String: Any]()
+    result["success"] = true
+    result["password_hashing"] = HASHER.stats()
+    result["token_cache"] = DB.tokenCache.stats()
+    result["post_cache"] = DB.postCache.stats()
+    result["rate_limit"] = LIMITER.stats()
+    result["token_sweeper"] = DB.tokenSweeperStats()
+    result["replicas"] = DB.replicas.stats()
+
+    try response.status(.OK).send(json: result).end()
+}
+
+
+/**
+ * Metrics of the server, in the prometheus text format.
+ */
+router.get("/metrics") {
+    request, response, next in
+
+    let hashing = HASHER.stats()
+    let caches = [ ("token", DB.tokenCache.stats()), ("post", DB.postCache.stats()) ]
+    let rateLimited = LIMITER.rejectedCounts()
+    var text = METRICS.render()
+
+    text += Metrics.format(name: "password_hashing_queue_depth", type: "gauge", help: "Number of passwords waiting to be hashed.", samples: [ (labels: "", value: hashing["queue_depth"]!) ])
+    text += Metrics.format(name: "password_hashing_rejected_total", type: "counter", help: "Number of requests rejected because the hashing queue was full.", samples: [ (labels: "", value: hashing["rejected"]!) ])
+    text += Metrics.format(name: "cache_hits_total", type: "counter", help: "Number of values found in the cache.", samples: caches.map { (labels: "cache=\"\($0.0)\"", value: $0.1["hits"]!) })
+    text += Metrics.format(name: "cache_misses_total", type: "counter", help: "Number of values not found in the cache.", samples: caches.map { (labels: "cache=\"\($0.0)\"", value: $0.1["misses"]!) })
+
+    text += Metrics.format(name: "rate_limited_total", type: "counter", help: "Number of requests rejected because the client went over its rate limit.", samples: rateLimited.keys.sorted().map { (labels: "route=\"\($0)\"", value: rateLimited[ $0 ]!) })
+
+    response.headers["Content-Type"] = "text/plain; version=0.0.4"
+    try response.status(.OK).send(text).end()
+}
+
+
     // configure the server
 let serverPort = Int(ProcessInfo.processInfo.environment["PORT"] ?? "8000") ?? 8000
 
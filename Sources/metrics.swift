@@ -0,0 +1,222 @@
+import Foundation
+
+
+/**
+ * Request metrics (count, status codes, latency histogram and requests in flight) per route, in the prometheus text format.
+ * The counters are split in shards, and each thread always updates the same shard, so recording a request doesn't contend with the other threads.
+ */
+class Metrics {
+    static let buckets: [Double] = [ 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10 ]
+
+        // the routes of the server, so the metrics are aggregated by the template and not the actual path (paths that don't match are counted as "other")
+    static let routes = [
+        "/",
+        "/user/create",
+        "/user/login",
+        "/user/remove",
+        "/user/change_password",
+        "/user/invalidate_tokens",
+        "/user/getall",
+        "/user/random",
+        "/blog/add",
+        "/blog/bulk_add",
+        "/blog/get_many",
+        "/blog/remove",
+        "/blog/update",
+        "/blog/random",
+        "/blog/getall",
+        "/blog/search",
+        "/blog/feed",
+        "/stats",
+        "/metrics",
+        "/blog/get/:blogId",
+        "/blog/:username/getall",
+        "/blog/:username/feed"
+    ]
+
+    private struct Histogram {
+        var counts = [Int](repeating: 0, count: Metrics.buckets.count)
+        var sum: Double = 0
+        var count = 0
+    }
+
+    private class Shard {
+        let lock = NSLock()
+        var requests = [String: Int]()          // labels (with the status) -> count
+        var histograms = [String: Histogram]()  // labels -> latency histogram
+        var inFlight = 0
+    }
+
+    private let shards: [Shard]
+
+
+    init(shardCount: Int = 16) {
+        var shards = [Shard]()
+
+        for _ in 0 ..< shardCount {
+            shards.append(Shard())
+        }
+
+        self.shards = shards
+    }
+
+
+    /**
+     * The shard of the current thread.
+     */
+    private func shard() -> Shard {
+        let index = abs( ObjectIdentifier(Thread.current).hashValue ) % self.shards.count
+
+        return self.shards[ index ]
+    }
+
+
+    /**
+     * Find the route template that matches the path (for example "/blog/get/1" -> "/blog/get/:blogId").
+     */
+    static func routeTemplate(_ path: String) -> String {
+        let parts = path.split(separator: "/")
+
+        for route in Metrics.routes {
+            let routeParts = route.split(separator: "/")
+
+            guard routeParts.count == parts.count else {
+                continue
+            }
+
+            var matches = true
+
+            for (index, part) in routeParts.enumerated() {
+                if !part.hasPrefix(":") && part != parts[ index ] {
+                    matches = false
+                    break
+                }
+            }
+
+            if matches {
+                return route
+            }
+        }
+
+        return "other"
+    }
+
+
+    func requestStarted() {
+        let shard = self.shard()
+
+        shard.lock.lock()
+        shard.inFlight += 1
+        shard.lock.unlock()
+    }
+
+
+    /**
+     * Record a finished request. The 'duration' is in seconds.
+     */
+    func requestFinished(method: String, route: String, status: Int, duration: Double) {
+        let labels = "method=\"\(method)\",route=\"\(route)\""
+        let bucket = Metrics.buckets.index(where: { duration <= $0 })
+        let shard = self.shard()
+
+        shard.lock.lock()
+        defer { shard.lock.unlock() }
+
+        shard.inFlight -= 1
+        shard.requests[ "\(labels),status=\"\(status)\"", default: 0 ] += 1
+
+        var histogram = shard.histograms[ labels ] ?? Histogram()
+
+        if let bucket = bucket {
+            histogram.counts[ bucket ] += 1
+        }
+
+        histogram.sum += duration
+        histogram.count += 1
+        shard.histograms[ labels ] = histogram
+    }
+
+
+    /**
+     * Add up the values of all the shards, and return the metrics in the prometheus text format.
+     */
+    func render() -> String {
+        var requests = [String: Int]()
+        var histograms = [String: Histogram]()
+        var inFlight = 0
+
+        for shard in self.shards {
+            shard.lock.lock()
+
+            inFlight += shard.inFlight
+
+            for (labels, count) in shard.requests {
+                requests[ labels, default: 0 ] += count
+            }
+
+            for (labels, histogram) in shard.histograms {
+                var total = histograms[ labels ] ?? Histogram()
+
+                for index in 0 ..< Metrics.buckets.count {
+                    total.counts[ index ] += histogram.counts[ index ]
+                }
+
+                total.sum += histogram.sum
+                total.count += histogram.count
+                histograms[ labels ] = total
+            }
+
+            shard.lock.unlock()
+        }
+
+        var lines = [String]()
+
+        lines.append("# HELP http_requests_total Total number of HTTP requests.")
+        lines.append("# TYPE http_requests_total counter")
+
+        for labels in requests.keys.sorted() {
+            lines.append("http_requests_total{\(labels)} \(requests[ labels ]!)")
+        }
+
+        lines.append("# HELP http_request_duration_seconds Time taken to answer the HTTP requests.")
+        lines.append("# TYPE http_request_duration_seconds histogram")
+
+        for labels in histograms.keys.sorted() {
+            let histogram = histograms[ labels ]!
+            var cumulative = 0
+
+            for (index, bound) in Metrics.buckets.enumerated() {
+                cumulative += histogram.counts[ index ]
+                lines.append("http_request_duration_seconds_bucket{\(labels),le=\"\(bound)\"} \(cumulative)")
+            }
+
+            lines.append("http_request_duration_seconds_bucket{\(labels),le=\"+Inf\"} \(histogram.count)")
+            lines.append("http_request_duration_seconds_sum{\(labels)} \(histogram.sum)")
+            lines.append("http_request_duration_seconds_count{\(labels)} \(histogram.count)")
+        }
+
+        lines.append("# HELP http_requests_in_flight Number of HTTP requests being answered.")
+        lines.append("# TYPE http_requests_in_flight gauge")
+        lines.append("http_requests_in_flight \(inFlight)")
+
+        return lines.joined(separator: "\n") + "\n"
+    }
+
+
+    /**
+     * Format a metric that isn't recorded here (from the password hasher or the caches, for example).
+     */
+    static func format(name: String, type: String, help: String, samples: [(labels: String, value: Any)]) -> String {
+        var lines = [
+            "# HELP \(name) \(help)",
+            "# TYPE \(name) \(type)"
+        ]
+
+        for sample in samples {
+            let labels = sample.labels.isEmpty ? "" : "{\(sample.labels)}"
+            lines.append("\(name)\(labels) \(sample.value)")
+        }
+
+        return lines.joined(separator: "\n") + "\n"
+    }
+}
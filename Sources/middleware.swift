@@ -0,0 +1,127 @@
+import Foundation
+import Kitura
+import LoggerAPI
+
+
+/**
+ * Scope the database keys of a request by the namespace in the 'X-Namespace' header.
+ * Lets several test/benchmark runs share the same redis server without interfering with each other.
+ * Only enabled when the 'NAMESPACE_HEADER' environment variable is set to "1".
+ */
+class NamespaceMiddleware: RouterMiddleware {
+    let enabled = ProcessInfo.processInfo.environment["NAMESPACE_HEADER"] == "1"
+    let allowed = CharacterSet.alphanumerics.union(CharacterSet(charactersIn: "_-"))
+
+
+    func handle(request: RouterRequest, response: RouterResponse, next: @escaping () -> Void) throws {
+        var namespace: String?
+
+        if self.enabled, let header = request.headers["X-Namespace"] {
+            guard header.count >= 1 && header.count <= 64 && !header.unicodeScalars.contains { !self.allowed.contains($0) } else {
+                try unsuccessfulRequest("Invalid 'X-Namespace' header.", response, .badRequest)
+                return
+            }
+
+            namespace = header
+        }
+
+            // the threads are reused between requests, so always set them (even if to nil)
+        Thread.current.threadDictionary[ "namespace" ] = namespace
+        ReplicaSet.primaryOnly = false
+
+        next()
+    }
+}
+
+
+/**
+ * Record the metrics of every request (see 'Metrics').
+ */
+class MetricsMiddleware: RouterMiddleware {
+    func handle(request: RouterRequest, response: RouterResponse, next: @escaping () -> Void) throws {
+        let start = Date()
+        let method = request.method.rawValue
+        let route = Metrics.routeTemplate(request.parsedURL.path ?? "/")
+
+        METRICS.requestStarted()
+
+        var previousOnEnd: LifecycleHandler = {}
+        previousOnEnd = response.setOnEndInvoked {
+            METRICS.requestFinished(method: method, route: route, status: response.statusCode.rawValue, duration: Date().timeIntervalSince(start))
+            previousOnEnd()
+        }
+
+        next()
+    }
+}
+
+
+/**
+ * Keep track of the redis round trips of each request (see 'RedisTrace').
+ * When the 'REDIS_TRACE' environment variable is set to "1", the totals are sent in the response headers and logged.
+ */
+class TracingMiddleware: RouterMiddleware {
+    let enabled = ProcessInfo.processInfo.environment["REDIS_TRACE"] == "1"
+
+
+    func handle(request: RouterRequest, response: RouterResponse, next: @escaping () -> Void) throws {
+        guard self.enabled else {
+            RedisTrace.current = nil
+            next()
+            return
+        }
+
+        let trace = RedisTrace()
+        let path = request.parsedURL.path ?? "/"
+        RedisTrace.current = trace
+
+        var previousOnEnd: LifecycleHandler = {}
+        previousOnEnd = response.setOnEndInvoked {
+            let elapsedMs = String(format: "%.3f", trace.elapsed * 1000)
+            let callers = trace.callers.keys.sorted().map { "\($0)=\(trace.callers[ $0 ]!)" }.joined(separator: ",")
+
+            response.headers["X-Redis-Round-Trips"] = String( trace.roundTrips )
+            response.headers["X-Redis-Time-Ms"] = elapsedMs
+            response.headers["X-Redis-Bytes-Sent"] = String( trace.bytesSent )
+            response.headers["X-Redis-Bytes-Received"] = String( trace.bytesReceived )
+
+            Log.info("redis_trace method=\(request.method.rawValue) path=\(path) status=\(response.statusCode.rawValue) round_trips=\(trace.roundTrips) time_ms=\(elapsedMs) bytes_sent=\(trace.bytesSent) bytes_received=\(trace.bytesReceived) callers=\(callers)")
+            previousOnEnd()
+        }
+
+        next()
+    }
+}
+
+
+/**
+ * Reject the requests of the clients that went over their rate limit (see 'RateLimiter').
+ * Runs after the body is parsed, so the requests with an 'username' argument are limited per user as well.
+ */
+class RateLimitMiddleware: RouterMiddleware {
+    func handle(request: RouterRequest, response: RouterResponse, next: @escaping () -> Void) throws {
+        guard LIMITER.enabled else {
+            next()
+            return
+        }
+
+        let route = Metrics.routeTemplate(request.parsedURL.path ?? "/")
+        var address = request.remoteAddress
+        var username: String?
+
+        if LIMITER.trustProxy, let forwarded = request.headers["X-Forwarded-For"]?.split(separator: ",").first {
+            address = forwarded.trimmingCharacters(in: .whitespaces)
+        }
+
+        if let body = request.body, case .urlEncoded(let values) = body {
+            username = values[ "username" ]
+        }
+
+        if let retryAfter = LIMITER.check(route: route, address: address, username: username) {
+            try tooManyRequests(retryAfter, response)
+            return
+        }
+
+        next()
+    }
+}
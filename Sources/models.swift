@@ -0,0 +1,172 @@
+import Foundation
+
+
+/**
+ * A blog post, as it's sent in the responses.
+ */
+struct Post: Codable {
+    let title: String
+    let body: String
+    let author: String
+    let lastUpdated: String
+
+    enum CodingKeys: String, CodingKey {
+        case title
+        case body
+        case author
+        case lastUpdated = "last_updated"
+    }
+
+
+    /**
+     * From the fields of the post hash (see 'Database.postFromReply()').
+     */
+    init(fields: [String: String]) {
+        self.title = fields[ "title" ] ?? ""
+        self.body = fields[ "body" ] ?? ""
+        self.author = fields[ "author" ] ?? ""
+        self.lastUpdated = fields[ "last_updated" ] ?? ""
+    }
+}
+
+
+/**
+ * A post as it's kept in the cache: the fields, its json encoding and its 'ETag'.
+ * The json is encoded once when the post is read from the database, and then written as is in every response that includes the post.
+ */
+final class CachedPost {
+    let fields: [String: String]
+    let json: Data
+    let etag: String
+
+
+    init(id: String, fields: [String: String]) {
+        self.fields = fields
+        self.json = (try? JSONEncoder().encode(Post(fields: fields))) ?? Data(bytes: Array("{}".utf8))
+        self.etag = getPostETag(id, fields)
+    }
+}
+
+
+/**
+ * A page of ids (of users or posts), see 'getPageParameters()'.
+ * The list is sent in the 'field' key (for example "users" or "posts_ids").
+ */
+struct IdsPage: Encodable {
+    let field: String
+    let ids: [String]
+    let nextCursor: String?
+
+
+    init(_ field: String, _ page: (members: [String], nextCursor: String?)) {
+        self.field = field
+        self.ids = page.members
+        self.nextCursor = page.nextCursor
+    }
+
+
+    private struct Key: CodingKey {
+        let stringValue: String
+        let intValue: Int? = nil
+
+        init(stringValue: String) {
+            self.stringValue = stringValue
+        }
+
+        init?(intValue: Int) {
+            return nil
+        }
+    }
+
+
+    func encode(to encoder: Encoder) throws {
+        var container = encoder.container(keyedBy: Key.self)
+
+        try container.encode(true, forKey: Key(stringValue: "success"))
+        try container.encode(self.ids, forKey: Key(stringValue: self.field))
+        try container.encodeIfPresent(self.nextCursor, forKey: Key(stringValue: "next_cursor"))
+    }
+}
+
+
+/**
+ * Builds a json object out of values that are already encoded (like the json of the cached posts), so they don't need to be decoded and encoded again.
+ */
+struct JSONObject {
+    private var data = Data(bytes: [ UInt8(ascii: "{") ])
+
+
+    /**
+     * Encode a single string ('JSONEncoder' only encodes lists and objects at the top level, so encode a list with the string and remove the square brackets).
+     */
+    static func encode(_ string: String) throws -> Data {
+        let list = try JSONEncoder().encode([ string ])
+
+        return list.subdata(in: 1 ..< list.count - 1)
+    }
+
+
+    /**
+     * Add a value that is already in json.
+     */
+    mutating func append(_ key: String, json: Data) throws {
+        if self.data.count > 1 {
+            self.data.append(UInt8(ascii: ","))
+        }
+
+        self.data.append(try JSONObject.encode(key))
+        self.data.append(UInt8(ascii: ":"))
+        self.data.append(json)
+    }
+
+
+    /**
+     * Add a list or an object (anything that 'JSONEncoder' can encode at the top level).
+     */
+    mutating func append<T: Encodable>(_ key: String, _ value: T) throws {
+        try self.append(key, json: try JSONEncoder().encode(value))
+    }
+
+
+    mutating func append(_ key: String, _ value: String) throws {
+        try self.append(key, json: try JSONObject.encode(value))
+    }
+
+
+    mutating func append(_ key: String, _ value: Bool) throws {
+        try self.append(key, json: Data(bytes: Array((value ? "true" : "false").utf8)))
+    }
+
+
+    func encoded() -> Data {
+        var data = self.data
+        data.append(UInt8(ascii: "}"))
+
+        return data
+    }
+}
+
+
+/**
+ * A json list of '{ "id": ..., "post": ... }' objects, with the posts already encoded (used by the routes that send several posts).
+ */
+func encodePostsList(_ posts: [(id: String, post: CachedPost)]) throws -> Data {
+    var data = Data(bytes: [ UInt8(ascii: "[") ])
+
+    for (index, entry) in posts.enumerated() {
+        var object = JSONObject()
+
+        try object.append("id", entry.id)
+        try object.append("post", json: entry.post.json)
+
+        if index > 0 {
+            data.append(UInt8(ascii: ","))
+        }
+
+        data.append(object.encoded())
+    }
+
+    data.append(UInt8(ascii: "]"))
+
+    return data
+}
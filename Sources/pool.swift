@@ -0,0 +1,140 @@
+import Foundation
+import Redis
+import LoggerAPI
+
+
+enum ConnectionPoolError: Error {
+    case timeout
+}
+
+
+/**
+ * A bounded pool of redis connections.
+ * A connection is checked out for the duration of a command (or a pipeline), so it's never shared between threads.
+ */
+class ConnectionPool {
+    let hostname: String
+    let port: UInt16
+    let password: String?
+    let database: Int
+    let size: Int
+
+    private let checkoutTimeout: DispatchTimeInterval = .seconds(5)
+    private let healthCheckInterval: TimeInterval = 30   // ping connections that have been idle for longer than this (in seconds)
+
+    private var idle = [(client: TCPClient, lastUsed: Date)]()
+    private let lock = NSLock()
+    private let semaphore: DispatchSemaphore
+
+
+    /**
+     * Open the first connection right away, so we fail early if the redis server can't be reached.
+     */
+    init(hostname: String, port: UInt16, password: String?, database: Int, size: Int) throws {
+        self.hostname = hostname
+        self.port = port
+        self.password = password
+        self.database = database
+        self.size = max(size, 1)
+        self.semaphore = DispatchSemaphore(value: self.size)
+
+        self.idle.append((client: try self.connect(), lastUsed: Date()))
+    }
+
+
+    /**
+     * Open a new connection to the redis server (and select the logical database to use).
+     */
+    func connect() throws -> TCPClient {
+        let client = try TCPClient(hostname: self.hostname, port: self.port, password: self.password)
+
+        if self.database != 0 {
+            try client.command(.custom("SELECT".makeBytes()), [ String( self.database ) ])
+        }
+
+        return client
+    }
+
+
+    /**
+     * Get a connection from the pool (waits if all of them are in use).
+     * Idle connections are checked before being handed out, and replaced if they're no longer working.
+     */
+    private func checkout() throws -> TCPClient {
+        guard self.semaphore.wait(timeout: .now() + self.checkoutTimeout) == .success else {
+            Log.error("Timed out waiting for a redis connection.")
+            throw ConnectionPoolError.timeout
+        }
+
+        self.lock.lock()
+        let connection = self.idle.popLast()
+        self.lock.unlock()
+
+        do {
+            if let connection = connection {
+                if Date().timeIntervalSince(connection.lastUsed) < self.healthCheckInterval {
+                    return connection.client
+                }
+
+                if (try? connection.client.command(.custom("PING".makeBytes()))) != nil {
+                    return connection.client
+                }
+
+                Log.warning("Redis connection failed the health check, reconnecting.")
+                try? connection.client.stream.close()
+            }
+
+            return try self.connect()
+        }
+
+        catch {
+            self.semaphore.signal()
+            throw error
+        }
+    }
+
+
+    /**
+     * Return a connection to the pool.
+     */
+    private func checkin(_ client: TCPClient) {
+        self.lock.lock()
+        self.idle.append((client: client, lastUsed: Date()))
+        self.lock.unlock()
+
+        self.semaphore.signal()
+    }
+
+
+    /**
+     * Close a connection that may be in an inconsistent state (a new one will be opened when needed).
+     */
+    private func discard(_ client: TCPClient) {
+        try? client.stream.close()
+
+        self.semaphore.signal()
+    }
+
+
+    /**
+     * Run the given function with exclusive access to a connection.
+     * If it fails, the connection is dropped, since we can't know if there's still a reply left to read in the socket.
+     */
+    @discardableResult
+    func withClient<T>(_ body: (TCPClient) throws -> T) throws -> T {
+        let client = try self.checkout()
+        let result: T
+
+        do {
+            result = try body(client)
+        }
+
+        catch {
+            self.discard(client)
+            throw error
+        }
+
+        self.checkin(client)
+        return result
+    }
+}
@@ -0,0 +1,115 @@
+import Foundation
+import LoggerAPI
+
+
+/**
+ * Per client rate limiting, with token buckets kept in redis (so the limits are shared by all the instances of the server).
+ * Each client (ip address, and ip address + username for the routes that receive one) has a bucket of 'capacity' tokens, that refills at 'refillRate' tokens per second.
+ * The bucket of a username is per address as well, otherwise anyone could use up the tokens of a user (with failed logins, for example) and lock them out.
+ * Every request takes the cost of its route from the buckets, and is rejected (with a '429' status) if there aren't enough tokens left.
+ * Only enabled when the 'RATE_LIMIT' environment variable is set to "1".
+ */
+class RateLimiter {
+        // the routes not listed here cost 1 token
+    static let costs = [
+        "/user/create": 20,
+        "/user/login": 20,
+        "/user/remove": 20,
+        "/user/change_password": 20,
+        "/blog/bulk_add": 20,
+        "/user/getall": 5,
+        "/blog/getall": 5,
+        "/blog/:username/getall": 5,
+        "/blog/search": 5,
+        "/blog/feed": 2,
+        "/blog/:username/feed": 2,
+        "/blog/get_many": 2,
+        "/stats": 0,
+        "/metrics": 0
+    ]
+
+    let enabled: Bool
+    let capacity: Int
+    let refillRate: Double  // tokens per second
+    let trustProxy: Bool    // use the client address from the 'X-Forwarded-For' header
+
+    private let lock = NSLock()
+    private var rejected = [String: Int]()  // route -> number of rejected requests
+
+
+    /**
+     * Can be configured with the 'RATE_LIMIT' / 'RATE_LIMIT_CAPACITY' / 'RATE_LIMIT_REFILL' / 'RATE_LIMIT_TRUST_PROXY' environment variables.
+     */
+    init() {
+        let environment = ProcessInfo.processInfo.environment
+
+        self.enabled = environment["RATE_LIMIT"] == "1"
+        self.capacity = max(Int(environment["RATE_LIMIT_CAPACITY"] ?? "") ?? 100, 1)
+        self.refillRate = max(Double(environment["RATE_LIMIT_REFILL"] ?? "") ?? 10, 0.001)
+        self.trustProxy = environment["RATE_LIMIT_TRUST_PROXY"] == "1"
+    }
+
+
+    /**
+     * Take the cost of the route from the buckets of the client.
+     * Returns nil if the request is allowed, otherwise the number of seconds until it would be.
+     * If redis can't be reached the request is allowed (the limiter shouldn't take the whole server down with it).
+     */
+    func check(route: String, address: String, username: String?) -> Int? {
+        let cost = min(RateLimiter.costs[ route ] ?? 1, self.capacity)
+
+        guard cost > 0 else {
+            return nil
+        }
+
+        var buckets = [ "ip_\(address)" ]
+
+        if let username = username {
+            buckets.append("user_\(address)_\(username)")
+        }
+
+        let wait: Double
+
+        do {
+            wait = try DB.takeRateLimitTokens(buckets: buckets, cost: cost, capacity: self.capacity, refillRate: self.refillRate)
+        }
+
+        catch {
+            Log.error("Failed to check the rate limit: \(error)")
+            return nil
+        }
+
+        guard wait > 0 else {
+            return nil
+        }
+
+        self.lock.lock()
+        self.rejected[ route, default: 0 ] += 1
+        self.lock.unlock()
+
+        return max(Int( wait.rounded(.up) ), 1)
+    }
+
+
+    /**
+     * Number of rejected requests of each route.
+     */
+    func rejectedCounts() -> [String: Int] {
+        self.lock.lock()
+        defer { self.lock.unlock() }
+
+        return self.rejected
+    }
+
+
+    func stats() -> [String: Any] {
+        var stats = [String: Any]()
+        stats["enabled"] = self.enabled
+        stats["capacity"] = self.capacity
+        stats["refill_rate"] = self.refillRate
+        stats["trust_proxy"] = self.trustProxy
+        stats["rejected"] = self.rejectedCounts()
+
+        return stats
+    }
+}
@@ -0,0 +1,224 @@
+import Foundation
+import Redis
+import LoggerAPI
+
+
+/**
+ * A read replica of the redis server, with its own connection pool.
+ */
+class Replica {
+    let name: String    // host:port
+    let pool: ConnectionPool
+
+    private let lock = NSLock()
+    private var _healthy = false
+    private var _lag: TimeInterval?
+    private var _reads = 0
+
+
+    init(name: String, pool: ConnectionPool) {
+        self.name = name
+        self.pool = pool
+    }
+
+
+    var healthy: Bool {
+        get {
+            self.lock.lock()
+            defer { self.lock.unlock() }
+
+            return self._healthy
+        }
+
+        set {
+            self.lock.lock()
+            self._healthy = newValue
+            self.lock.unlock()
+        }
+    }
+
+
+    /**
+     * Update the result of the last health check.
+     */
+    func update(healthy: Bool, lag: TimeInterval?) {
+        self.lock.lock()
+        self._healthy = healthy
+        self._lag = lag
+        self.lock.unlock()
+    }
+
+
+    func countRead() {
+        self.lock.lock()
+        self._reads += 1
+        self.lock.unlock()
+    }
+
+
+    func stats() -> [String: Any] {
+        self.lock.lock()
+        defer { self.lock.unlock() }
+
+        var stats = [String: Any]()
+        stats["name"] = self.name
+        stats["healthy"] = self._healthy
+        stats["lag"] = self._lag ?? -1
+        stats["reads"] = self._reads
+
+        return stats
+    }
+}
+
+
+/**
+ * The read replicas of the redis server (from the 'REDIS_REPLICA_URLS' environment variable).
+ * Reads are spread between the healthy replicas in turns. When none is healthy, or the current request already wrote something, they go to the primary instead.
+ * The replicas are checked periodically (see 'Database.startReplicaMonitor()'): a replica is healthy if it's connected to the primary, and its replication lag is under 'maxLag' (when set).
+ */
+class ReplicaSet {
+    let replicas: [Replica]
+    let maxLag: TimeInterval?
+
+    private let lock = NSLock()
+    private var nextIndex = 0
+
+
+    init(replicas: [Replica], maxLag: TimeInterval?) {
+        self.replicas = replicas
+        self.maxLag = maxLag
+    }
+
+
+    var enabled: Bool {
+        return self.replicas.count > 0
+    }
+
+
+    /**
+     * Whether the reads of the request being answered in the current thread need to go to the primary (set after the request writes something).
+     */
+    static var primaryOnly: Bool {
+        get {
+            return Thread.current.threadDictionary[ "redis_primary_only" ] as? Bool ?? false
+        }
+
+        set {
+            Thread.current.threadDictionary[ "redis_primary_only" ] = newValue
+        }
+    }
+
+
+    /**
+     * The commands that don't change any data. Any other command is taken as a write (see 'noteCommand()').
+     */
+    static let readCommands: Set<String> = [
+        "GET", "TTL", "TYPE", "HGETALL", "HMGET", "HEXISTS", "HSTRLEN", "SMEMBERS", "SISMEMBER", "SCARD", "SSCAN",
+        "ZRANGE", "ZREVRANGE", "ZRANGEBYSCORE", "ZREVRANGEBYSCORE", "ZRANGEBYLEX", "ZCARD", "ZSCAN", "SCAN",
+        "INFO", "MEMORY", "PING", "TIME", "SELECT", "SCRIPT"
+    ]
+
+
+    /**
+     * Called for every command sent to the primary: after a write, the reads that follow in the same request go to the primary as well (so the request sees its own writes).
+     */
+    static func noteCommand(_ command: Command) {
+        let name = String(bytes: command.makeBytes(), encoding: .utf8)?.uppercased() ?? ""
+
+        if !ReplicaSet.readCommands.contains(name) {
+            ReplicaSet.primaryOnly = true
+        }
+    }
+
+
+    /**
+     * How long something that may have been read from a replica can stay in a cache (at most 'ttl').
+     * A healthy replica is at most 'maxLag' behind the primary, so after that the cache could be missing a change. Without a 'maxLag' the lag has no limit, and nil is returned (don't cache it).
+     */
+    func cacheTTL(_ ttl: TimeInterval) -> TimeInterval? {
+        guard self.enabled else {
+            return ttl
+        }
+
+        guard let maxLag = self.maxLag else {
+            return nil
+        }
+
+        return min(ttl, maxLag)
+    }
+
+
+    /**
+     * Pick the replica for the next read, or nil if the read should go to the primary.
+     */
+    func next() -> Replica? {
+        guard self.enabled && !ReplicaSet.primaryOnly else {
+            return nil
+        }
+
+        self.lock.lock()
+        let start = self.nextIndex
+        self.nextIndex = (self.nextIndex + 1) % self.replicas.count
+        self.lock.unlock()
+
+        for offset in 0 ..< self.replicas.count {
+            let replica = self.replicas[ (start + offset) % self.replicas.count ]
+
+            if replica.healthy {
+                return replica
+            }
+        }
+
+        return nil
+    }
+
+
+    /**
+     * Check the state of every replica.
+     * The 'heartbeatKey' was just set in the primary to 'writtenAt', so the lag of a replica is how old its copy of the value is.
+     */
+    func check(heartbeatKey: String, writtenAt: TimeInterval) {
+        for replica in self.replicas {
+            do {
+                let replies = try replica.pool.withClient { client in
+                    try client.makePipeline()
+                        .enqueue(.custom("INFO".makeBytes()), [ "replication" ])
+                        .enqueue(.get, [ heartbeatKey ])
+                        .execute()
+                }
+
+                let connected = replies[ 0 ]?.string?.contains("master_link_status:up") ?? false
+                var lag: TimeInterval?
+
+                if let heartbeat = TimeInterval(replies[ 1 ]?.string ?? "") {
+                    lag = max(writtenAt - heartbeat, 0)
+                }
+
+                var healthy = connected
+
+                if let maxLag = self.maxLag {
+                    healthy = healthy && lag != nil && lag! <= maxLag
+                }
+
+                if healthy != replica.healthy {
+                    Log.info("Redis replica \(replica.name) is now \(healthy ? "healthy" : "unhealthy").")
+                }
+
+                replica.update(healthy: healthy, lag: lag)
+            }
+
+            catch {
+                if replica.healthy {
+                    Log.warning("Redis replica \(replica.name) failed the health check: \(error)")
+                }
+
+                replica.update(healthy: false, lag: nil)
+            }
+        }
+    }
+
+
+    func stats() -> [[String: Any]] {
+        return self.replicas.map { $0.stats() }
+    }
+}
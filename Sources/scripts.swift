@@ -0,0 +1,352 @@
+/**
+ * Lua scripts that run in the redis server.
+ * Each script runs atomically, and in a single round trip (see 'Database.runScript()').
+ */
+enum Scripts {
+
+    /**
+     * Lua function used by the scripts that change the posts, to keep the search index up to date.
+     * Replaces the terms of a post (the ones in the "post_terms_*" set) by the given 'terms', and updates the "search_*" sets accordingly.
+     */
+    static let setTermsFunction = """
+        local function set_terms(prefix, id, terms)
+            local termsKey = prefix .. 'post_terms_' .. id
+            local current = {}
+            local wanted = {}
+
+            for _, term in ipairs(redis.call('SMEMBERS', termsKey)) do
+                current[term] = true
+            end
+
+            for _, term in ipairs(terms) do
+                wanted[term] = true
+            end
+
+            for term in pairs(current) do
+                if not wanted[term] then
+                    redis.call('SREM', prefix .. 'search_' .. term, id)
+                end
+            end
+
+            for term in pairs(wanted) do
+                if not current[term] then
+                    redis.call('SADD', prefix .. 'search_' .. term, id)
+                end
+            end
+
+            redis.call('DEL', termsKey)
+
+            if #terms > 0 then
+                redis.call('SADD', termsKey, unpack(terms))
+            end
+        end
+
+        """
+
+    /**
+     * Lua function that gives the current time of the server with microseconds, as a string (used as the score of the time ordered indexes).
+     */
+    static let timeScoreFunction = """
+        local function time_score()
+            local time = redis.call('TIME')
+
+            return time[1] .. '.' .. string.format('%06d', tonumber(time[2])), time[1]
+        end
+
+        """
+
+    /**
+     * Remove a user, all of their posts and tokens.
+     * KEYS: user_posts_* / user_tokens_* / user_* / users / users_index / posts / posts_index / posts_by_time / user_posts_by_time_*
+     * ARGV: username / prefix of the keys (the namespace)
+     * Returns the list of the removed post ids, and the list of the removed tokens.
+     */
+    static let removeUser = Scripts.setTermsFunction + """
+        local posts = redis.call('SMEMBERS', KEYS[1])
+        local tokens = redis.call('ZRANGE', KEYS[2], 0, -1)
+
+        for _, id in ipairs(posts) do
+            set_terms(ARGV[2], id, {})
+            redis.call('DEL', ARGV[2] .. 'post_' .. id)
+            redis.call('SREM', KEYS[6], id)
+            redis.call('ZREM', KEYS[7], id)
+            redis.call('ZREM', KEYS[8], id)
+        end
+
+        for _, token in ipairs(tokens) do
+            redis.call('DEL', ARGV[2] .. 'token_' .. token)
+        end
+
+        redis.call('DEL', KEYS[1], KEYS[2], KEYS[3], KEYS[9])
+        redis.call('SREM', KEYS[4], ARGV[1])
+        redis.call('ZREM', KEYS[5], ARGV[1])
+
+        return { posts, tokens }
+        """
+
+    /**
+     * Add a new blog post (with the next available id, and the current time of the server).
+     * KEYS: LAST_POST_ID / user_posts_* / posts / posts_index / posts_by_time / user_posts_by_time_*
+     * ARGV: username / title / body / prefix of the keys (the namespace) / format of the body (empty for plain text) / search terms...
+     * Returns the id of the new post.
+     */
+    static let addPost = Scripts.setTermsFunction + Scripts.timeScoreFunction + """
+        redis.replicate_commands()
+
+        local id = redis.call('INCR', KEYS[1])
+        local score, time = time_score()
+
+        redis.call('HMSET', ARGV[4] .. 'post_' .. id, 'title', ARGV[2], 'body', ARGV[3], 'author', ARGV[1], 'last_updated', time)
+
+        if ARGV[5] ~= '' then
+            redis.call('HSET', ARGV[4] .. 'post_' .. id, 'body_format', ARGV[5])
+        end
+
+        redis.call('SADD', KEYS[2], id)
+        redis.call('SADD', KEYS[3], id)
+        redis.call('ZADD', KEYS[4], id, id)
+        redis.call('ZADD', KEYS[5], score, id)
+        redis.call('ZADD', KEYS[6], score, id)
+        set_terms(ARGV[4], id, { unpack(ARGV, 6) })
+
+        return id
+        """
+
+    /**
+     * Update the title/body of an existing blog post (which moves it to the top of the time ordered indexes).
+     * KEYS: post_*
+     * ARGV: title / body / prefix of the keys (the namespace) / post id / format of the body (empty for plain text) / search terms...
+     * Returns 1 if the post was updated, 0 if it doesn't exist.
+     */
+    static let updatePost = Scripts.setTermsFunction + Scripts.timeScoreFunction + """
+        redis.replicate_commands()
+
+        local author = redis.call('HGET', KEYS[1], 'author')
+
+        if not author then
+            return 0
+        end
+
+        local score, time = time_score()
+
+        redis.call('HMSET', KEYS[1], 'title', ARGV[1], 'body', ARGV[2], 'last_updated', time)
+
+        if ARGV[5] ~= '' then
+            redis.call('HSET', KEYS[1], 'body_format', ARGV[5])
+        else
+            redis.call('HDEL', KEYS[1], 'body_format')
+        end
+
+        redis.call('ZADD', ARGV[3] .. 'posts_by_time', score, ARGV[4])
+        redis.call('ZADD', ARGV[3] .. 'user_posts_by_time_' .. author, score, ARGV[4])
+        set_terms(ARGV[3], ARGV[4], { unpack(ARGV, 6) })
+
+        return 1
+        """
+
+    /**
+     * Remove a blog post (and its search terms).
+     * KEYS: user_posts_* / posts / posts_index / post_* / posts_by_time / user_posts_by_time_*
+     * ARGV: prefix of the keys (the namespace) / post id
+     */
+    static let removePost = Scripts.setTermsFunction + """
+        set_terms(ARGV[1], ARGV[2], {})
+
+        redis.call('SREM', KEYS[1], ARGV[2])
+        redis.call('SREM', KEYS[2], ARGV[2])
+        redis.call('ZREM', KEYS[3], ARGV[2])
+        redis.call('DEL', KEYS[4])
+        redis.call('ZREM', KEYS[5], ARGV[2])
+        redis.call('ZREM', KEYS[6], ARGV[2])
+
+        return 1
+        """
+
+    /**
+     * Set the search terms of an existing post (used when rebuilding the search index).
+     * ARGV: prefix of the keys (the namespace) / post id / search terms...
+     */
+    static let indexPost = Scripts.setTermsFunction + """
+        set_terms(ARGV[1], ARGV[2], { unpack(ARGV, 3) })
+
+        return 1
+        """
+
+    /**
+     * Find the posts that have the given terms, ranked by the number of matched terms and then by recency (newest id first).
+     * The ranking is done by redis in a temporary sorted set (instead of sorting all the matches in lua): the union of the "search_*" sets gives the number of matched terms of each post,
+     * which is then combined with the id of the post from "posts_index" (score = matches * 2^32 + id, so the ids need to stay under 2^32). Only the page is read from it, and it's removed right away.
+     * The temporary key has a ':' so it can't be the set of a search term (the terms are alphanumeric only).
+     * ARGV: prefix of the keys (the namespace) / offset / limit / search terms...
+     * Returns the total number of posts found, and a list with the post id followed by the number of matched terms, for each post in the page.
+     */
+    static let search = """
+        local prefix = ARGV[1]
+        local offset = tonumber(ARGV[2])
+        local limit = tonumber(ARGV[3])
+        local resultsKey = prefix .. 'search_tmp:results'
+        local idRange = 4294967296
+        local terms = {}
+        local page = {}
+
+        for index = 4, #ARGV do
+            table.insert(terms, prefix .. 'search_' .. ARGV[index])
+        end
+
+        redis.call('ZUNIONSTORE', resultsKey, #terms, unpack(terms))
+
+        local total = redis.call('ZINTERSTORE', resultsKey, 2, resultsKey, prefix .. 'posts_index', 'WEIGHTS', idRange, 1)
+        local results = redis.call('ZREVRANGE', resultsKey, offset, offset + limit - 1, 'WITHSCORES')
+
+        redis.call('DEL', resultsKey)
+
+        for index = 1, #results, 2 do
+            table.insert(page, results[index])
+            table.insert(page, math.floor(tonumber(results[index + 1]) / idRange))
+        end
+
+        return { total, page }
+        """
+
+    /**
+     * Get several random posts (without repeating any).
+     * Ids that are still in the set but whose post no longer exists are skipped, so there may be fewer posts than requested.
+     * KEYS: posts
+     * ARGV: prefix of the keys (the namespace) / number of posts
+     * Returns a list with the post id followed by the post hash (as a field/value list), for each post.
+     */
+    static let randomPosts = """
+        local results = {}
+
+        for _, id in ipairs(redis.call('SRANDMEMBER', KEYS[1], ARGV[2])) do
+            local post = redis.call('HGETALL', ARGV[1] .. 'post_' .. id)
+
+            if #post > 0 then
+                table.insert(results, id)
+                table.insert(results, post)
+            end
+        end
+
+        return results
+        """
+
+    /**
+     * Get several random users (without repeating any), along with the ids of their posts.
+     * KEYS: users
+     * ARGV: prefix of the keys (the namespace) / number of users
+     * Returns a list with the username followed by the list of post ids, for each user.
+     */
+    static let randomUsers = """
+        local results = {}
+
+        for _, username in ipairs(redis.call('SRANDMEMBER', KEYS[1], ARGV[2])) do
+            table.insert(results, username)
+            table.insert(results, redis.call('SMEMBERS', ARGV[1] .. 'user_posts_' .. username))
+        end
+
+        return results
+        """
+
+    /**
+     * Replace the body of a post by the same body in another format (used to compress the existing posts), unless it was changed in the meantime.
+     * KEYS: post_*
+     * ARGV: current body / new body / format of the new body
+     * Returns 1 if the body was replaced.
+     */
+    static let replaceBody = """
+        if redis.call('HGET', KEYS[1], 'body') ~= ARGV[1] or redis.call('HEXISTS', KEYS[1], 'body_format') == 1 then
+            return 0
+        end
+
+        redis.call('HMSET', KEYS[1], 'body', ARGV[2], 'body_format', ARGV[3])
+
+        return 1
+        """
+
+    /**
+     * Get the most recently added/updated posts (from one of the time ordered indexes), newest first.
+     * KEYS: posts_by_time / user_posts_by_time_*
+     * ARGV: prefix of the keys (the namespace) / only posts with a lower score than this ("+inf" for the newest) / number of posts
+     * Returns the score to continue from (empty if there are no more posts), and a list with the post id followed by the post hash (as a field/value list), for each post.
+     */
+    static let feed = """
+        local max = ARGV[2] == '+inf' and '+inf' or '(' .. ARGV[2]
+        local entries = redis.call('ZREVRANGEBYSCORE', KEYS[1], max, '-inf', 'WITHSCORES', 'LIMIT', 0, ARGV[3])
+        local posts = {}
+        local cursor = ''
+
+        for index = 1, #entries, 2 do
+            local post = redis.call('HGETALL', ARGV[1] .. 'post_' .. entries[index])
+
+            if #post > 0 then
+                table.insert(posts, entries[index])
+                table.insert(posts, post)
+            end
+        end
+
+        if #entries == 2 * tonumber(ARGV[3]) then
+            cursor = entries[#entries]
+        end
+
+        return { cursor, posts }
+        """
+
+    /**
+     * Take 'cost' tokens from each of the given token buckets, but only if all of them have enough tokens.
+     * The buckets refill continuously (at 'rate' tokens per second) up to 'capacity', and expire once they would be full again.
+     * KEYS: the buckets (rate_limit_*)
+     * ARGV: capacity / rate / cost
+     * Returns the number of seconds to wait until the request is allowed (as a string), or "0" if the tokens were taken.
+     */
+    static let rateLimit = """
+        redis.replicate_commands()
+
+        local capacity = tonumber(ARGV[1])
+        local rate = tonumber(ARGV[2])
+        local cost = tonumber(ARGV[3])
+        local time = redis.call('TIME')
+        local now = tonumber(time[1]) + tonumber(time[2]) / 1000000
+        local levels = {}
+        local wait = 0
+
+        for index, key in ipairs(KEYS) do
+            local bucket = redis.call('HMGET', key, 'tokens', 'time')
+            local tokens = tonumber(bucket[1]) or capacity
+            local last = tonumber(bucket[2]) or now
+
+            tokens = math.min(capacity, tokens + math.max(0, now - last) * rate)
+            levels[index] = tokens
+
+            if tokens < cost then
+                wait = math.max(wait, (cost - tokens) / rate)
+            end
+        end
+
+        for index, key in ipairs(KEYS) do
+            local tokens = levels[index]
+
+            if wait == 0 then
+                tokens = tokens - cost
+            end
+
+            redis.call('HMSET', key, 'tokens', tostring(tokens), 'time', tostring(now))
+            redis.call('PEXPIRE', key, math.ceil((capacity - tokens) / rate * 1000) + 1000)
+        end
+
+        return tostring(wait)
+        """
+
+    static let all = [
+        removeUser,
+        addPost,
+        updatePost,
+        removePost,
+        indexPost,
+        search,
+        randomPosts,
+        randomUsers,
+        feed,
+        replaceBody,
+        rateLimit
+    ]
+}
@@ -0,0 +1,37 @@
+import Foundation
+
+
+/**
+ * Common words that aren't worth indexing.
+ */
+let SEARCH_STOP_WORDS: Set<String> = [
+    "a", "an", "and", "are", "as", "at", "be", "but", "by", "for", "if", "in", "into", "is", "it",
+    "no", "not", "of", "on", "or", "such", "that", "the", "their", "then", "there", "these",
+    "they", "this", "to", "was", "will", "with"
+]
+
+
+/**
+ * Split a text into the terms used by the search index.
+ * The terms are lower case, without diacritics ("Café" -> "cafe"), unique, and between 2 and 30 characters.
+ */
+func getSearchTerms(_ text: String, limit: Int = 1000) -> [String] {
+    let normalized = text.folding(options: [ .caseInsensitive, .diacriticInsensitive ], locale: nil).lowercased()
+    var terms = [String]()
+    var seen = Set<String>()
+
+    for word in normalized.components(separatedBy: CharacterSet.alphanumerics.inverted) {
+        guard word.count >= 2 && word.count <= 30 && !SEARCH_STOP_WORDS.contains(word) && !seen.contains(word) else {
+            continue
+        }
+
+        seen.insert(word)
+        terms.append(word)
+
+        if terms.count >= limit {
+            break
+        }
+    }
+
+    return terms
+}
@@ -0,0 +1,150 @@
+import Foundation
+import Redis
+import LoggerAPI
+
+
+/**
+ * Redis usage of a single HTTP request: number of round trips, bytes sent/received and time spent waiting for redis.
+ * Set by the 'TracingMiddleware' for the thread that is answering the request, and updated by 'Database.withClient()'.
+ */
+class RedisTrace {
+    static let slowThreshold = (Double(ProcessInfo.processInfo.environment["REDIS_SLOW_MS"] ?? "50") ?? 50) / 1000
+
+    var roundTrips = 0
+    var bytesSent = 0
+    var bytesReceived = 0
+    var elapsed: TimeInterval = 0
+    var callers = [String: Int]()   // 'Database' method -> number of round trips
+
+
+    /**
+     * The trace of the request being answered in the current thread (if tracing is enabled).
+     */
+    static var current: RedisTrace? {
+        get {
+            return Thread.current.threadDictionary[ "redis_trace" ] as? RedisTrace
+        }
+
+        set {
+            Thread.current.threadDictionary[ "redis_trace" ] = newValue
+        }
+    }
+
+
+    /**
+     * Add a round trip to the trace of the current request, and log it if it was slow.
+     */
+    static func record(caller: String, elapsed: TimeInterval) {
+        if elapsed >= RedisTrace.slowThreshold {
+            Log.warning("Slow redis call: \(caller) took \(Int( elapsed * 1000 ))ms.")
+        }
+
+        guard let trace = RedisTrace.current else {
+            return
+        }
+
+        trace.roundTrips += 1
+        trace.elapsed += elapsed
+        trace.callers[ caller, default: 0 ] += 1
+    }
+
+
+    /**
+     * Add the size of a command (or pipeline) and its reply to the trace of the current request.
+     */
+    static func recordBytes(sent: Int, received: Int) {
+        guard let trace = RedisTrace.current else {
+            return
+        }
+
+        trace.bytesSent += sent
+        trace.bytesReceived += received
+    }
+
+
+    /**
+     * Size of a command in the redis protocol (RESP).
+     */
+    static func commandSize(_ command: Command, _ params: [BytesConvertible]) -> Int {
+        var size = RedisTrace.headerSize("*", params.count + 1) + RedisTrace.bulkSize(command.makeBytes().count)
+
+        for param in params {
+            size += RedisTrace.bulkSize((try? param.makeBytes().count) ?? 0)
+        }
+
+        return size
+    }
+
+
+    /**
+     * Approximate size of a reply in the redis protocol (RESP).
+     */
+    static func replySize(_ reply: Redis.Data?) -> Int {
+        guard let reply = reply else {
+            return 5     // "$-1\r\n"
+        }
+
+        if let array = reply.array {
+            return array.reduce(RedisTrace.headerSize("*", array.count)) { $0 + RedisTrace.replySize($1) }
+        }
+
+        if let value = reply.string {
+            return RedisTrace.bulkSize(value.utf8.count)
+        }
+
+        return RedisTrace.headerSize(":", reply.int ?? 0)
+    }
+
+
+    private static func headerSize(_ type: String, _ value: Int) -> Int {
+        return 1 + String( value ).utf8.count + 2
+    }
+
+
+    private static func bulkSize(_ length: Int) -> Int {
+        return RedisTrace.headerSize("$", length) + length + 2
+    }
+}
+
+
+/**
+ * A pipeline that keeps track of the size of its commands and replies (see 'RedisTrace').
+ * The commands are queued here, and sent in a regular pipeline by 'execute()'.
+ * The writes in the pipeline make the rest of the request read from the primary (see 'ReplicaSet.noteCommand()').
+ */
+final class TracedPipeline {
+    private let client: TCPClient
+    private var commands = [(command: Command, params: [BytesConvertible])]()
+
+
+    init(client: TCPClient) {
+        self.client = client
+    }
+
+
+    @discardableResult
+    func enqueue(_ command: Command, _ params: [BytesConvertible] = []) throws -> TracedPipeline {
+        self.commands.append((command, params))
+
+        return self
+    }
+
+
+    func execute() throws -> [Redis.Data?] {
+        let pipeline = self.client.makePipeline()
+        var sent = 0
+
+        for (command, params) in self.commands {
+            try pipeline.enqueue(command, params)
+            sent += RedisTrace.commandSize(command, params)
+            ReplicaSet.noteCommand(command)
+        }
+
+        let replies = try pipeline.execute()
+
+        RedisTrace.recordBytes(sent: sent, received: replies.reduce(0) { $0 + RedisTrace.replySize($1) })
+
+        return replies
+    }
+}
+
@@ -1,3 +1,4 @@
+import Foundation
 import Kitura
 import KituraNet
 import Cryptor
@@ -24,6 +25,64 @@ func unsuccessfulRequest(_ message: String, _ response: RouterResponse, _ code:
 }
 
 
+/**
+ * The server is overloaded, ask the client to try again later.
+ */
+func serverBusy(_ response: RouterResponse) throws {
+    response.headers["Retry-After"] = "1"
+    try unsuccessfulRequest("Server busy, try again later.", response, .serviceUnavailable)
+}
+
+
+/**
+ * The client went over its rate limit (see 'RateLimiter'), and can try again after 'retryAfter' seconds.
+ */
+func tooManyRequests(_ retryAfter: Int, _ response: RouterResponse) throws {
+    response.headers["Retry-After"] = String( retryAfter )
+    try unsuccessfulRequest("Too many requests, try again later.", response, .tooManyRequests)
+}
+
+
+/**
+ * Send a successful response with a (possibly very large) list, without building the whole list in memory first.
+ * The 'iterate' function gives the elements a batch at a time, and each batch is encoded and added to the response right away.
+ * Results in the same json as a '[String: Any]' dictionary with "success" and the list in the 'field' key.
+ */
+func sendList(_ field: String, _ response: RouterResponse, _ iterate: (([String]) throws -> Void) throws -> Void) throws {
+    var first = true
+
+    response.headers["Content-Type"] = "application/json; charset=utf-8"
+    response.status(.OK).send("{\"success\":true,\"\(field)\":[")
+
+    try iterate {
+        batch in
+
+            // encode the batch as a json array, and only keep the elements (without the square brackets)
+        let data = try JSONSerialization.data(withJSONObject: batch)
+        let elements = data.subdata(in: 1 ..< data.count - 1)
+
+        if !first {
+            response.send(",")
+        }
+
+        response.send(data: elements)
+        first = false
+    }
+
+    try response.send("]}").end()
+}
+
+
+/**
+ * Send a successful response with json that was already encoded (see 'JSONObject').
+ */
+func sendJSON(_ data: Data, _ response: RouterResponse) throws {
+    response.headers["Content-Type"] = "application/json; charset=utf-8"
+
+    try response.status(.OK).send(data: data).end()
+}
+
+
 /**
  * Check if the required post parameters were sent.
  */
@@ -53,6 +112,92 @@ func getPostParameters(_ keys: [String], _ request: RouterRequest, _ response: R
 }
 
 
+/**
+ * Get the optional 'limit' / 'cursor' query parameters, used to paginate the listings.
+ * The 'limit' needs to be between 1 and 1000 (defaults to 100).
+ */
+func getPageParameters(_ request: RouterRequest, _ response: RouterResponse) throws -> (limit: Int, cursor: String?)? {
+    var limit = 100
+
+    if let limitString = request.queryParameters["limit"] {
+        guard let value = Int(limitString), value >= 1 && value <= 1000 else {
+            try unsuccessfulRequest("'limit' needs to be a number between 1 and 1000.", response, .badRequest)
+            return nil
+        }
+
+        limit = value
+    }
+
+    let cursor = request.queryParameters["cursor"]
+
+    if cursor != nil && cursor!.isEmpty {
+        try unsuccessfulRequest("Invalid 'cursor' argument.", response, .badRequest)
+        return nil
+    }
+
+    return (limit, cursor)
+}
+
+
+/**
+ * Get the arguments of the feed routes: 'limit' (optional, between 1 and 100, 20 by default) / 'before' (optional, a time in seconds).
+ */
+func getFeedParameters(_ request: RouterRequest, _ response: RouterResponse) throws -> (limit: Int, before: String?)? {
+    guard let limit = Int(request.queryParameters["limit"] ?? "20"), limit >= 1 && limit <= 100 else {
+        try unsuccessfulRequest("'limit' needs to be a number between 1 and 100.", response, .badRequest)
+        return nil
+    }
+
+    let before = request.queryParameters["before"]
+
+        // 'Double()' also accepts "nan" and "inf", which redis doesn't take as a score
+    if before != nil && !(Double(before!)?.isFinite ?? false) {
+        try unsuccessfulRequest("'before' needs to be a time in seconds.", response, .badRequest)
+        return nil
+    }
+
+    return (limit, before)
+}
+
+
+/**
+ * Send a page of the most recent posts (of everyone, or only of the given user), see 'Database.getFeed()'.
+ */
+func sendFeed(username: String?, _ request: RouterRequest, _ response: RouterResponse) throws {
+    guard let params = try getFeedParameters(request, response) else { return }
+
+    let feed = try DB.getFeed(username: username, limit: params.limit, before: params.before)
+
+    var result = JSONObject()
+    try result.append("success", true)
+    try result.append("posts", json: try encodePostsList(feed.posts))
+
+    if let nextBefore = feed.nextBefore {
+        try result.append("next_before", nextBefore)
+    }
+
+    try sendJSON(result.encoded(), response)
+}
+
+
+/**
+ * The optional 'count' argument of the random routes needs to be between 1 and 100.
+ * Returns 1 if it wasn't given.
+ */
+func getCountParameter(_ request: RouterRequest, _ response: RouterResponse) throws -> Int? {
+    guard let countString = request.queryParameters["count"] else {
+        return 1
+    }
+
+    guard let count = Int(countString), count >= 1 && count <= 100 else {
+        try unsuccessfulRequest("'count' needs to be a number between 1 and 100.", response, .badRequest)
+        return nil
+    }
+
+    return count
+}
+
+
 /**
  * An 'username' needs to be between 3 and 20 characters.
  */
@@ -100,17 +245,56 @@ func validateTitleBody(_ params: [String: String], _ response: RouterResponse) t
     let title = params["title"]!
     let body = params["body"]!
 
-    guard title.count >= 5 && title.count <= 100 else {
-        try unsuccessfulRequest("'title' needs to be between 5 and 100 characters.", response, .badRequest)
+    if let message = checkTitleBody(title, body) {
+        try unsuccessfulRequest(message, response, .badRequest)
         return nil
     }
 
+    return (title, body)
+}
+
+
+/**
+ * Check the length of the 'title' and 'body' values.
+ * Returns the error message if they're not valid.
+ */
+func checkTitleBody(_ title: String, _ body: String) -> String? {
+    guard title.count >= 5 && title.count <= 100 else {
+        return "'title' needs to be between 5 and 100 characters."
+    }
+
     guard body.count >= 10 && body.count <= 10_000 else {
-        try unsuccessfulRequest("'body' needs to be between 10 and 10000 characters.", response, .badRequest)
+        return "'body' needs to be between 10 and 10000 characters."
+    }
+
+    return nil
+}
+
+
+/**
+ * Parse a json array of '{ "title": ..., "body": ... }' objects (between 1 and 'limit' of them).
+ * The elements that aren't objects with a string 'title' and 'body' are returned as nil.
+ */
+func validatePostsList(_ json: String, _ limit: Int, _ response: RouterResponse) throws -> [(title: String, body: String)?]? {
+    guard let data = json.data(using: .utf8), let list = (try? JSONSerialization.jsonObject(with: data)) as? [Any] else {
+        try unsuccessfulRequest("'posts' needs to be a json array.", response, .badRequest)
         return nil
     }
 
-    return (title, body)
+    guard list.count >= 1 && list.count <= limit else {
+        try unsuccessfulRequest("'posts' needs to have between 1 and \(limit) elements.", response, .badRequest)
+        return nil
+    }
+
+    return list.map {
+        element in
+
+        guard let post = element as? [String: Any], let title = post["title"] as? String, let body = post["body"] as? String else {
+            return nil
+        }
+
+        return (title: title, body: body)
+    }
 }
 
 
@@ -118,7 +302,15 @@ func validateTitleBody(_ params: [String: String], _ response: RouterResponse) t
  * See if a blog post with the given ID exists.
  */
 func validateBlogPost(_ blogId: String, _ response: RouterResponse) throws -> [String: String]? {
-    guard let post = DB.getBlogPost(id: blogId) else {
+    return try validateCachedPost(blogId, response)?.fields
+}
+
+
+/**
+ * Same as 'validateBlogPost()', but returns the post with its json already encoded.
+ */
+func validateCachedPost(_ blogId: String, _ response: RouterResponse) throws -> CachedPost? {
+    guard let post = DB.getCachedPost(id: blogId) else {
         try unsuccessfulRequest("Didn't find the blog post.", response, .notFound)
         return nil
     }
@@ -127,6 +319,42 @@ func validateBlogPost(_ blogId: String, _ response: RouterResponse) throws -> [S
 }
 
 
+/**
+ * The 'ETag' of a blog post changes whenever the post is updated.
+ * The contents are part of the digest as well, since 'last_updated' only has a precision of one second.
+ */
+func getPostETag(_ blogId: String, _ post: [String: String]) -> String {
+    let digest = Digest(using: .md5).update(string: "\(blogId)\n\(post["last_updated"]!)\n\(post["title"]!)\n\(post["body"]!)")!.final()
+
+    return "\"\(CryptoUtils.hexString(from: digest))\""
+}
+
+
+/**
+ * Check the 'If-None-Match' header against the current 'ETag'.
+ * The header can have a list of tags (separated by commas), weak tags ('W/' prefix, compared like the strong ones), or '*' to match any version.
+ */
+func etagMatches(_ header: String?, _ etag: String) -> Bool {
+    guard let header = header else {
+        return false
+    }
+
+    for tag in header.split(separator: ",") {
+        var tag = tag.trimmingCharacters(in: .whitespaces)
+
+        if tag.hasPrefix("W/") {
+            tag = String( tag.dropFirst(2) )
+        }
+
+        if tag == "*" || tag == etag {
+            return true
+        }
+    }
+
+    return false
+}
+
+
 /**
  * Check if we received the necessary 'blogId' parameter.
  */
@@ -140,6 +368,34 @@ func validateBlogId(_ request: RouterRequest, _ response: RouterResponse) throws
 }
 
 
+/**
+ * Parse a comma separated list of blog ids (between 1 and 100 of them).
+ */
+func validateBlogIds(_ idsString: String, _ response: RouterResponse) throws -> [String]? {
+    var ids = [String]()
+
+    for id in idsString.split(separator: ",") {
+        let trimmed = id.trimmingCharacters(in: .whitespaces)
+
+        guard Int(trimmed) != nil else {
+            try unsuccessfulRequest("'ids' needs to be a comma separated list of numbers.", response, .badRequest)
+            return nil
+        }
+
+        if !ids.contains(trimmed) {
+            ids.append(trimmed)
+        }
+    }
+
+    guard ids.count >= 1 && ids.count <= 100 else {
+        try unsuccessfulRequest("'ids' needs to have between 1 and 100 elements.", response, .badRequest)
+        return nil
+    }
+
+    return ids
+}
+
+
 /**
  * See if the username is the same as the post author.
  */
@@ -162,7 +418,16 @@ func authenticateUser(_ username: String, _ password: String, _ response: Router
         return false
     }
 
-    let testPassword = getPasswordHash(string: password, salt: user["salt"]!)
+    let testPassword: String
+
+    do {
+        testPassword = try HASHER.hash(password: password, salt: user["salt"]!)
+    }
+
+    catch PasswordHasherError.busy {
+        try serverBusy(response)
+        return false
+    }
 
     guard user["password"]! == testPassword else {
         try unsuccessfulRequest("Invalid password.", response, .badRequest)
@@ -0,0 +1,317 @@
+"""
+    Load generator for the blog api.
+
+    Seeds the database with some users and posts, then sends a mix of requests
+    from several threads (each with its own keep-alive session), and reports the
+    throughput and latency percentiles of each route as json.
+
+    Usage example:
+        python3 Tests/benchmark.py --users 10 --posts 200 --concurrency 16 --duration 30
+        python3 Tests/benchmark.py --mix get=80,add=5,login=5,getall=10 --output results.json
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urljoin
+
+import requests
+
+URL = 'http://localhost:8000/'
+PASSWORD = 'bbbbbb'
+
+# route name -> the route template (used in the report)
+ROUTES = {
+    'get': 'GET /blog/get/:blogId',
+    'get_many': 'GET /blog/get_many',
+    'add': 'POST /blog/add',
+    'update': 'POST /blog/update',
+    'login': 'POST /user/login',
+    'getall': 'GET /blog/getall',
+    'user_getall': 'GET /user/getall',
+    'user_posts': 'GET /blog/:username/getall',
+    'random': 'GET /blog/random',
+    'user_random': 'GET /user/random',
+}
+DEFAULT_MIX = 'get=60,get_many=5,add=5,update=5,login=2,getall=8,user_getall=5,user_posts=5,random=5'
+
+
+class Benchmark:
+    def __init__(self, url, users, posts, mix, namespace=None):
+        self.url = url
+        self.headers = {'X-Namespace': namespace} if namespace else {}
+        self.usersCount = users
+        self.postsCount = posts
+        self.mix = mix
+        self.users = []     # list of { 'username', 'token' }
+        self.posts = []     # list of { 'id', 'username' }
+        self.local = threading.local()
+
+    def getSession(self):
+        """
+            Each thread has its own session (so the connections are reused between requests).
+        """
+        session = getattr(self.local, 'session', None)
+
+        if session is None:
+            session = requests.Session()
+            session.headers.update(self.headers)
+            self.local.session = session
+
+        return session
+
+    def makeRequest(self, path, data=None):
+        """
+            Make a GET request if 'data' is not passed.
+            Otherwise do a POST request with the given 'data' dictionary.
+            Returns the response and the time it took (in seconds).
+        """
+        completeUrl = urljoin(self.url, path)
+        session = self.getSession()
+        start = time.perf_counter()
+
+        if data is None:
+            r = session.get(completeUrl)
+
+        else:
+            r = session.post(completeUrl, data=data)
+
+        return r, time.perf_counter() - start
+
+    def seed(self):
+        """
+            Create the users (each with a token) and the posts (distributed between the users).
+        """
+        runId = random.randint(0, 1_000_000)
+
+        for a in range(self.usersCount):
+            username = 'bench{0}_{1}'.format(runId, a)
+            r, _ = self.makeRequest('/user/create', {
+                'username': username,
+                'password': PASSWORD
+            })
+            response = r.json()
+
+            if not response['success']:
+                raise RuntimeError(
+                    'Failed to create a user: {0}'.format(response['message']))
+
+            self.users.append({
+                'username': username,
+                'token': response['token']
+            })
+
+        for a in range(self.postsCount):
+            user = self.users[a % len(self.users)]
+            r, _ = self.makeRequest('/blog/add', {
+                'token': user['token'],
+                'title': 'The title {0}.'.format(a),
+                'body': 'The body message {0}.'.format(a) * 10
+            })
+            self.posts.append({
+                'id': r.json()['post_id'],
+                'username': user['username']
+            })
+
+    def runRoute(self, name):
+        """
+            Make a request to one of the routes in 'ROUTES', with random (valid) arguments.
+        """
+        user = random.choice(self.users)
+
+        if name == 'get':
+            return self.makeRequest('/blog/get/{0}'.format(random.choice(self.posts)['id']))
+
+        elif name == 'get_many':
+            posts = random.sample(self.posts, min(10, len(self.posts)))
+            return self.makeRequest('/blog/get_many?ids=' + ','.join(str(post['id']) for post in posts))
+
+        elif name == 'add':
+            return self.makeRequest('/blog/add', {
+                'token': user['token'],
+                'title': 'The title.',
+                'body': 'The body message.'
+            })
+
+        elif name == 'update':
+            post = random.choice(self.posts)
+            author = next(a for a in self.users if a['username'] == post['username'])
+            return self.makeRequest('/blog/update', {
+                'token': author['token'],
+                'blogId': post['id'],
+                'title': 'The new title.',
+                'body': 'The new body message.'
+            })
+
+        elif name == 'login':
+            return self.makeRequest('/user/login', {
+                'username': user['username'],
+                'password': PASSWORD
+            })
+
+        elif name == 'getall':
+            return self.makeRequest('/blog/getall')
+
+        elif name == 'user_getall':
+            return self.makeRequest('/user/getall')
+
+        elif name == 'user_posts':
+            return self.makeRequest('/blog/{0}/getall'.format(user['username']))
+
+        elif name == 'random':
+            return self.makeRequest('/blog/random')
+
+        elif name == 'user_random':
+            return self.makeRequest('/user/random')
+
+        raise ValueError('Unknown route: {0}'.format(name))
+
+    def worker(self, deadline):
+        """
+            Keep making requests until the deadline.
+            Returns a dictionary with the latencies (and errors count) of each route.
+        """
+        names = list(self.mix.keys())
+        weights = list(self.mix.values())
+        results = {name: {'latencies': [], 'errors': 0} for name in names}
+
+        while time.perf_counter() < deadline:
+            name = random.choices(names, weights)[0]
+            result = results[name]
+
+            try:
+                r, elapsed = self.runRoute(name)
+
+            except requests.RequestException:
+                result['errors'] += 1
+                continue
+
+            result['latencies'].append(elapsed)
+
+            if r.status_code >= 400:
+                result['errors'] += 1
+
+        return results
+
+    def run(self, concurrency, duration):
+        """
+            Run the workers for 'duration' seconds, and return the report.
+        """
+        deadline = time.perf_counter() + duration
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = [executor.submit(self.worker, deadline)
+                       for _ in range(concurrency)]
+            allResults = [future.result() for future in futures]
+
+        routes = {}
+        everything = []
+
+        for name in self.mix:
+            latencies = []
+            errors = 0
+
+            for results in allResults:
+                latencies.extend(results[name]['latencies'])
+                errors += results[name]['errors']
+
+            everything.extend(latencies)
+            routes[ROUTES[name]] = summary(latencies, errors, duration)
+
+        return {
+            'concurrency': concurrency,
+            'duration': duration,
+            'users': self.usersCount,
+            'posts': self.postsCount,
+            'total': summary(everything, sum(a['errors'] for a in routes.values()), duration),
+            'routes': routes
+        }
+
+
+def percentile(values, percent):
+    """
+        The value below which 'percent' of the (sorted) values are.
+    """
+    if not values:
+        return None
+
+    index = min(int(round(percent / 100 * (len(values) - 1))), len(values) - 1)
+    return values[index]
+
+
+def summary(latencies, errors, duration):
+    """
+        Throughput (requests per second) and latency percentiles (in milliseconds).
+    """
+    latencies = sorted(latencies)
+
+    def toMs(value):
+        return None if value is None else round(value * 1000, 3)
+
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'throughput': round(len(latencies) / duration, 2),
+        'mean_ms': toMs(sum(latencies) / len(latencies)) if latencies else None,
+        'p50_ms': toMs(percentile(latencies, 50)),
+        'p95_ms': toMs(percentile(latencies, 95)),
+        'p99_ms': toMs(percentile(latencies, 99)),
+        'max_ms': toMs(latencies[-1]) if latencies else None
+    }
+
+
+def parseMix(mixString):
+    """
+        Parse a 'name=weight,name=weight' string.
+    """
+    mix = {}
+
+    for part in mixString.split(','):
+        name, weight = part.split('=')
+        name = name.strip()
+
+        if name not in ROUTES:
+            raise argparse.ArgumentTypeError(
+                "Unknown route '{0}' (available: {1}).".format(name, ', '.join(ROUTES)))
+
+        mix[name] = float(weight)
+
+    return mix
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the blog api.')
+    parser.add_argument('--url', default=URL)
+    parser.add_argument('--users', type=int, default=10,
+                        help='Number of users to create.')
+    parser.add_argument('--posts', type=int, default=100,
+                        help='Number of posts to create.')
+    parser.add_argument('--concurrency', type=int, default=8,
+                        help='Number of simultaneous clients.')
+    parser.add_argument('--duration', type=float, default=10,
+                        help='For how long to run (in seconds).')
+    parser.add_argument('--mix', type=parseMix, default=parseMix(DEFAULT_MIX),
+                        help='Weight of each route (default: {0}).'.format(DEFAULT_MIX))
+    parser.add_argument('--namespace',
+                        help="Use a separate namespace of the database (the server needs to run with 'NAMESPACE_HEADER=1').")
+    parser.add_argument('--output', help='Write the report to this file (otherwise print it).')
+    args = parser.parse_args()
+
+    benchmark = Benchmark(args.url, max(args.users, 1),
+                          max(args.posts, 1), args.mix, args.namespace)
+    benchmark.seed()
+    report = benchmark.run(args.concurrency, args.duration)
+    text = json.dumps(report, indent=4)
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text)
+
+    else:
+        print(text)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,990 @@
+"""
+    In-memory stand-in for the redis server, to run the tests and the benchmark
+    without a real redis (and to measure the overhead of the api server alone).
+
+    Speaks the subset of the redis protocol (RESP) that the server uses: strings,
+    hashes, sets, sorted sets, key expiration, SCAN, MULTI/EXEC, pipelining and
+    pub/sub. The Lua scripts (EVAL/EVALSHA) need the 'lupa' package.
+
+    A latency can be added to every round trip (once per batch of pipelined
+    commands), to model a slow network.
+
+    Usage example:
+        python3 Tests/fake_redis.py --port 6380 --latency 0.5 --jitter 0.2
+        REDIS_URL=redis://localhost:6380 NAMESPACE_HEADER=1 swift run
+"""
+import argparse
+import asyncio
+import fnmatch
+import hashlib
+import random
+import time
+from collections import defaultdict
+
+try:
+    import lupa
+
+except ImportError:
+    lupa = None
+
+
+class ReplyError(Exception):
+    """
+        An error reply ('-ERR message'), the message should start with the error type.
+    """
+
+
+class Status(bytes):
+    """
+        A simple string reply ('+OK').
+    """
+
+
+OK = Status(b'OK')
+QUEUED = Status(b'QUEUED')
+WRONG_TYPE = 'WRONGTYPE Operation against a key holding the wrong kind of value'
+
+
+class SortedSet(dict):
+    """
+        A sorted set is kept as a dictionary of member -> score, and sorted when read.
+    """
+
+    def ordered(self):
+        return sorted(self.items(), key=lambda item: (item[1], item[0]))
+
+
+TYPE_NAMES = {bytes: b'string', dict: b'hash', set: b'set', SortedSet: b'zset'}
+
+
+def encodeReply(reply, out):
+    """
+        Add the RESP encoding of a reply to the 'out' bytearray.
+    """
+    if isinstance(reply, Status):
+        out += b'+' + reply + b'\r\n'
+
+    elif isinstance(reply, ReplyError):
+        out += b'-' + str(reply).encode() + b'\r\n'
+
+    elif reply is None:
+        out += b'$-1\r\n'
+
+    elif isinstance(reply, bool):
+        out += b':1\r\n' if reply else b':0\r\n'
+
+    elif isinstance(reply, int):
+        out += b':' + str(reply).encode() + b'\r\n'
+
+    elif isinstance(reply, (bytes, str)):
+        value = reply.encode() if isinstance(reply, str) else reply
+        out += b'$' + str(len(value)).encode() + b'\r\n' + value + b'\r\n'
+
+    else:
+        out += b'*' + str(len(reply)).encode() + b'\r\n'
+
+        for item in reply:
+            encodeReply(item, out)
+
+
+def parseCommand(buffer, start):
+    """
+        Parse a command from the buffer (in the RESP format, or an inline command).
+        Returns the arguments and the position after the command, or None if the command isn't complete yet.
+    """
+    end = buffer.find(b'\r\n', start)
+
+    if end < 0:
+        return None
+
+    if buffer[start:start + 1] != b'*':
+        return bytes(buffer[start:end]).split(), end + 2
+
+    count = int(buffer[start + 1:end])
+    position = end + 2
+    arguments = []
+
+    for _ in range(count):
+        end = buffer.find(b'\r\n', position)
+
+        if end < 0:
+            return None
+
+        length = int(buffer[position + 1:end])
+        position = end + 2
+
+        if len(buffer) < position + length + 2:
+            return None
+
+        arguments.append(bytes(buffer[position:position + length]))
+        position += length + 2
+
+    return arguments, position
+
+
+def toFloat(value):
+    try:
+        return float(value)
+
+    except ValueError:
+        raise ReplyError('ERR value is not a valid float')
+
+
+def toInt(value):
+    try:
+        return int(value)
+
+    except ValueError:
+        raise ReplyError('ERR value is not an integer or out of range')
+
+
+def formatScore(score):
+    """
+        Same format redis uses for the scores ('%.17g').
+    """
+    return ('%.17g' % score).encode()
+
+
+def parseScoreBound(value):
+    """
+        A score bound of ZRANGEBYSCORE ('-inf' / '+inf' / '(1.5' for exclusive / '1.5').
+        Returns the score and if it's exclusive.
+    """
+    if value.startswith(b'('):
+        return toFloat(value[1:]), True
+
+    return toFloat(value), False
+
+
+def parseLexBound(value):
+    """
+        A lexicographical bound of ZRANGEBYLEX ('-' / '+' / '(abc' for exclusive / '[abc' for inclusive).
+        Returns the value (None for '-'/'+') and if it's exclusive.
+    """
+    if value in (b'-', b'+'):
+        return None, False
+
+    if value[:1] not in (b'(', b'['):
+        raise ReplyError('ERR min or max not valid string range item')
+
+    return value[1:], value.startswith(b'(')
+
+
+def matches(key, pattern):
+    return pattern is None or fnmatch.fnmatchcase(key.decode('latin-1'), pattern.decode('latin-1'))
+
+
+class Client:
+    """
+        State of a connection.
+    """
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.db = 0
+        self.transaction = None   # list of the queued commands, while in a 'MULTI'
+        self.channels = set()
+
+
+class FakeRedis:
+    def __init__(self, latency=0, jitter=0):
+        self.latency = latency      # seconds added to every round trip
+        self.jitter = jitter
+        self.databases = defaultdict(dict)
+        self.expires = defaultdict(dict)   # db -> key -> time it expires
+        self.scripts = {}                   # sha1 -> source
+        self.compiledScripts = {}
+        self.subscribers = defaultdict(set)
+        self.lua = None
+        self.scriptClient = None
+        self.commandsCount = 0
+
+        self.commands = {
+            'PING': self.ping, 'ECHO': self.echo, 'AUTH': self.auth, 'SELECT': self.select,
+            'FLUSHALL': self.flushall, 'FLUSHDB': self.flushdb, 'DBSIZE': self.dbsize, 'INFO': self.info,
+            'TIME': self.time, 'COMMAND': self.command, 'CLIENT': self.client, 'MEMORY': self.memory,
+            'GET': self.get, 'SET': self.set, 'INCR': self.incr, 'INCRBY': self.incrby,
+            'DEL': self.delete, 'UNLINK': self.delete, 'EXISTS': self.exists, 'TYPE': self.type,
+            'EXPIRE': self.expire, 'PEXPIRE': self.pexpire, 'TTL': self.ttl, 'RENAME': self.rename,
+            'KEYS': self.keys, 'SCAN': self.scan,
+            'HSET': self.hset, 'HMSET': self.hmset, 'HGET': self.hget, 'HMGET': self.hmget,
+            'HGETALL': self.hgetall, 'HDEL': self.hdel, 'HEXISTS': self.hexists, 'HLEN': self.hlen,
+            'HSTRLEN': self.hstrlen,
+            'SADD': self.sadd, 'SREM': self.srem, 'SMEMBERS': self.smembers, 'SCARD': self.scard,
+            'SISMEMBER': self.sismember, 'SRANDMEMBER': self.srandmember, 'SSCAN': self.sscan,
+            'ZADD': self.zadd, 'ZREM': self.zrem, 'ZCARD': self.zcard, 'ZSCORE': self.zscore,
+            'ZRANGE': self.zrange, 'ZRANGEBYSCORE': self.zrangebyscore,
+            'ZREVRANGEBYSCORE': self.zrevrangebyscore, 'ZRANGEBYLEX': self.zrangebylex,
+            'ZREMRANGEBYSCORE': self.zremrangebyscore, 'ZREVRANGE': self.zrevrange, 'ZSCAN': self.zscan,
+            'ZUNIONSTORE': self.zunionstore, 'ZINTERSTORE': self.zinterstore,
+            'PUBLISH': self.publish, 'SUBSCRIBE': self.subscribe, 'UNSUBSCRIBE': self.unsubscribe,
+            'SCRIPT': self.script, 'EVAL': self.eval, 'EVALSHA': self.evalsha,
+        }
+
+    # ---- connections ----
+
+    async def handleConnection(self, reader, writer):
+        client = Client(writer)
+        buffer = bytearray()
+
+        try:
+            while True:
+                data = await reader.read(65536)
+
+                if not data:
+                    break
+
+                buffer += data
+                out = bytearray()
+                position = 0
+
+                # answer all the complete commands received (a pipeline is answered in a single round trip)
+                while True:
+                    parsed = parseCommand(buffer, position)
+
+                    if parsed is None:
+                        break
+
+                    arguments, position = parsed
+
+                    if arguments:
+                        encodeReply(self.execute(client, arguments), out)
+
+                del buffer[:position]
+
+                if out:
+                    if self.latency or self.jitter:
+                        await asyncio.sleep(max(self.latency + random.uniform(-self.jitter, self.jitter), 0))
+
+                    writer.write(out)
+                    await writer.drain()
+
+        except (ConnectionError, ValueError):
+            pass
+
+        finally:
+            for channel in client.channels:
+                self.subscribers[channel].discard(client)
+
+            writer.close()
+
+    def execute(self, client, arguments):
+        """
+            Run a command, and return its reply (errors are returned as well, as a 'ReplyError').
+        """
+        name = arguments[0].decode('latin-1').upper()
+        self.commandsCount += 1
+
+        if client.transaction is not None and name not in ('MULTI', 'EXEC', 'DISCARD'):
+            client.transaction.append(arguments)
+            return QUEUED
+
+        if name == 'MULTI':
+            if client.transaction is not None:
+                return ReplyError('ERR MULTI calls can not be nested')
+
+            client.transaction = []
+            return OK
+
+        if name == 'EXEC':
+            if client.transaction is None:
+                return ReplyError('ERR EXEC without MULTI')
+
+            queued, client.transaction = client.transaction, None
+            return [self.execute(client, command) for command in queued]
+
+        if name == 'DISCARD':
+            if client.transaction is None:
+                return ReplyError('ERR DISCARD without MULTI')
+
+            client.transaction = None
+            return OK
+
+        handler = self.commands.get(name)
+
+        if handler is None:
+            return ReplyError("ERR unknown command '{0}'".format(name))
+
+        try:
+            return handler(client, *arguments[1:])
+
+        except TypeError:
+            return ReplyError("ERR wrong number of arguments for '{0}' command".format(name.lower()))
+
+        except ReplyError as error:
+            return error
+
+    # ---- keys ----
+
+    def data(self, client):
+        return self.databases[client.db]
+
+    def lookup(self, client, key, kind=None):
+        """
+            Get the value of a key (None if it doesn't exist or expired), checking that it's of the expected type.
+        """
+        data = self.data(client)
+        expires = self.expires[client.db]
+
+        if key in expires and expires[key] <= time.time():
+            del expires[key]
+            data.pop(key, None)
+
+        value = data.get(key)
+
+        if value is not None and kind is not None and type(value) is not kind:
+            raise ReplyError(WRONG_TYPE)
+
+        return value
+
+    def create(self, client, key, kind):
+        value = self.lookup(client, key, kind)
+
+        if value is None:
+            value = kind()
+            self.data(client)[key] = value
+
+        return value
+
+    def removeIfEmpty(self, client, key):
+        if not self.data(client).get(key):
+            self.remove(client, key)
+
+    def remove(self, client, key):
+        self.expires[client.db].pop(key, None)
+        return self.data(client).pop(key, None) is not None
+
+    def liveKeys(self, client):
+        return [key for key in list(self.data(client)) if self.lookup(client, key) is not None]
+
+    def ping(self, client, message=None):
+        return Status(b'PONG') if message is None else message
+
+    def echo(self, client, message):
+        return message
+
+    def auth(self, client, *arguments):
+        return OK
+
+    def select(self, client, index):
+        client.db = toInt(index)
+        return OK
+
+    def flushall(self, client, *arguments):
+        self.databases.clear()
+        self.expires.clear()
+        return OK
+
+    def flushdb(self, client, *arguments):
+        self.data(client).clear()
+        self.expires[client.db].clear()
+        return OK
+
+    def dbsize(self, client):
+        return len(self.liveKeys(client))
+
+    def info(self, client, *sections):
+        lines = [
+            '# Server', 'redis_version:7.0.0-fake',
+            '# Replication', 'role:master', 'connected_slaves:0',
+            '# Memory', 'used_memory:{0}'.format(sum(self.sizeOf(value) for data in self.databases.values() for value in data.values())),
+            '# Stats', 'total_commands_processed:{0}'.format(self.commandsCount),
+            '# Keyspace'
+        ]
+
+        for index, data in sorted(self.databases.items()):
+            if data:
+                lines.append('db{0}:keys={1},expires={2}'.format(index, len(data), len(self.expires[index])))
+
+        return '\r\n'.join(lines) + '\r\n'
+
+    def time(self, client):
+        now = time.time()
+        return [str(int(now)), str(int(now * 1_000_000) % 1_000_000)]
+
+    def command(self, client, *arguments):
+        return []
+
+    def client(self, client, *arguments):
+        return OK
+
+    def sizeOf(self, value):
+        """
+            Rough size of a value in memory (for 'MEMORY USAGE' / 'INFO memory').
+        """
+        if isinstance(value, bytes):
+            return 16 + len(value)
+
+        if isinstance(value, SortedSet):
+            return 16 + sum(len(member) + 24 for member in value)
+
+        if isinstance(value, dict):
+            return 16 + sum(len(field) + len(item) + 8 for field, item in value.items())
+
+        return 16 + sum(len(member) + 8 for member in value)
+
+    def memory(self, client, subcommand, key, *arguments):
+        if subcommand.upper() != b'USAGE':
+            raise ReplyError('ERR unknown subcommand')
+
+        value = self.lookup(client, key)
+        return None if value is None else self.sizeOf(value) + len(key)
+
+    def get(self, client, key):
+        return self.lookup(client, key, bytes)
+
+    def set(self, client, key, value, *options):
+        options = [option.upper() for option in options]
+        exists = self.lookup(client, key) is not None
+        expiresAt = None
+
+        if (b'NX' in options and exists) or (b'XX' in options and not exists):
+            return None
+
+        for index, option in enumerate(options):
+            if option in (b'EX', b'PX'):
+                amount = toInt(options[index + 1])
+                expiresAt = time.time() + (amount if option == b'EX' else amount / 1000)
+
+        self.remove(client, key)
+        self.data(client)[key] = bytes(value)
+
+        if expiresAt is not None:
+            self.expires[client.db][key] = expiresAt
+
+        return OK
+
+    def incrby(self, client, key, amount):
+        value = toInt(self.lookup(client, key, bytes) or b'0') + toInt(amount)
+        self.data(client)[key] = str(value).encode()
+        return value
+
+    def incr(self, client, key):
+        return self.incrby(client, key, b'1')
+
+    def delete(self, client, *keys):
+        return sum(1 for key in keys if self.lookup(client, key) is not None and self.remove(client, key))
+
+    def exists(self, client, *keys):
+        return sum(1 for key in keys if self.lookup(client, key) is not None)
+
+    def type(self, client, key):
+        value = self.lookup(client, key)
+        return Status(b'none' if value is None else TYPE_NAMES[type(value)])
+
+    def pexpire(self, client, key, milliseconds):
+        if self.lookup(client, key) is None:
+            return 0
+
+        self.expires[client.db][key] = time.time() + toInt(milliseconds) / 1000
+        return 1
+
+    def expire(self, client, key, seconds):
+        return self.pexpire(client, key, str(toInt(seconds) * 1000).encode())
+
+    def ttl(self, client, key):
+        if self.lookup(client, key) is None:
+            return -2
+
+        expiresAt = self.expires[client.db].get(key)
+        return -1 if expiresAt is None else round(expiresAt - time.time())
+
+    def rename(self, client, key, newKey):
+        value = self.lookup(client, key)
+
+        if value is None:
+            raise ReplyError('ERR no such key')
+
+        expiresAt = self.expires[client.db].get(key)
+        self.remove(client, key)
+        self.remove(client, newKey)
+        self.data(client)[newKey] = value
+
+        if expiresAt is not None:
+            self.expires[client.db][newKey] = expiresAt
+
+        return OK
+
+    def keys(self, client, pattern):
+        return [key for key in self.liveKeys(client) if matches(key, pattern)]
+
+    def scanList(self, members, cursor, options):
+        """
+            Common part of SCAN/SSCAN/ZSCAN: the cursor is the position in the sorted list of members.
+        """
+        pattern = None
+        count = 10
+
+        for index in range(0, len(options) - 1, 2):
+            if options[index].upper() == b'MATCH':
+                pattern = options[index + 1]
+
+            elif options[index].upper() == b'COUNT':
+                count = toInt(options[index + 1])
+
+        members = sorted(members)
+        start = toInt(cursor)
+        end = start + count
+        page = [member for member in members[start:end] if matches(member, pattern)]
+
+        return [str(end if end < len(members) else 0), page]
+
+    def scan(self, client, cursor, *options):
+        return self.scanList(self.liveKeys(client), cursor, options)
+
+    # ---- hashes ----
+
+    def hset(self, client, key, *fieldsValues):
+        if not fieldsValues or len(fieldsValues) % 2:
+            raise TypeError()
+
+        value = self.create(client, key, dict)
+        added = 0
+
+        for index in range(0, len(fieldsValues), 2):
+            added += fieldsValues[index] not in value
+            value[fieldsValues[index]] = fieldsValues[index + 1]
+
+        return added
+
+    def hmset(self, client, key, *fieldsValues):
+        self.hset(client, key, *fieldsValues)
+        return OK
+
+    def hget(self, client, key, field):
+        return (self.lookup(client, key, dict) or {}).get(field)
+
+    def hmget(self, client, key, *fields):
+        value = self.lookup(client, key, dict) or {}
+        return [value.get(field) for field in fields]
+
+    def hgetall(self, client, key):
+        value = self.lookup(client, key, dict) or {}
+        return [item for pair in value.items() for item in pair]
+
+    def hdel(self, client, key, *fields):
+        value = self.lookup(client, key, dict) or {}
+        removed = sum(1 for field in fields if value.pop(field, None) is not None)
+        self.removeIfEmpty(client, key)
+        return removed
+
+    def hexists(self, client, key, field):
+        return int(field in (self.lookup(client, key, dict) or {}))
+
+    def hlen(self, client, key):
+        return len(self.lookup(client, key, dict) or {})
+
+    def hstrlen(self, client, key, field):
+        return len((self.lookup(client, key, dict) or {}).get(field, b''))
+
+    # ---- sets ----
+
+    def sadd(self, client, key, *members):
+        if not members:
+            raise TypeError()
+
+        value = self.create(client, key, set)
+        count = len(value)
+        value.update(members)
+        return len(value) - count
+
+    def srem(self, client, key, *members):
+        value = self.lookup(client, key, set) or set()
+        count = len(value)
+        value.difference_update(members)
+        self.removeIfEmpty(client, key)
+        return count - len(value)
+
+    def smembers(self, client, key):
+        return list(self.lookup(client, key, set) or set())
+
+    def scard(self, client, key):
+        return len(self.lookup(client, key, set) or set())
+
+    def sismember(self, client, key, member):
+        return int(member in (self.lookup(client, key, set) or set()))
+
+    def srandmember(self, client, key, count=None):
+        members = list(self.lookup(client, key, set) or set())
+
+        if count is None:
+            return random.choice(members) if members else None
+
+        count = toInt(count)
+
+        if count >= 0:
+            return random.sample(members, min(count, len(members)))
+
+        return [random.choice(members) for _ in range(-count)] if members else []
+
+    def sscan(self, client, key, cursor, *options):
+        return self.scanList(self.lookup(client, key, set) or set(), cursor, options)
+
+    # ---- sorted sets ----
+
+    def zadd(self, client, key, *scoresMembers):
+        if not scoresMembers or len(scoresMembers) % 2:
+            raise TypeError()
+
+        scores = [toFloat(score) for score in scoresMembers[::2]]
+        value = self.create(client, key, SortedSet)
+        added = 0
+
+        for score, member in zip(scores, scoresMembers[1::2]):
+            added += member not in value
+            value[member] = score
+
+        return added
+
+    def zrem(self, client, key, *members):
+        value = self.lookup(client, key, SortedSet) or SortedSet()
+        removed = sum(1 for member in members if value.pop(member, None) is not None)
+        self.removeIfEmpty(client, key)
+        return removed
+
+    def zscan(self, client, key, cursor, *options):
+        value = self.lookup(client, key, SortedSet) or SortedSet()
+        nextCursor, page = self.scanList(value, cursor, options)
+
+        return [nextCursor, [item for member in page for item in (member, formatScore(value[member]))]]
+
+    def zcard(self, client, key):
+        return len(self.lookup(client, key, SortedSet) or SortedSet())
+
+    def zscore(self, client, key, member):
+        score = (self.lookup(client, key, SortedSet) or SortedSet()).get(member)
+        return None if score is None else formatScore(score)
+
+    def rangeReply(self, items, options):
+        """
+            Common part of the ZRANGE* commands: apply the 'LIMIT offset count' and 'WITHSCORES' options.
+        """
+        options = list(options)
+        upper = [option.upper() for option in options]
+
+        if b'LIMIT' in upper:
+            index = upper.index(b'LIMIT')
+            offset, count = toInt(options[index + 1]), toInt(options[index + 2])
+            items = items[offset:] if count < 0 else items[offset:offset + count]
+
+        if b'WITHSCORES' in upper:
+            return [item for member, score in items for item in (member, formatScore(score))]
+
+        return [member for member, _ in items]
+
+    def byIndex(self, items, start, stop, options):
+        start, stop = toInt(start), toInt(stop)
+        start = max(start + len(items) if start < 0 else start, 0)
+        stop = stop + len(items) if stop < 0 else stop
+
+        return self.rangeReply(items[start:stop + 1], [option for option in options if option.upper() != b'LIMIT'])
+
+    def zrange(self, client, key, start, stop, *options):
+        return self.byIndex((self.lookup(client, key, SortedSet) or SortedSet()).ordered(), start, stop, options)
+
+    def zrevrange(self, client, key, start, stop, *options):
+        return self.byIndex((self.lookup(client, key, SortedSet) or SortedSet()).ordered()[::-1], start, stop, options)
+
+    def byScore(self, client, key, minimum, maximum):
+        (low, lowExclusive), (high, highExclusive) = parseScoreBound(minimum), parseScoreBound(maximum)
+
+        return [
+            (member, score) for member, score in (self.lookup(client, key, SortedSet) or SortedSet()).ordered()
+            if (score > low if lowExclusive else score >= low) and (score < high if highExclusive else score <= high)
+        ]
+
+    def zrangebyscore(self, client, key, minimum, maximum, *options):
+        return self.rangeReply(self.byScore(client, key, minimum, maximum), options)
+
+    def zrevrangebyscore(self, client, key, maximum, minimum, *options):
+        return self.rangeReply(self.byScore(client, key, minimum, maximum)[::-1], options)
+
+    def zremrangebyscore(self, client, key, minimum, maximum):
+        return self.zrem(client, key, *[member for member, _ in self.byScore(client, key, minimum, maximum)]) if self.zcard(client, key) else 0
+
+    def storeCombination(self, client, destination, numkeys, arguments, combine):
+        """
+            Common part of ZUNIONSTORE / ZINTERSTORE: the sources can be sets (with a score of 1) or sorted sets, with the 'WEIGHTS' / 'AGGREGATE' options.
+        """
+        count = toInt(numkeys)
+        keys, options = arguments[:count], list(arguments[count:])
+        weights = [1.0] * count
+        aggregate = sum
+        index = 0
+
+        while index < len(options):
+            option = options[index].upper()
+
+            if option == b'WEIGHTS':
+                weights = [toFloat(weight) for weight in options[index + 1:index + 1 + count]]
+                index += 1 + count
+
+            elif option == b'AGGREGATE':
+                aggregate = {b'SUM': sum, b'MIN': min, b'MAX': max}[options[index + 1].upper()]
+                index += 2
+
+            else:
+                raise ReplyError('ERR syntax error')
+
+        sources = []
+
+        for key, weight in zip(keys, weights):
+            value = self.lookup(client, key)
+
+            if value is not None and type(value) not in (set, SortedSet):
+                raise ReplyError(WRONG_TYPE)
+
+            scores = dict.fromkeys(value, 1.0) if type(value) is set else (value or {})
+            sources.append({member: score * weight for member, score in scores.items()})
+
+        members = combine([set(source) for source in sources])
+        result = SortedSet({
+            member: aggregate(source[member] for source in sources if member in source) for member in members
+        })
+
+        self.remove(client, destination)
+
+        if result:
+            self.data(client)[destination] = result
+
+        return len(result)
+
+    def zunionstore(self, client, destination, numkeys, *arguments):
+        return self.storeCombination(client, destination, numkeys, arguments, lambda sets: set.union(*sets))
+
+    def zinterstore(self, client, destination, numkeys, *arguments):
+        return self.storeCombination(client, destination, numkeys, arguments, lambda sets: set.intersection(*sets))
+
+    def zrangebylex(self, client, key, minimum, maximum, *options):
+        (low, lowExclusive), (high, highExclusive) = parseLexBound(minimum), parseLexBound(maximum)
+        items = sorted((self.lookup(client, key, SortedSet) or SortedSet()).items())
+
+        items = [
+            (member, score) for member, score in items
+            if (minimum == b'-' or (member > low if lowExclusive else member >= low))
+            and (maximum == b'+' or (member < high if highExclusive else member <= high))
+        ]
+
+        return self.rangeReply(items, options)
+
+    # ---- pub/sub ----
+
+    def publish(self, client, channel, message):
+        out = bytearray()
+        encodeReply([b'message', channel, message], out)
+
+        for subscriber in self.subscribers[channel]:
+            subscriber.writer.write(out)
+
+        return len(self.subscribers[channel])
+
+    def subscribe(self, client, *channels):
+        replies = []
+
+        for channel in channels:
+            client.channels.add(channel)
+            self.subscribers[channel].add(client)
+            replies.append([b'subscribe', channel, len(client.channels)])
+
+        # the replies of every channel are sent one after the other (not as a single array)
+        out = bytearray()
+
+        for reply in replies[:-1]:
+            encodeReply(reply, out)
+
+        client.writer.write(out)
+        return replies[-1]
+
+    def unsubscribe(self, client, *channels):
+        for channel in channels or list(client.channels):
+            client.channels.discard(channel)
+            self.subscribers[channel].discard(client)
+
+        return [b'unsubscribe', channels[-1] if channels else None, len(client.channels)]
+
+    # ---- scripts ----
+
+    def script(self, client, subcommand, *arguments):
+        subcommand = subcommand.upper()
+
+        if subcommand == b'LOAD':
+            return self.loadScript(arguments[0])
+
+        if subcommand == b'EXISTS':
+            return [int(sha.lower() in self.scripts) for sha in arguments]
+
+        if subcommand == b'FLUSH':
+            self.scripts.clear()
+            self.compiledScripts.clear()
+            return OK
+
+        raise ReplyError('ERR unknown subcommand')
+
+    def loadScript(self, source):
+        sha = hashlib.sha1(source).hexdigest().encode()
+        self.scripts[sha] = source
+        return sha
+
+    def eval(self, client, source, keysCount, *arguments):
+        return self.runScript(client, self.loadScript(source), keysCount, arguments)
+
+    def evalsha(self, client, sha, keysCount, *arguments):
+        if sha.lower() not in self.scripts:
+            raise ReplyError('NOSCRIPT No matching script. Please use EVAL.')
+
+        return self.runScript(client, sha.lower(), keysCount, arguments)
+
+    def runScript(self, client, sha, keysCount, arguments):
+        """
+            Run a Lua script with the 'lupa' package. The scripts run atomically, since the commands are never interleaved.
+        """
+        if lupa is None:
+            raise ReplyError("ERR scripting isn't available (install the 'lupa' python package)")
+
+        if self.lua is None:
+            self.setupLua()
+
+        function = self.compiledScripts.get(sha)
+
+        if function is None:
+            try:
+                function = self.lua.execute(
+                    b'return function(KEYS, ARGV)\n' + self.scripts[sha] + b'\nend')
+
+            except lupa.LuaError as error:
+                raise ReplyError('ERR Error compiling script: {0}'.format(error))
+
+            self.compiledScripts[sha] = function
+
+        count = toInt(keysCount)
+        keys = self.lua.table_from(list(arguments[:count]))
+        argv = self.lua.table_from(list(arguments[count:]))
+        self.scriptClient = client
+
+        try:
+            return self.fromLua(function(keys, argv))
+
+        except lupa.LuaError as error:
+            raise ReplyError('ERR Error running script: {0}'.format(error))
+
+        finally:
+            self.scriptClient = None
+
+    def setupLua(self):
+        self.lua = lupa.LuaRuntime(encoding=None)
+        self.lua.execute(b'unpack = unpack or table.unpack')
+        redis = self.lua.table_from({
+            b'call': self.luaCall,
+            b'pcall': self.luaPcall,
+            b'replicate_commands': lambda: True,
+            b'status_reply': lambda message: self.lua.table_from({b'ok': message}),
+            b'error_reply': lambda message: self.lua.table_from({b'err': message}),
+        })
+        self.lua.globals()[b'redis'] = redis
+
+    def luaCall(self, *arguments):
+        reply = self.luaPcall(*arguments)
+
+        if isinstance(reply, ReplyError):
+            raise reply
+
+        return reply
+
+    def luaPcall(self, *arguments):
+        arguments = [self.toBytes(argument) for argument in arguments]
+        reply = self.execute(self.scriptClient, arguments)
+
+        if isinstance(reply, ReplyError):
+            return self.lua.table_from({b'err': str(reply).encode()})
+
+        return self.toLua(reply)
+
+    def toBytes(self, value):
+        if isinstance(value, bytes):
+            return value
+
+        if isinstance(value, float) and value.is_integer():
+            value = int(value)
+
+        return str(value).encode()
+
+    def toLua(self, reply):
+        """
+            Convert a reply into Lua values (same conversion rules as redis).
+        """
+        if isinstance(reply, Status):
+            return self.lua.table_from({b'ok': bytes(reply)})
+
+        if reply is None:
+            return False
+
+        if isinstance(reply, str):
+            return reply.encode()
+
+        if isinstance(reply, list):
+            return self.lua.table_from([self.toLua(item) for item in reply])
+
+        return reply
+
+    def fromLua(self, value):
+        """
+            Convert the value returned by a script into a reply (same conversion rules as redis).
+        """
+        if lupa.lua_type(value) == 'table':
+            if value[b'ok'] is not None:
+                return Status(value[b'ok'])
+
+            if value[b'err'] is not None:
+                return ReplyError(value[b'err'].decode())
+
+            items = []
+            index = 1
+
+            while value[index] is not None:
+                items.append(self.fromLua(value[index]))
+                index += 1
+
+            return items
+
+        if value is True:
+            return 1
+
+        if value is False or value is None:
+            return None
+
+        if isinstance(value, float):
+            return int(value)
+
+        return value
+
+
+async def serve(host, port, latency, jitter):
+    server = FakeRedis(latency, jitter)
+    listener = await asyncio.start_server(server.handleConnection, host, port)
+
+    print('Fake redis listening on {0}:{1} (latency: {2}ms, jitter: {3}ms, scripting: {4})'.format(
+        host, port, latency * 1000, jitter * 1000, 'yes' if lupa else "no, install 'lupa'"))
+
+    async with listener:
+        await listener.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='In-memory stand-in for the redis server.')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=6380)
+    parser.add_argument('--latency', type=float, default=0,
+                        help='Milliseconds added to every round trip.')
+    parser.add_argument('--jitter', type=float, default=0,
+                        help='Random variation of the latency (in milliseconds, up or down).')
+    args = parser.parse_args()
+
+    try:
+        asyncio.run(serve(args.host, args.port, args.latency / 1000, args.jitter / 1000))
+
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
@@ -6,6 +6,12 @@ from urllib.parse import urljoin
 import itertools
 import subprocess
 import os
+import sys
+import asyncio
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'Client'))
+from blog_client import BlogClient, AsyncBlogClient, BlogApiError
 
 URL = 'http://localhost:8000/'
 USERNAME_LOWER_LIMIT = 3
@@ -18,13 +24,37 @@ BODY_LOWER_LIMIT = 10
 BODY_UPPER_LIMIT = 10000
 DEVNULL = open(os.devnull, 'w')
 
+# the tests clear their data directly in redis (set 'REDIS_PORT' when using another port, for example with 'Tests/fake_redis.py')
+REDIS_CLI = ['redis-cli', '-p', os.environ.get('REDIS_PORT', '6379')]
+
+# every test process uses its own namespace, so several can run at the same time (the server needs to run with 'NAMESPACE_HEADER=1')
+NAMESPACE = 'test_{0}'.format(os.getpid())
+HEADERS = {'X-Namespace': NAMESPACE}
+
+# the requests of the tests reuse the same connections (without retrying the rejected ones, the tests check those)
+CLIENT = BlogClient(URL, namespace=NAMESPACE, retries=0)
+
+# remove all the keys of a namespace (the keys are prefixed by 'namespace:')
+DROP_NAMESPACE_SCRIPT = """
+redis.replicate_commands()
+local cursor = '0'
+repeat
+    local reply = redis.call('SCAN', cursor, 'MATCH', ARGV[1], 'COUNT', 1000)
+    cursor = reply[1]
+    if #reply[2] > 0 then
+        redis.call('UNLINK', unpack(reply[2]))
+    end
+until cursor == '0'
+"""
+
 
 class TestBlog(unittest.TestCase):
     def setUp(self):
         """
-            Clear the database before every test.
+            Clear the namespace of the tests before every test.
         """
-        subprocess.call(["redis-cli", "flushall"], stdout=DEVNULL)
+        subprocess.call(REDIS_CLI + ["eval", DROP_NAMESPACE_SCRIPT,
+                                     "0", NAMESPACE + ':*'], stdout=DEVNULL)
 
     def createUser(self, username='test', password='bbbbbb'):
         """
@@ -110,15 +140,7 @@ class TestBlog(unittest.TestCase):
             Make a GET request if 'data' is not passed.
             Otherwise do a POST request with the given 'data' dictionary.
         """
-        completeUrl = urljoin(URL, path)
-
-        if data is None:
-            r = requests.get(completeUrl)
-
-        else:
-            r = requests.post(completeUrl, data=data)
-
-        return json.loads(r.text)
+        return CLIENT.request(path, data)
 
     def missingArguments(self, url, arguments):
         """
@@ -231,11 +253,24 @@ class TestBlog(unittest.TestCase):
             'password': info['password']
         })
         self.assertEqual(response['success'], True)
+        self.assertEqual(response['removed_posts'], 1)
+        self.assertEqual(response['removed_tokens'], 1)
 
         response = self.makeRequest(
             '/blog/{0}/getall'.format(username))
         self.assertEqual(response['success'], False)
 
+        # the post and the token are gone as well
+        response = self.makeRequest('/blog/get/{0}'.format(post['post_id']))
+        self.assertEqual(response['success'], False)
+
+        response = self.makeRequest('/blog/add', {
+            'token': info['token'],
+            'title': 'The title.',
+            'body': 'The body message.'
+        })
+        self.assertEqual(response['success'], False)
+
     def test_user_change_password(self):
         url = '/user/change_password'
         info = self.createUser()
@@ -375,6 +410,31 @@ class TestBlog(unittest.TestCase):
         self.assertEqual(response['success'], True)
         self.assertEqual(len(response['users']), 1)
 
+        # get the users one page at a time (in alphabetical order)
+        self.createUser('test3')
+        self.createUser('test2')
+        response = self.makeRequest(url + '?limit=2')
+        self.assertEqual(response['success'], True)
+        self.assertEqual(response['users'], ['test1', 'test2'])
+        self.assertEqual(response['next_cursor'], 'test2')
+
+        response = self.makeRequest(
+            url + '?limit=2&cursor=' + response['next_cursor'])
+        self.assertEqual(response['success'], True)
+        self.assertEqual(response['users'], ['test3'])
+        self.assertEqual('next_cursor' in response, False)
+
+        # get all of them at once
+        response = self.makeRequest(url + '?all=1')
+        self.assertEqual(response['success'], True)
+        self.assertEqual(sorted(response['users']), [
+                         'test1', 'test2', 'test3'])
+
+        # invalid limit
+        response = self.makeRequest(url + '?limit=0')
+        self.assertEqual(response['success'], False)
+        self.assertEqual('message' in response, True)
+
     def test_user_random(self):
         url = '/user/random'
 
@@ -396,6 +456,252 @@ class TestBlog(unittest.TestCase):
         self.assertEqual(len(response['posts_ids']), 1)
         self.assertEqual(int(response['posts_ids'][0]), post['post_id'])
 
+        # several users at once (without repeating any)
+        self.createUser('test2')
+        response = self.makeRequest(url + '?count=5')
+        self.assertEqual(response['success'], True)
+        self.assertEqual(sorted(a['username'] for a in response['users']), [
+                         'test1', 'test2'])
+
+        # invalid count
+        response = self.makeRequest(url + '?count=0')
+        self.assertEqual(response['success'], False)
+        self.assertEqual('message' in response, True)
+
+    def test_blog_search(self):
+        url = '/blog/search?q={0}'
+
+        # missing query
+        response = self.makeRequest('/blog/search')
+        self.assertEqual(response['success'], False)
+        self.assertEqual('message' in response, True)
+
+        user = self.createUser()
+        post1 = self.makeRequest('/blog/add', {
+            'token': user['token'],
+            'title': 'Swift servers',
+            'body': 'Writing a web server in Swift.'
+        })
+        post2 = self.makeRequest('/blog/add', {
+            'token': user['token'],
+            'title': 'Redis tips',
+            'body': 'Using Redis from a Swift server.'
+        })
+
+        # ranked by the number of matched words, then by the most recent
+        response = self.makeRequest(url.format('SWIFT redis'))
+        self.assertEqual(response['success'], True)
+        self.assertEqual(response['total'], 2)
+        self.assertEqual([a['id'] for a in response['results']], [
+                         str(post2['post_id']), str(post1['post_id'])])
+        self.assertEqual(response['results'][0]['matches'], 2)
+        self.assertEqual(response['results'][0]['post']['title'], 'Redis tips')
+
+        # paginated
+        response = self.makeRequest(url.format('swift') + '&limit=1')
+        self.assertEqual(len(response['results']), 1)
+        self.assertEqual(response['next_offset'], 1)
+
+        # the index is updated when a post changes
+        self.makeRequest('/blog/update', {
+            'token': user['token'],
+            'blogId': post2['post_id'],
+            'title': 'Redis tips',
+            'body': 'Using Redis from anywhere.'
+        })
+        response = self.makeRequest(url.format('swift'))
+        self.assertEqual([a['id'] for a in response['results']], [
+                         str(post1['post_id'])])
+
+        # or removed
+        self.makeRequest('/blog/remove', {
+            'token': user['token'],
+            'blogId': post1['post_id']
+        })
+        response = self.makeRequest(url.format('swift'))
+        self.assertEqual(response['total'], 0)
+
+        # the temporary key of a search doesn't touch the index of the term 'results'
+        post3 = self.makeRequest('/blog/add', {
+            'token': user['token'],
+            'title': 'Search results',
+            'body': 'Ranking the results.'
+        })
+        self.makeRequest(url.format('ranking'))
+        response = self.makeRequest(url.format('results'))
+        self.assertEqual(response['total'], 1)
+        self.assertEqual(response['results'][0]['id'], str(post3['post_id']))
+
+    def test_stats(self):
+        url = '/stats'
+
+        # create a user and use its token twice (the second time should be found in the cache)
+        user = self.createUser()
+        self.addPost(user)
+        self.addPost(user)
+
+        response = self.makeRequest(url)
+        self.assertEqual(response['success'], True)
+
+        hashing = response['password_hashing']
+        self.assertEqual(hashing['completed'] >= 1, True)
+        self.assertEqual(hashing['queue_depth'], 0)
+        self.assertEqual('average_hash_ms' in hashing, True)
+
+        tokenCache = response['token_cache']
+        self.assertEqual(tokenCache['hits'] >= 1, True)
+        self.assertEqual(tokenCache['misses'] >= 1, True)
+
+        # the read replicas (if any) and how many reads each one answered
+        for replica in response['replicas']:
+            self.assertEqual('healthy' in replica, True)
+            self.assertEqual(replica['reads'] >= 0, True)
+
+    def test_rate_limit(self):
+        """
+            Only runs when the server was started with 'RATE_LIMIT=1'.
+        """
+        response = self.makeRequest('/stats')
+        limits = response['rate_limit']
+
+        if not limits['enabled']:
+            self.skipTest('rate limiting is not enabled')
+
+        # the login route is expensive, so the bucket of the user runs out after a few attempts
+        user = self.createUser()
+        attempts = limits['capacity'] // 20 + 1
+
+        for _ in range(attempts):
+            r = requests.post(urljoin(URL, '/user/login'), data={
+                'username': user['username'],
+                'password': 'wrong password'
+            }, headers=HEADERS)
+
+            if r.status_code == 429:
+                break
+
+        self.assertEqual(r.status_code, 429)
+        self.assertEqual(int(r.headers['Retry-After']) >= 1, True)
+        self.assertEqual(r.json()['success'], False)
+
+        response = self.makeRequest('/stats')
+        self.assertEqual(
+            response['rate_limit']['rejected']['/user/login'] >= 1, True)
+
+        # the failed logins from one address don't lock the user out in the others
+        if limits['trust_proxy']:
+            r = requests.post(urljoin(URL, '/user/login'), data={
+                'username': user['username'],
+                'password': user['password']
+            }, headers={**HEADERS, 'X-Forwarded-For': '10.1.2.3'})
+            self.assertEqual(r.status_code, 200)
+
+    def test_token_sweeper(self):
+        """
+            Only runs when the server was started with a short 'TOKEN_SWEEP_INTERVAL' (5 seconds at most).
+        """
+        sweeper = self.makeRequest('/stats')['token_sweeper']
+
+        if sweeper['interval'] > 5:
+            self.skipTest('the token sweeps are too far apart')
+
+        # an expired token, and a key that matches the pattern of the sweep but isn't a sorted set (the hash of a user named 'tokens_*')
+        user = self.createUser()
+        self.createUser('tokens_other')
+        key = '{0}:user_tokens_{1}'.format(NAMESPACE, user['username'])
+        subprocess.call(REDIS_CLI + ['zadd', key, '1', 'expired'], stdout=DEVNULL)
+
+        # wait for a whole sweep that started after the token was added
+        deadline = time.time() + sweeper['interval'] * 3 + 5
+
+        while self.makeRequest('/stats')['token_sweeper']['sweeps'] < sweeper['sweeps'] + 2:
+            self.assertEqual(time.time() < deadline, True)
+            time.sleep(0.5)
+
+        self.assertEqual(subprocess.check_output(
+            REDIS_CLI + ['zscore', key, 'expired']).strip(), b'')
+
+        # the valid token is still there
+        self.assertEqual(subprocess.check_output(
+            REDIS_CLI + ['zscore', key, user['token']]).strip() != b'', True)
+        self.addPost(user)
+
+    def test_metrics(self):
+        url = '/metrics'
+
+        self.makeRequest('/blog/get/1')
+        r = requests.get(urljoin(URL, url), headers=HEADERS)
+        self.assertEqual(r.status_code, 200)
+
+        # aggregated by the route template, not the actual path
+        self.assertIn(
+            'http_requests_total{method="GET",route="/blog/get/:blogId",status="404"}', r.text)
+        self.assertIn(
+            'http_request_duration_seconds_count{method="GET",route="/blog/get/:blogId"}', r.text)
+        self.assertIn('http_requests_in_flight', r.text)
+
+    def test_redis_trace(self):
+        """
+            Only runs when the server was started with 'REDIS_TRACE=1'.
+        """
+        user = self.createUser()
+        post = self.addPost(user)
+        r = requests.get(
+            urljoin(URL, '/blog/get/{0}'.format(post['post_id'])), headers=HEADERS)
+
+        if 'X-Redis-Round-Trips' not in r.headers:
+            self.skipTest('redis tracing is not enabled')
+
+        # the first time the post is read from the database (a single command), then it's in the cache
+        self.assertEqual(int(r.headers['X-Redis-Round-Trips']), 1)
+        self.assertEqual(int(r.headers['X-Redis-Bytes-Sent']) > 0, True)
+        self.assertEqual(int(r.headers['X-Redis-Bytes-Received']) > len(post['body']), True)
+
+        r = requests.get(
+            urljoin(URL, '/blog/get/{0}'.format(post['post_id'])), headers=HEADERS)
+        self.assertEqual(int(r.headers['X-Redis-Round-Trips']), 0)
+
+        # only the post that isn't in the cache is fetched (in a single pipeline)
+        r = requests.get(
+            urljoin(URL, '/blog/get_many?ids={0},1000'.format(post['post_id'])), headers=HEADERS)
+        self.assertEqual(int(r.headers['X-Redis-Round-Trips']), 1)
+        self.assertEqual(int(r.headers['X-Redis-Bytes-Sent']) > 0, True)
+        self.assertEqual(int(r.headers['X-Redis-Bytes-Received']) > 0, True)
+
+    def test_blog_compressed_body(self):
+        """
+            Long bodies are stored compressed, but that shouldn't be visible in the api.
+        """
+        user = self.createUser()
+        title = 'The title.'
+        body = 'A long body message, that repeats itself. ' * 200
+        response = self.makeRequest('/blog/add', {
+            'token': user['token'],
+            'title': title,
+            'body': body
+        })
+        postId = response['post_id']
+        key = '{0}:post_{1}'.format(NAMESPACE, postId)
+
+        self.assertEqual(subprocess.check_output(
+            REDIS_CLI + ['hget', key, 'body_format']).strip(), b'zlib')
+        self.postTest(postId, user['username'], title, body)
+
+        response = self.makeRequest('/blog/get_many?ids={0}'.format(postId))
+        self.assertEqual(response['posts'][str(postId)]['body'], body)
+        self.assertEqual('body_format' in response['posts'][str(postId)], False)
+
+        # an update with a short body is stored in plain text again
+        self.makeRequest('/blog/update', {
+            'token': user['token'],
+            'blogId': postId,
+            'title': title,
+            'body': 'The new body message.'
+        })
+        self.assertEqual(subprocess.check_output(
+            REDIS_CLI + ['hget', key, 'body_format']).strip(), b'')
+        self.postTest(postId, user['username'], title, 'The new body message.')
+
     def test_blog_add(self):
         url = '/blog/add'
         user = self.createUser()
@@ -430,6 +736,44 @@ class TestBlog(unittest.TestCase):
         # try to get it with the given ID, and compare the values
         self.postTest(response['post_id'], user['username'], title, body)
 
+    def test_blog_bulk_add(self):
+        url = '/blog/bulk_add'
+        user = self.createUser()
+
+        self.missingArguments(url, ['token', 'posts'])
+
+        # not a json array
+        response = self.makeRequest(url, {
+            'token': user['token'],
+            'posts': 'abc'
+        })
+        self.assertEqual(response['success'], False)
+        self.assertEqual('message' in response, True)
+
+        # the valid posts are added, and the invalid ones are reported
+        posts = [
+            {'title': 'The title 1.', 'body': 'The body message 1.'},
+            {'title': '1', 'body': 'The body message 2.'},
+            {'title': 'The title 3.'},
+            {'title': 'The title 4.', 'body': 'The body message 4.'}
+        ]
+        response = self.makeRequest(url, {
+            'token': user['token'],
+            'posts': json.dumps(posts)
+        })
+        self.assertEqual(response['success'], True)
+        self.assertEqual(response['added'], 2)
+
+        results = response['results']
+        self.assertEqual([a['success'] for a in results], [
+                         True, False, False, True])
+        self.assertEqual(results[3]['post_id'], results[0]['post_id'] + 1)
+
+        self.postTest(results[0]['post_id'], user['username'],
+                      posts[0]['title'], posts[0]['body'])
+        self.postTest(results[3]['post_id'], user['username'],
+                      posts[3]['title'], posts[3]['body'])
+
     def test_blog_get(self):
         url = '/blog/get/{0}'
 
@@ -449,6 +793,64 @@ class TestBlog(unittest.TestCase):
         self.postTest(post['post_id'], user['username'],
                       post['title'], post['body'])
 
+        # the post didn't change, so we get a '304 Not Modified' when sending its 'ETag'
+        completeUrl = urljoin(URL, url.format(post['post_id']))
+        r = requests.get(completeUrl, headers=HEADERS)
+        etag = r.headers['ETag']
+
+        r = requests.get(completeUrl, headers={**HEADERS, 'If-None-Match': etag})
+        self.assertEqual(r.status_code, 304)
+        self.assertEqual(r.text, '')
+
+        # also with a list of tags, a weak tag, or '*'
+        for header in ('"abc", {0}'.format(etag), 'W/{0}'.format(etag), '*'):
+            r = requests.get(completeUrl, headers={**HEADERS, 'If-None-Match': header})
+            self.assertEqual(r.status_code, 304)
+
+        # after an update, the 'ETag' is different
+        self.makeRequest('/blog/update', {
+            'token': user['token'],
+            'blogId': post['post_id'],
+            'title': 'The new title!',
+            'body': post['body']
+        })
+        r = requests.get(completeUrl, headers={**HEADERS, 'If-None-Match': etag})
+        self.assertEqual(r.status_code, 200)
+        self.assertNotEqual(r.headers['ETag'], etag)
+        self.assertEqual(json.loads(r.text)['post']['title'], 'The new title!')
+
+    def test_blog_get_many(self):
+        url = '/blog/get_many'
+
+        self.missingArguments(url, ['ids'])
+
+        # not a list of numbers
+        response = self.makeRequest(url + '?ids=1,a')
+        self.assertEqual(response['success'], False)
+        self.assertEqual('message' in response, True)
+
+        # too many ids
+        response = self.makeRequest(
+            url + '?ids=' + ','.join(str(a) for a in range(101)))
+        self.assertEqual(response['success'], False)
+        self.assertEqual('message' in response, True)
+
+        # correct usage, with one of the ids missing
+        user = self.createUser()
+        post1 = self.addPost(user)
+        post2 = self.addPost(user)
+        ids = '{0},{1},1000'.format(post1['post_id'], post2['post_id'])
+
+        for response in [self.makeRequest(url + '?ids=' + ids), self.makeRequest(url, {'ids': ids})]:
+            self.assertEqual(response['success'], True)
+            self.assertEqual(len(response['posts']), 2)
+            self.assertEqual(response['missing'], ['1000'])
+
+            post = response['posts'][str(post1['post_id'])]
+            self.assertEqual(post['title'], post1['title'])
+            self.assertEqual(post['body'], post1['body'])
+            self.assertEqual(post['author'], user['username'])
+
     def test_blog_remove(self):
         url = 'blog/remove'
         user1 = self.createUser('test1')
@@ -578,6 +980,71 @@ class TestBlog(unittest.TestCase):
         self.assertEqual(len(response['posts_ids']), 1)
         self.assertEqual(int(response['posts_ids'][0]), post['post_id'])
 
+    def test_blog_feed(self):
+        url = '/blog/feed'
+
+        # no posts yet
+        response = self.makeRequest(url)
+        self.assertEqual(response['success'], True)
+        self.assertEqual(len(response['posts']), 0)
+
+        user1 = self.createUser('test1')
+        user2 = self.createUser('test2')
+        post1 = self.addPost(user1)
+        post2 = self.addPost(user2)
+        post3 = self.addPost(user1)
+
+        # newest first, with the contents of the posts
+        response = self.makeRequest(url)
+        self.assertEqual([int(a['id']) for a in response['posts']], [
+                         post3['post_id'], post2['post_id'], post1['post_id']])
+        self.assertEqual(response['posts'][0]['post']['title'], post3['title'])
+        self.assertEqual(response['posts'][0]['post']['author'], 'test1')
+
+        # one page at a time
+        response = self.makeRequest(url + '?limit=2')
+        self.assertEqual(len(response['posts']), 2)
+        response = self.makeRequest(
+            url + '?limit=2&before=' + response['next_before'])
+        self.assertEqual([int(a['id']) for a in response['posts']], [
+                         post1['post_id']])
+        self.assertEqual('next_before' in response, False)
+
+        # an updated post moves to the top
+        self.makeRequest('/blog/update', {
+            'token': user1['token'],
+            'blogId': post1['post_id'],
+            'title': 'The new title.',
+            'body': 'The new body message.'
+        })
+        response = self.makeRequest(url + '?limit=1')
+        self.assertEqual(int(response['posts'][0]['id']), post1['post_id'])
+
+        # only the posts of one user
+        response = self.makeRequest('/blog/test1/feed')
+        self.assertEqual([int(a['id']) for a in response['posts']], [
+                         post1['post_id'], post3['post_id']])
+
+        # removed posts are no longer in the feeds
+        self.makeRequest('/blog/remove', {
+            'token': user1['token'],
+            'blogId': post1['post_id']
+        })
+        response = self.makeRequest('/blog/test1/feed')
+        self.assertEqual([int(a['id']) for a in response['posts']], [
+                         post3['post_id']])
+
+        # invalid arguments
+        response = self.makeRequest(url + '?before=abc')
+        self.assertEqual(response['success'], False)
+
+        for before in ('nan', 'inf', '-inf'):
+            r = requests.get(urljoin(URL, url + '?before=' + before), headers=HEADERS)
+            self.assertEqual(r.status_code, 400)
+
+        response = self.makeRequest(url + '?limit=101')
+        self.assertEqual(response['success'], False)
+
     def test_blog_random(self):
         url = '/blog/random'
 
@@ -595,6 +1062,69 @@ class TestBlog(unittest.TestCase):
         self.assertEqual(response['post']['body'], post['body'])
         self.assertEqual(response['post']['author'], user['username'])
 
+        # several posts at once (without repeating any)
+        post2 = self.addPost(user)
+        response = self.makeRequest(url + '?count=5')
+        self.assertEqual(response['success'], True)
+        self.assertEqual(sorted(int(a['id']) for a in response['posts']), [
+                         post['post_id'], post2['post_id']])
+
+        # invalid count
+        response = self.makeRequest(url + '?count=101')
+        self.assertEqual(response['success'], False)
+        self.assertEqual('message' in response, True)
+
+    def test_client(self):
+        user = self.createUser()
+        client = BlogClient(URL, user['username'], user['password'], namespace=NAMESPACE)
+
+        # logs in on the first request that needs a token
+        postId = client.addPost('The title.', 'The body message.')
+        self.postTest(postId, user['username'], 'The title.', 'The body message.')
+
+        # logs in again after the token is invalidated
+        self.makeRequest('/user/invalidate_tokens', {
+            'username': user['username'],
+            'password': user['password']
+        })
+        client.updatePost(postId, 'The new title.', 'The body message.')
+        self.assertEqual(client.getPost(postId)['title'], 'The new title.')
+
+        # get several posts concurrently, the missing ones aren't included
+        otherId = client.addPost('Another title.', 'Another body message.')
+        posts = client.getPosts([postId, otherId, 1000], concurrency=2)
+        self.assertEqual(sorted(posts.keys()), sorted([postId, otherId]))
+        self.assertEqual(posts[otherId]['title'], 'Another title.')
+        self.assertEqual(client.getPost(1000), None)
+
+        # the listings are followed through all the pages
+        self.assertEqual(sorted(int(a) for a in client.iterPostIds(limit=1)), sorted([postId, otherId]))
+
+        with self.assertRaises(BlogApiError) as context:
+            client.removePost(1000)
+
+        self.assertEqual(context.exception.status, 404)
+        client.close()
+
+    def test_async_client(self):
+        try:
+            import aiohttp
+
+        except ImportError:
+            self.skipTest("the async client needs the 'aiohttp' package")
+
+        user = self.createUser()
+
+        async def run():
+            async with AsyncBlogClient(URL, user['username'], user['password'], namespace=NAMESPACE) as client:
+                ids = [await client.addPost('The title {0}.'.format(a), 'The body message.') for a in range(5)]
+                posts = await client.getPosts(ids + [1000], concurrency=2)
+
+                self.assertEqual(sorted(posts.keys()), sorted(ids))
+                self.assertEqual(posts[ids[3]]['title'], 'The title 3.')
+
+        asyncio.run(run())
+
     def test_blog_getall(self):
         url = '/blog/getall'
 
@@ -616,6 +1146,31 @@ class TestBlog(unittest.TestCase):
         self.assertEqual(response['success'], True)
         self.assertEqual(len(response['posts_ids']), 2)
 
+        # get the posts one page at a time (ordered by id)
+        post3 = self.addPost(user)
+        response = self.makeRequest(url + '?limit=2')
+        self.assertEqual(response['success'], True)
+        self.assertEqual([int(a) for a in response['posts_ids']], [
+                         post1['post_id'], post2['post_id']])
+
+        response = self.makeRequest(
+            url + '?limit=2&cursor=' + response['next_cursor'])
+        self.assertEqual(response['success'], True)
+        self.assertEqual([int(a) for a in response['posts_ids']], [
+                         post3['post_id']])
+        self.assertEqual('next_cursor' in response, False)
+
+        # get all of them at once
+        response = self.makeRequest(url + '?all=1')
+        self.assertEqual(response['success'], True)
+        self.assertEqual(sorted(int(a) for a in response['posts_ids']), [
+                         post1['post_id'], post2['post_id'], post3['post_id']])
+
+        # invalid cursor
+        response = self.makeRequest(url + '?cursor=abc')
+        self.assertEqual(response['success'], False)
+        self.assertEqual('message' in response, True)
+
 
 if __name__ == '__main__':
     unittest.main()